@@ -0,0 +1,60 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import cherrypy
+from wok.control.base import Resource
+from wok.control.utils import UrlSubNode
+
+
+@UrlSubNode('debug', True)
+class Debug(Resource):
+    def __init__(self, model, id=None):
+        super(Debug, self).__init__(model, id)
+        self.admin_methods = ['GET']
+        self.uri_fmt = '/debug/%s'
+        self.libvirt = LibvirtDebug(self.model)
+
+    @property
+    def data(self):
+        return self.info
+
+
+class LibvirtDebug(Resource):
+    def __init__(self, model, id=None):
+        super(LibvirtDebug, self).__init__(model, id)
+        self.admin_methods = ['GET', 'POST']
+        self.uri_fmt = '/debug/libvirt/%s'
+        self.reset = self.generate_action_handler('reset')
+        self.metrics = LibvirtMetrics(self.model)
+
+    @property
+    def data(self):
+        return self.info
+
+
+class LibvirtMetrics(Resource):
+    def __init__(self, model, id=None):
+        super(LibvirtMetrics, self).__init__(model, id)
+        self.admin_methods = ['GET']
+        self.uri_fmt = '/debug/libvirt/metrics/%s'
+
+    def get(self):
+        # Prometheus text exposition format
+        cherrypy.response.headers['Content-Type'] = (
+            'text/plain; version=0.0.4; charset=utf-8')
+        return self.model.libvirtdebug_prometheus().encode('utf-8')
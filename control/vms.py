@@ -16,9 +16,13 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import cherrypy
+from cherrypy.lib import cptools
+from cherrypy.lib import httputil
 from wok.control.base import AsyncCollection
 from wok.control.base import Resource
 from wok.control.utils import internal_redirect
+from wok.control.utils import model_fn
 from wok.control.utils import UrlSubNode
 from wok.plugins.kimchi.control.vm import sub_nodes
 
@@ -58,11 +62,27 @@ class VMs(AsyncCollection):
         self.log_map = VMS_REQUESTS
         self.log_args.update({'name': '', 'template': ''})
 
+    def _get_resources(self, flag_filter):
+        # With '_full' the description of all VMs is retrieved in a single
+        # pass instead of doing a lookup for each VM
+        if flag_filter.pop('_full', None) not in ['1', 'true']:
+            return super(VMs, self)._get_resources(flag_filter)
+
+        get_full_list = getattr(self.model, model_fn(self, 'get_full_list'))
+        res_list = []
+        for info in get_full_list(*self.model_args):
+            res = self.resource(self.model, info['name'])
+            res.info = info
+            res_list.append(res)
+
+        return res_list
+
 
 class VM(Resource):
     def __init__(self, model, ident):
         super(VM, self).__init__(model, ident)
         self.screenshot = VMScreenShot(model, ident)
+        self.stats = VMStats(model, ident)
         self.virtviewerfile = VMVirtViewerFile(model, ident)
         self.uri_fmt = '/vms/%s'
         for ident, node in sub_nodes.items():
@@ -75,7 +95,7 @@ class VM(Resource):
         self.reset = self.generate_action_handler('reset',
                                                   destructive=True)
         self.connect = self.generate_action_handler('connect')
-        self.clone = self.generate_action_handler_task('clone')
+        self.clone = self.generate_action_handler_task('clone', ['linked'])
         self.migrate = self.generate_action_handler_task('migrate',
                                                          ['remote_host',
                                                           'user',
@@ -100,8 +120,39 @@ class VMScreenShot(Resource):
 
     def get(self):
         self.lookup()
-        internal_uri = self.info.replace('plugins/kimchi', '')
-        raise internal_redirect(internal_uri)
+        get_image = getattr(self.model, model_fn(self, 'get_image'))
+        image = get_image(self.ident)
+        if image is None:
+            internal_uri = self.info.replace('plugins/kimchi', '')
+            raise internal_redirect(internal_uri)
+
+        # serve the thumbnail kept in memory, or 304 if the client has it
+        headers = cherrypy.response.headers
+        headers['Content-Type'] = 'image/png'
+        headers['ETag'] = '"%s"' % image['etag']
+        headers['Last-Modified'] = httputil.HTTPDate(image['mtime'])
+        cptools.validate_etags()
+        cptools.validate_since()
+        return image['data']
+
+
+class VMStats(Resource):
+    def __init__(self, model, ident):
+        super(VMStats, self).__init__(model, ident)
+        self.history = VMStatsHistory(model, ident)
+
+    @property
+    def data(self):
+        return self.info
+
+
+class VMStatsHistory(Resource):
+    def __init__(self, model, ident):
+        super(VMStatsHistory, self).__init__(model, ident)
+
+    @property
+    def data(self):
+        return self.info
 
 
 class VMVirtViewerFile(Resource):
@@ -18,6 +18,8 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import copy
+import json
 import os.path
 import re
 
@@ -25,112 +27,43 @@ from parted import Device as PDevice
 from parted import Disk as PDisk
 from wok.exception import NotFoundError
 from wok.exception import OperationFailed
-from wok.stringutils import encode_value
+from wok.plugins.kimchi.utils import TTLCache
 from wok.utils import run_command
 from wok.utils import wok_log
 
 
-def _get_dev_node_path(maj_min):
-    """ Returns device node path given the device number 'major:min' """
+# seconds during which the block devices listed by lsblk are reused
+BLOCK_DEVICES_TTL = 5
 
-    dm_name = '/sys/dev/block/%s/dm/name' % maj_min
-    if os.path.exists(dm_name):
-        with open(dm_name) as dm_f:
-            content = dm_f.read().rstrip('\n')
-        return '/dev/mapper/' + content
+# seconds during which the LVM report is reused
+LVM_REPORT_TTL = 5
 
-    uevent = '/sys/dev/block/%s/uevent' % maj_min
-    with open(uevent) as ueventf:
-        content = ueventf.read()
+# MBR partition types of the extended partitions
+EXTENDED_PARTITION_TYPES = (0x05, 0x0F, 0x85)
 
-    data = dict(re.findall(r'(\S+)=(".*?"|\S+)', content.replace('\n', ' ')))
 
-    return '/dev/%s' % data['DEVNAME']
-
-
-def _get_lsblk_devs(keys, devs=None):
-    if devs is None:
-        devs = []
-    out, err, returncode = run_command(
-        ['lsblk', '-Pbo'] + [','.join(keys)] + devs)
+def _get_lsblk_tree():
+    # -O lists all the columns known by the installed lsblk, so the columns
+    # missing from older versions do not make the command fail
+    out, err, returncode = run_command(['lsblk', '-J', '-b', '-O'])
     if returncode != 0:
-        if 'not a block device' in err:
-            raise NotFoundError('KCHDISK00002E')
-        else:
-            raise OperationFailed('KCHDISK00001E', {'err': err})
-
-    return _parse_lsblk_output(out, keys)
-
-
-def _get_dev_major_min(name):
-    maj_min = None
-
-    keys = ['NAME', 'MAJ:MIN']
-    try:
-        dev_list = _get_lsblk_devs(keys)
-    except Exception:
-        raise
-
-    for dev in dev_list:
-        if dev['name'].split()[0] == name:
-            maj_min = dev['maj:min']
-            break
-    else:
-        raise NotFoundError('KCHDISK00003E', {'device': name})
-
-    return maj_min
-
+        raise OperationFailed('KCHDISK00001E', {'err': err})
 
-def _is_dev_leaf(devNodePath, name=None, devs=None, devtype=None):
     try:
-        if devs and devtype != 'mpath':
-            for dev in devs:
-                if encode_value(name) == dev['pkname']:
-                    return False
-            return True
-        # By default, lsblk prints a device information followed by children
-        # device information
-        childrenCount = len(_get_lsblk_devs(['NAME'], [devNodePath])) - 1
-    except OperationFailed as e:
-        # lsblk is known to fail on multipath devices
-        # Assume these devices contain children
-        wok_log.error('Error getting device info for %s: %s', devNodePath, e)
-        return False
-
-    return childrenCount == 0
-
-
-def _is_dev_extended_partition(devType, devNodePath):
-    if devType != 'part':
-        return False
+        return json.loads(out).get('blockdevices', [])
+    except ValueError as e:
+        raise OperationFailed('KCHDISK00001E', {'err': str(e)})
 
-    if devNodePath.startswith('/dev/mapper'):
-        try:
-            dev_maj_min = _get_dev_major_min(devNodePath.split('/')[-1])
-            parent_sys_path = '/sys/dev/block/' + dev_maj_min + '/slaves'
-            parent_dm_name = os.listdir(parent_sys_path)[0]
-            parent_maj_min = (
-                open(parent_sys_path + '/' + parent_dm_name + '/dev')
-                .readline()
-                .rstrip()
-            )
-            diskPath = _get_dev_node_path(parent_maj_min)
-        except Exception as e:
-            wok_log.error(
-                'Error dealing with dev mapper device: ' + devNodePath)
-            raise OperationFailed('KCHDISK00001E', {'err': e.message})
-    else:
-        diskPath = devNodePath.rstrip('0123456789')
 
+def _is_dev_extended_partition(devNodePath, diskPath):
     device = PDevice(diskPath)
     try:
         extended_part = PDisk(device).getExtendedPartition()
     except NotImplementedError as e:
         wok_log.warning(
-            'Error getting extended partition info for dev %s type %s: %s',
+            'Error getting extended partition info for dev %s: %s',
             devNodePath,
-            devType,
-            e.message,
+            e,
         )
         # Treate disk with unsupported partiton table as if it does not
         # contain extended partitions.
@@ -140,57 +73,156 @@ def _is_dev_extended_partition(devType, devNodePath):
     return False
 
 
-def _parse_lsblk_output(output, keys):
-    # output is on format key="value",
-    # where key can be NAME, TYPE, FSTYPE, SIZE, MOUNTPOINT, etc
-    lines = output.rstrip('\n').split('\n')
-    r = []
-    for line in lines:
-        d = {}
-        for key in keys:
-            expression = r"%s=\".*?\"" % key
-            match = re.search(expression, line)
-            field = match.group()
-            k, v = field.split('=', 1)
-            d[k.lower()] = v[1:-1]
-        r.append(d)
-    return r
-
-
-def _is_available(name, devtype, fstype, mountpoint, majmin, devs=None):
-    devNodePath = _get_dev_node_path(majmin)
-    # Only list unmounted and unformated and leaf and (partition or disk)
-    # leaf means a partition, a disk has no partition, or a disk not held
-    # by any multipath device. Physical volume belongs to no volume group
-    # is also listed. Extended partitions should not be listed.
-    if fstype == 'LVM2_member':
-        has_VG = True
-    else:
-        has_VG = False
-    if (
-        devtype in ['part', 'disk', 'mpath'] and
-        fstype in ['', 'LVM2_member'] and
-        mountpoint == '' and
-        not has_VG and
-        _is_dev_leaf(devNodePath, name, devs, devtype) and
-        not _is_dev_extended_partition(devtype, devNodePath)
-    ):
-        return True
-    return False
+class BlockDevices(object):
+    """
+    Graph of the block devices of the host, built from a single
+    "lsblk -J -b -O" output. A device is listed by lsblk under each of its
+    parents, so the same device may appear several times in the output (for
+    example a multipath device under each of its paths) but it has a single
+    node in the graph.
+
+    Each node has the lsblk fields used by Kimchi plus the names of its
+    parents and of its children, which are its partitions and the devices
+    holding it (device mapper, multipath, RAID).
+    """
+
+    def __init__(self, tree):
+        # key: device name; value: node dict
+        self.devices = {}
+        # key: device node path; value: device name
+        self._paths = {}
+        for dev in tree:
+            self._add(dev, None)
+
+    @staticmethod
+    def _field(dev, key):
+        # lsblk uses null for empty fields and, depending on its version,
+        # strings or numbers for the numeric ones
+        value = dev.get(key)
+        return '' if value is None else str(value)
+
+    def _add(self, dev, parent):
+        name = self._field(dev, 'name')
+        node = self.devices.get(name)
+        if node is None:
+            kname = self._field(dev, 'kname') or name
+            path = self._field(dev, 'path')
+            if not path:
+                # lsblk < 2.33 does not list the device node path
+                if kname.startswith('dm-'):
+                    path = '/dev/mapper/' + name
+                else:
+                    path = '/dev/' + kname
+
+            mountpoint = dev.get('mountpoint')
+            if mountpoint is None:
+                # lsblk >= 2.37 lists all the mountpoints of the device
+                mountpoints = [m for m in dev.get('mountpoints') or [] if m]
+                mountpoint = mountpoints[0] if mountpoints else ''
+
+            node = self.devices[name] = {
+                'name': name,
+                'path': path,
+                'type': self._field(dev, 'type'),
+                'fstype': self._field(dev, 'fstype'),
+                'size': self._field(dev, 'size'),
+                'mountpoint': mountpoint,
+                'maj:min': self._field(dev, 'maj:min'),
+                'pkname': self._field(dev, 'pkname'),
+                'parttype': dev.get('parttype'),
+                'parents': [],
+                'children': [],
+            }
+            self._paths[path] = name
+
+        if parent is not None:
+            if parent['name'] not in node['parents']:
+                node['parents'].append(parent['name'])
+            if name not in parent['children']:
+                parent['children'].append(name)
+
+        for child in dev.get('children', []):
+            self._add(child, node)
+
+    def find(self, name_or_path):
+        """
+        Return the node of the device named <name_or_path> or whose device
+        node is <name_or_path>, or None when not found.
+        """
+        if name_or_path in self.devices:
+            return self.devices[name_or_path]
+
+        name = self._paths.get(os.path.realpath(name_or_path))
+        if name is None:
+            name = self._paths.get(name_or_path)
+        return self.devices.get(name)
+
+    def is_available(self, dev):
+        # Only list unmounted and unformated and leaf and (partition or disk)
+        # leaf means a partition, a disk has no partition, or a disk not held
+        # by any multipath device. Physical volume belongs to no volume group
+        # is also listed. Extended partitions should not be listed.
+        if dev['fstype'] == 'LVM2_member':
+            has_VG = True
+        else:
+            has_VG = False
+        if (
+            dev['type'] in ['part', 'disk', 'mpath'] and
+            dev['fstype'] in ['', 'LVM2_member'] and
+            dev['mountpoint'] == '' and
+            not has_VG and
+            not dev['children'] and
+            not self._is_extended_partition(dev)
+        ):
+            return True
+        return False
+
+    def _is_extended_partition(self, dev):
+        if dev['type'] != 'part':
+            return False
+
+        parttype = dev['parttype']
+        if parttype is not None:
+            # GPT partition types are UUIDs and are never extended
+            try:
+                return int(parttype, 16) in EXTENDED_PARTITION_TYPES
+            except ValueError:
+                return False
+
+        # lsblk < 2.25 does not list the partition type
+        for parent in dev['parents']:
+            diskPath = self.devices[parent]['path']
+            return _is_dev_extended_partition(dev['path'], diskPath)
+        return False
+
+
+_block_devices = TTLCache(
+    lambda: BlockDevices(_get_lsblk_tree()), BLOCK_DEVICES_TTL)
+
+
+def invalidate_block_devices():
+    """Read the block devices again on next access, as they were changed"""
+    _block_devices.invalidate()
+
+
+def find_block_device(name_or_path):
+    """
+    Return the lsblk fields of the block device <name_or_path>, or None when
+    it does not exist. The devices are read again before giving up, so a
+    device just attached to the host is found.
+    """
+    dev = _block_devices.get().find(name_or_path)
+    if dev is None:
+        dev = _block_devices.get(refresh=True).find(name_or_path)
+    # the parents and children lists are shared with the cache
+    return None if dev is None else copy.deepcopy(dev)
 
 
 def get_partitions_names(check=False):
+    devices = _block_devices.get()
     names = set()
-    keys = ['NAME', 'TYPE', 'FSTYPE', 'MOUNTPOINT', 'MAJ:MIN']
-    # output is on format key="value",
-    # where key can be NAME, TYPE, FSTYPE, MOUNTPOINT
-    for dev in _get_lsblk_devs(keys):
-        # split()[0] to avoid the second part of the name, after the
-        # whiteline
-        name = dev['name'].split()[0]
-        if check and not _is_available(
-            name, dev['type'], dev['fstype'], dev['mountpoint'], dev['maj:min']
-        ):
+    for name, dev in devices.devices.items():
+        if check and not devices.is_available(dev):
             continue
         names.add(name)
 
@@ -198,62 +230,147 @@ def get_partitions_names(check=False):
 
 
 def get_partition_details(name):
-    majmin = _get_dev_major_min(name)
-    dev_path = _get_dev_node_path(majmin)
-
-    keys = ['TYPE', 'FSTYPE', 'SIZE', 'MOUNTPOINT', 'MAJ:MIN', 'PKNAME']
-    try:
-        dev = _get_lsblk_devs(keys, [dev_path])[0]
-    except Exception:
-        wok_log.error('Error getting partition info for %s', name)
-        return {}
-
-    dev['available'] = _is_available(
-        name, dev['type'], dev['fstype'], dev['mountpoint'], majmin
-    )
-    if dev['mountpoint']:
+    devices = _block_devices.get()
+    dev = devices.find(name)
+    if dev is None:
+        devices = _block_devices.get(refresh=True)
+        dev = devices.find(name)
+        if dev is None:
+            raise NotFoundError('KCHDISK00003E', {'device': name})
+
+    keys = ['path', 'type', 'fstype', 'size', 'mountpoint', 'maj:min',
+            'pkname']
+    details = dict((key, dev[key]) for key in keys)
+    details['available'] = devices.is_available(dev)
+    if details['mountpoint']:
         # Sometimes the mountpoint comes with [SWAP] or other
         # info which is not an actual mount point. Filtering it
         regexp = re.compile(r'\[.*\]')
-        if regexp.search(dev['mountpoint']) is not None:
-            dev['mountpoint'] = ''
-    dev['path'] = dev_path
-    dev['name'] = name
-    return dev
+        if regexp.search(details['mountpoint']) is not None:
+            details['mountpoint'] = ''
+    details['name'] = name
+    return details
 
 
-def vgs():
+class LVMReport(object):
     """
-    lists all volume groups in the system. All size units are in bytes.
-
-    [{'vgname': 'vgtest', 'size': 999653638144L, 'free': 0}]
+    Volume groups, logical volumes and physical volumes of the host, indexed
+    by volume group, built from a single "lvm fullreport" output. All sizes
+    are in bytes.
     """
+
+    def __init__(self, report):
+        # key: VG name; value: dict with the VG size, free space, PVs and LVs
+        self.vgs = {}
+        self.lvs = []
+        self.pvs = []
+        # each item describes a VG, or the PVs belonging to no VG
+        for item in report:
+            vgname = ''
+            for vg in item.get('vg', []):
+                vgname = vg['vg_name']
+                self.vgs[vgname] = {
+                    'vgname': vgname,
+                    'size': int(vg['vg_size']),
+                    'free': int(vg['vg_free']),
+                    'pvs': [],
+                    'lvs': [],
+                }
+
+            for lv in item.get('lv', []):
+                # hidden LVs, like the metadata of thin pools, are not listed
+                # by lvs
+                if lv['lv_name'].startswith('['):
+                    continue
+                lv = {
+                    'lvname': lv['lv_name'],
+                    'path': lv['lv_path'],
+                    'size': int(lv['lv_size']),
+                    'vgname': vgname,
+                }
+                self.lvs.append(lv)
+                if vgname:
+                    self.vgs[vgname]['lvs'].append(lv)
+
+            for pv in item.get('pv', []):
+                pv = {
+                    'pvname': pv['pv_name'],
+                    'size': int(pv['pv_size']),
+                    'uuid': pv['pv_uuid'],
+                    'vgname': vgname,
+                }
+                self.pvs.append(pv)
+                if vgname:
+                    self.vgs[vgname]['pvs'].append(pv)
+
+
+def _get_lvm_report():
     cmd = [
-        'vgs',
+        'lvm',
+        'fullreport',
+        '--reportformat',
+        'json',
         '--units',
         'b',
         '--nosuffix',
-        '--noheading',
-        '--unbuffered',
+        '--configreport',
+        'vg',
         '--options',
         'vg_name,vg_size,vg_free',
+        '--configreport',
+        'lv',
+        '--options',
+        'lv_name,lv_path,lv_size',
+        '--configreport',
+        'pv',
+        '--options',
+        'pv_name,pv_size,pv_uuid',
     ]
 
     out, err, rc = run_command(cmd)
     if rc != 0:
         raise OperationFailed('KCHDISK00004E', {'err': err})
 
-    if not out:
-        return []
+    try:
+        return json.loads(out).get('report', [])
+    except ValueError as e:
+        raise OperationFailed('KCHDISK00004E', {'err': str(e)})
+
+
+_lvm = TTLCache(lambda: LVMReport(_get_lvm_report()), LVM_REPORT_TTL)
 
-    # remove blank spaces and create a list of VGs
-    vgs = map(lambda v: v.strip(), out.strip('\n').split('\n'))
 
-    # create a dict based on data retrieved from vgs
-    return map(
-        lambda l: {'vgname': l[0], 'size': int(l[1]), 'free': int(l[2])},
-        [fields.split() for fields in vgs],
-    )
+def invalidate_lvm():
+    """Read the LVM report again on next access, as LVM was changed"""
+    _lvm.invalidate()
+
+
+def get_vg(vgname):
+    """
+    Return the volume group <vgname> with its PVs and LVs, or None when it
+    does not exist. The report is read again before giving up, so a volume
+    group just created is found.
+
+    {'vgname': 'vgtest', 'size': 999653638144, 'free': 0,
+     'pvs': [{'pvname': '/dev/sda3', ...}],
+     'lvs': [{'lvname': 'lva', 'path': '/dev/vgtest/lva', ...}]}
+    """
+    vg = _lvm.get().vgs.get(vgname)
+    if vg is None:
+        vg = _lvm.get(refresh=True).vgs.get(vgname)
+    return vg
+
+
+def vgs():
+    """
+    lists all volume groups in the system. All size units are in bytes.
+
+    [{'vgname': 'vgtest', 'size': 999653638144L, 'free': 0}]
+    """
+    return [
+        {'vgname': vg['vgname'], 'size': vg['size'], 'free': vg['free']}
+        for vg in _lvm.get().vgs.values()
+    ]
 
 
 def lvs(vgname=None):
@@ -264,37 +381,12 @@ def lvs(vgname=None):
     [{'lvname': 'lva', 'path': '/dev/vgtest/lva', 'size': 12345L},
      {'lvname': 'lvb', 'path': '/dev/vgtest/lvb', 'size': 12345L}]
     """
-    cmd = [
-        'lvs',
-        '--units',
-        'b',
-        '--nosuffix',
-        '--noheading',
-        '--unbuffered',
-        '--options',
-        'lv_name,lv_path,lv_size,vg_name',
+    return [
+        {'lvname': lv['lvname'], 'path': lv['path'], 'size': lv['size']}
+        for lv in _lvm.get().lvs
+        if vgname is None or lv['vgname'] == vgname
     ]
 
-    out, err, rc = run_command(cmd)
-    if rc != 0:
-        raise OperationFailed('KCHDISK00004E', {'err': err})
-
-    if not out:
-        return []
-
-    # remove blank spaces and create a list of LVs filtered by vgname, if
-    # provided
-    lvs = filter(
-        lambda f: vgname is None or vgname in f,
-        map(lambda v: v.strip(), out.strip('\n').split('\n')),
-    )
-
-    # create a dict based on data retrieved from lvs
-    return map(
-        lambda l: {'lvname': l[0], 'path': l[1], 'size': int(l[2])},
-        [fields.split() for fields in lvs],
-    )
-
 
 def pvs(vgname=None):
     """
@@ -308,33 +400,8 @@ def pvs(vgname=None):
       'size': 21470642176L,
       'uuid': 'CyBzhK-cQFl-gWqr-fyWC-A50Y-LMxu-iHiJq4'}]
     """
-    cmd = [
-        'pvs',
-        '--units',
-        'b',
-        '--nosuffix',
-        '--noheading',
-        '--unbuffered',
-        '--options',
-        'pv_name,pv_size,pv_uuid,vg_name',
+    return [
+        {'pvname': pv['pvname'], 'size': pv['size'], 'uuid': pv['uuid']}
+        for pv in _lvm.get().pvs
+        if vgname is None or pv['vgname'] == vgname
     ]
-
-    out, err, rc = run_command(cmd)
-    if rc != 0:
-        raise OperationFailed('KCHDISK00004E', {'err': err})
-
-    if not out:
-        return []
-
-    # remove blank spaces and create a list of PVs filtered by vgname, if
-    # provided
-    pvs = filter(
-        lambda f: vgname is None or vgname in f,
-        map(lambda v: v.strip(), out.strip('\n').split('\n')),
-    )
-
-    # create a dict based on data retrieved from pvs
-    return map(
-        lambda l: {'pvname': l[0], 'size': int(l[1]), 'uuid': l[2]},
-        [fields.split() for fields in pvs],
-    )
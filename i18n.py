@@ -146,6 +146,13 @@ messages = {
     'KCHVM0089E': _('Unable to setup password-less login at remote host %(host)s using user %(user)s: remote directory %(sshdir)s does not exist.'),
     'KCHVM0090E': _('Unable to create a password-less libvirt connection to the remote libvirt daemon at host %(host)s with the user %(user)s. Please verify the remote server libvirt configuration. More information: http://libvirt.org/auth.html .'),
     'KCHVM0091E': _("'enable_rdma' must be of type boolean (true or false)."),
+    'KCHVM0092E': _("'linked' must be of type boolean (true or false)."),
+    'KCHVM0093E': _("'count' must be an integer between 1 and 256."),
+    'KCHVM0094E': _("'name_prefix' must be a non-empty string without slashes."),
+    'KCHVM0095E': _("'name' cannot be used to create several virtual machines at once. Use 'name_prefix' instead."),
+    'KCHVM0096E': _('Unable to create virtual machines %(names)s. Details: %(err)s'),
+    'KCHVM0097E': _('Unable to delete virtual machine %(name)s as its disks are the base images of the linked clones %(clones)s. Delete the linked clones first.'),
+    'KCHVM0098E': _('Unable to start virtual machine %(name)s as its disks are the base images of the linked clones %(clones)s, which would be corrupted by any change to them.'),
 
     'KCHVMHDEV0001E': _('VM %(vmid)s does not contain directly assigned host device %(dev_name)s.'),
     'KCHVMHDEV0002E': _('The host device %(dev_name)s is not allowed to directly assign to VM.'),
@@ -17,7 +17,7 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 import contextlib
-import glob
+import fnmatch
 import os
 import platform
 import re
@@ -25,13 +25,24 @@ import stat
 import struct
 import sys
 import urllib
+from http.client import HTTPConnection
+from http.client import HTTPException
+from http.client import HTTPSConnection
+from multiprocessing.pool import ThreadPool
 
 from wok.exception import IsoFormatError
 from wok.exception import OperationFailed
 from wok.plugins.kimchi.utils import check_url_path
+from wok.plugins.kimchi.utils import FileCache
 from wok.utils import wok_log
 
 
+# number of ISO files read in parallel by a directory scan
+SCAN_WORKERS = 8
+
+# number of ISO files whose probe results are kept in memory
+PROBE_CACHE_SIZE = 1024
+
 iso_dir = [
     ##
     # Portions of this data from libosinfo: http://libosinfo.org/
@@ -166,6 +177,13 @@ iso_dir = [
     ('arch', lambda m: m.group(1), 'ARCH_(\\d+)'),
 ]
 
+# iso_dir with the regular expressions compiled once, in the same order
+iso_matchers = [(d, v, re.compile(regex)) for d, v, regex in iso_dir]
+
+# matches any Volume ID known by iso_dir, so unknown images are detected
+# with a single search
+iso_any_matcher = re.compile('|'.join(f'(?:{regex})' for d, v, regex in iso_dir))
+
 
 class IsoImage(object):
     """
@@ -189,12 +207,21 @@ class IsoImage(object):
     # First int is path table size, next 4 bytes are discarded (it is
     # the same info but in big endian) and next int is the location.
     PATH_TABLE_SIZE_LOC = struct.Struct('<I 4s I')
+    # Bytes read at once from the start of the image, covering the Volume
+    # Descriptor Set. The other reads are served from this buffer whenever
+    # possible, so most images are probed with a single read.
+    HEADER_SIZE = 32 * SECTOR_SIZE
 
     def __init__(self, path):
         self.path = path
         self.remote = self._is_iso_remote()
         self.volume_id = None
         self.bootable = False
+        # (offset, data) of the header read
+        self._buffer = None
+        # file or keep-alive HTTP connection used by all the reads of a scan
+        self._fd = None
+        self._http = None
         self._scan()
 
     def _is_iso_remote(self):
@@ -214,7 +241,12 @@ class IsoImage(object):
 
         matcher = Matcher(self.volume_id)
 
-        for d, v, regex in iso_dir:
+        if not matcher.search(iso_any_matcher):
+            iso_list = []
+        else:
+            iso_list = iso_matchers
+
+        for d, v, regex in iso_list:
             if matcher.search(regex):
                 distro = d
                 if hasattr(v, '__call__'):
@@ -477,36 +509,84 @@ lang=en#!/wiki/W51a7ffcf4dfd_4b40_9d82_446ebc23c550/page/PowerLinux\
         return data[190:318]
 
     def _get_iso_data(self, offset, size):
+        if self._buffer is not None:
+            buffer_offset, buffer_data = self._buffer
+            start = offset - buffer_offset
+            if start >= 0 and start + size <= len(buffer_data):
+                return buffer_data[start: start + size]
+
         if self.remote:
+            return self._get_remote_iso_data(offset, size)
+
+        if self._fd is None:
+            self._fd = open(self.path, 'rb')
+        self._fd.seek(offset)
+        return self._fd.read(size)
+
+    def _get_remote_iso_data(self, offset, size):
+        range_header = 'bytes=%d-%d' % (offset, offset + size - 1)
+        url = urllib.parse.urlparse(self.path)
+        if url.scheme in ['http', 'https']:
             try:
-                request = urllib.request.Request(self.path)
-                range_header = 'bytes=%d-%d' % (offset, offset + size - 1)
-                request.add_header('range', range_header)
-                with contextlib.closing(urllib.request.urlopen(request)) as response:
-                    data = response.read()
-            except urllib.error.URLError as e:
-                raise OperationFailed('KCHISO0009E', {'err': e})
-        else:
-            with open(self.path, 'rb') as fd:
-                fd.seek(offset)
-                data = fd.read(size)
+                if self._http is None:
+                    if url.scheme == 'https':
+                        self._http = HTTPSConnection(url.netloc, timeout=15)
+                    else:
+                        self._http = HTTPConnection(url.netloc, timeout=15)
+                path = url.path + ('?' + url.query if url.query else '')
+                self._http.request('GET', path, headers={'Range': range_header})
+                response = self._http.getresponse()
+                if response.status == 206:
+                    return response.read()
+                if response.status == 200:
+                    # the server does not support ranges: read only the
+                    # beginning of the file and drop the connection
+                    data = response.read(offset + size)[offset:]
+                    self._close()
+                    return data
+                # let urllib handle redirections and errors
+                response.read()
+            except (HTTPException, OSError) as e:
+                wok_log.debug(f'Unable to read {self.path}: {e}')
+            self._close()
+
+        try:
+            request = urllib.request.Request(self.path)
+            request.add_header('range', range_header)
+            with contextlib.closing(urllib.request.urlopen(request)) as response:
+                data = response.read()
+        except urllib.error.URLError as e:
+            raise OperationFailed('KCHISO0009E', {'err': e})
 
         return data
 
+    def _close(self):
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+
     def _scan(self):
         offset = 16 * IsoImage.SECTOR_SIZE
-        size = 4 * IsoImage.SECTOR_SIZE
-        data = self._get_iso_data(offset, size)
-        if len(data) < 2 * IsoImage.SECTOR_SIZE:
-            return
+        try:
+            header = self._get_iso_data(0, IsoImage.HEADER_SIZE)
+            data = header[offset:]
+            if len(data) < 2 * IsoImage.SECTOR_SIZE:
+                return
+            self._buffer = (0, header)
 
-        self._scan_primary_vol(data)
-        if platform.machine().startswith('ppc'):
-            self._scan_ppc()
-        elif platform.machine().startswith('s390x'):
-            self._scan_s390x()
-        else:
-            self._scan_el_torito(data)
+            self._scan_primary_vol(data)
+            if platform.machine().startswith('ppc'):
+                self._scan_ppc()
+            elif platform.machine().startswith('s390x'):
+                self._scan_s390x()
+            else:
+                self._scan_el_torito(data)
+        finally:
+            self._buffer = None
+            self._close()
 
 
 class Matcher(object):
@@ -526,38 +606,178 @@ class Matcher(object):
         return self.lastmatch.group(num)
 
 
+class IsoProbeCache(object):
+    """
+    Cache of the ISO probe results, so an image is only read again when it
+    changes. See FileCache.
+    """
+
+    def __init__(self, size=PROBE_CACHE_SIZE):
+        self._cache = FileCache(size)
+
+    def get_info(self, path):
+        """
+        Return a dict with the distro, version, bootable and volume_id values
+        of the ISO image <path>. The distro and version are 'unknown' for
+        non bootable images.
+
+        Raises IsoFormatError when <path> is not a valid ISO image.
+        """
+        info = self._cache.get(path, self._probe)
+        if 'error' in info:
+            raise info['error'].with_traceback(None)
+        return dict(info)
+
+    def invalidate(self, path=None):
+        """
+        Drop the results of the image <path> or all of them when <path> is
+        None.
+        """
+        self._cache.invalidate(path)
+
+    @staticmethod
+    def _probe(path):
+        try:
+            iso_img = IsoImage(path)
+        except IsoFormatError as e:
+            return {'error': e}
+
+        distro = version = 'unknown'
+        if iso_img.bootable:
+            distro, version = iso_img.probe()
+
+        return {
+            'distro': distro,
+            'version': version,
+            'bootable': iso_img.bootable,
+            'volume_id': iso_img.volume_id,
+        }
+
+
+_probe_cache = IsoProbeCache()
+
+
+def get_iso_info(path):
+    """
+    Return the probe results of the ISO image <path> from the cache shared by
+    all the users of the ISO images. See IsoProbeCache.get_info().
+    """
+    return _probe_cache.get_info(path)
+
+
+def probe_one(path):
+    """
+    Same as IsoImage(path).probe() but using the shared probe cache.
+    Returns: a tuple with the distro and version of the image
+    """
+    info = get_iso_info(path)
+    if not info['bootable']:
+        raise IsoFormatError('KCHISO0002E', {'filename': path})
+    return info['distro'], info['version']
+
+
+def _compile_ignore_list(ignore_list):
+    """
+    Compile the glob patterns of the directories to skip into a single regular
+    expression, so they are not evaluated again for every directory visited.
+    """
+    if not ignore_list:
+        return None
+
+    patterns = [fnmatch.translate(os.path.normpath(p)) for p in ignore_list]
+    return re.compile('|'.join(patterns))
+
+
+def _find_isos(loc, ignore):
+    for root, dirs, files in os.walk(loc):
+        if ignore is not None and ignore.match(os.path.normpath(root)):
+            # skip the whole directory tree
+            dirs[:] = []
+            continue
+
+        for name in files:
+            if name.lower().endswith('.iso'):
+                yield os.path.join(root, name)
+
+
+def _probe_iso_file(iso, cache):
+    """
+    Probe a local ISO file, reusing the result found in <cache> when the file
+    did not change since it was probed.
+
+    Returns: a tuple with the path and its cache entry. The distro and version
+    of the entry are None when the file is not a valid bootable ISO.
+    """
+    path = os.path.abspath(iso)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return path, None
+
+    key = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'inode': st.st_ino}
+    entry = cache.get(path)
+    if entry is not None and all(entry.get(k) == v for k, v in key.items()):
+        return path, entry
+
+    entry = dict(key, distro=None, version=None)
+    try:
+        entry['distro'], entry['version'] = probe_one(path)
+    except Exception as e:
+        wok_log.debug(f'probe_iso: Unable to probe ISO {path}: {e}')
+    return path, entry
+
+
 def probe_iso(status_helper, params):
+    """
+    Probe an ISO file or all the ISO files found in a directory tree.
+
+    params: A dict with the following values:
+        - path: An ISO file, URL or directory to scan
+        - updater: Function called with the path, distro and version of every
+          ISO image identified
+        - ignore_list: Glob patterns of the directories to skip (optional)
+        - cache: A dict with the entries of previous scans, keyed by path.
+          Unchanged files are not read again and all the files found are
+          stored in it (optional)
+        - workers: Number of files read in parallel (optional)
+    """
     loc = params['path']
     updater = params['updater']
-    ignore = False
-    ignore_list = params.get('ignore_list', [])
+    ignore = _compile_ignore_list(params.get('ignore_list', []))
+    cache = params.get('cache', {})
+    workers = params.get('workers', SCAN_WORKERS)
 
     def update_result(iso, ret):
         path = os.path.abspath(iso) if os.path.isfile(iso) else iso
         updater({'path': path, 'distro': ret[0], 'version': ret[1]})
 
     if os.path.isdir(loc):
-        for root, dirs, files in os.walk(loc):
-            for dir_name in ignore_list:
-                if root in glob.glob(dir_name):
-                    ignore = True
-                    break
-            if ignore:
-                ignore = False
-                continue
-            for name in files:
-                if not name.lower().endswith('.iso'):
-                    continue
-                iso = os.path.join(root, name)
-                try:
-                    iso_img = IsoImage(iso)
-                    ret = iso_img.probe()
-                    update_result(iso, ret)
-                except Exception:
+        found = 0
+        pool = ThreadPool(processes=workers)
+        try:
+            results = pool.imap_unordered(
+                lambda iso: _probe_iso_file(iso, cache),
+                _find_isos(loc, ignore),
+            )
+            for i, (path, entry) in enumerate(results, 1):
+                if entry is None:
                     continue
+
+                cache[path] = entry
+                if entry['distro'] is not None:
+                    found += 1
+                    try:
+                        update_result(
+                            path, (entry['distro'], entry['version']))
+                    except Exception as e:
+                        wok_log.debug(f'probe_iso: Unable to add {path}: {e}')
+
+                if status_helper is not None:
+                    status_helper(f'{i} ISO files probed, {found} images found')
+        finally:
+            pool.terminate()
     else:
-        iso_img = IsoImage(loc)
-        ret = iso_img.probe()
+        ret = probe_one(loc)
         update_result(loc, ret)
 
     if status_helper is not None:
@@ -0,0 +1,91 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import queue
+
+import magic
+from wok.plugins.kimchi.utils import FileCache
+
+
+# number of idle magic handles kept loaded
+MAGIC_HANDLES = 4
+
+# number of files whose type is kept in memory
+TYPE_CACHE_SIZE = 4096
+
+
+class MagicPool(object):
+    """
+    Pool of libmagic handles with the magic database already loaded, so the
+    database is not parsed again for every file classified.
+
+    A libmagic handle can not be used by several threads at once, so each
+    classification takes a handle from the pool and gives it back when done.
+    A new handle is loaded when all of them are in use.
+    """
+
+    def __init__(self, size=MAGIC_HANDLES, flags=magic.NONE):
+        self.flags = flags
+        self._handles = queue.LifoQueue(maxsize=size)
+
+    def _get_handle(self):
+        try:
+            return self._handles.get_nowait()
+        except queue.Empty:
+            handle = magic.open(self.flags)
+            handle.load()
+            return handle
+
+    def _put_handle(self, handle):
+        try:
+            self._handles.put_nowait(handle)
+        except queue.Full:
+            handle.close()
+
+    def file(self, path):
+        """Return the textual description of the type of the file <path>"""
+        handle = self._get_handle()
+        try:
+            return handle.file(path)
+        finally:
+            self._put_handle(handle)
+
+
+class FileTypeCache(object):
+    """
+    Cache of the libmagic description of the files, so a file is only read
+    again when it changes. See FileCache.
+    """
+
+    def __init__(self, pool, size=TYPE_CACHE_SIZE):
+        self.pool = pool
+        self._cache = FileCache(size)
+
+    def get_type(self, path):
+        return self._cache.get(path, self.pool.file)
+
+
+_type_cache = FileTypeCache(MagicPool())
+
+
+def get_file_type(path):
+    """
+    Same as magic.open(magic.NONE).file(path) but using a pool of loaded
+    magic handles and the results of the previous calls for unchanged files.
+    """
+    return _type_cache.get_type(path)
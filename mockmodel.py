@@ -35,6 +35,8 @@ from wok.plugins.kimchi import imageinfo
 from wok.plugins.kimchi import osinfo
 from wok.plugins.kimchi.model import cpuinfo
 from wok.plugins.kimchi.model import storagevolumes
+from wok.plugins.kimchi.model.deviceinventory import get_device_inventory
+from wok.plugins.kimchi.model.domaininventory import get_domain_inventory
 from wok.plugins.kimchi.model.groups import PAMGroupsModel
 from wok.plugins.kimchi.model.host import DeviceModel
 from wok.plugins.kimchi.model.host import DevicesModel
@@ -42,6 +44,9 @@ from wok.plugins.kimchi.model.libvirtstoragepool import IscsiPoolDef
 from wok.plugins.kimchi.model.libvirtstoragepool import NetfsPoolDef
 from wok.plugins.kimchi.model.libvirtstoragepool import StoragePoolDef
 from wok.plugins.kimchi.model.model import Model
+from wok.plugins.kimchi.model.networkinventory import get_network_inventory
+from wok.plugins.kimchi.model.poolhealth import get_pool_health_monitor
+from wok.plugins.kimchi.model.poolrefresh import get_pool_refresher
 from wok.plugins.kimchi.model.storagepools import StoragePoolModel
 from wok.plugins.kimchi.model.storagepools import StoragePoolsModel
 from wok.plugins.kimchi.model.storagevolumes import StorageVolumeModel
@@ -102,6 +107,8 @@ class MockModel(Model):
         PAMGroupsModel.auth_type = 'fake'
 
         super(MockModel, self).__init__('test:///default', objstore_loc)
+        # The mocked device functions below do not emit any libvirt event
+        MockModel._domain_inventory = get_domain_inventory(self.conn)
         self.objstore_loc = objstore_loc
         self.objstore = ObjectStore(objstore_loc)
 
@@ -157,6 +164,11 @@ class MockModel(Model):
     def reset(self):
         MockModel._mock_vms = defaultdict(list)
         MockModel._mock_snapshots = {}
+        MockModel._domain_inventory.invalidate()
+        get_device_inventory(self.conn).invalidate()
+        get_network_inventory(self.conn).invalidate()
+        get_pool_refresher(self.conn).invalidate()
+        get_pool_health_monitor(self.conn).forget()
 
         if hasattr(self, 'objstore'):
             self.objstore = ObjectStore(self.objstore_loc)
@@ -229,6 +241,7 @@ class MockModel(Model):
             xml = ET.tostring(myxml, encoding='unicode')
             dom.setMaxMemory(int(dom.maxMemory() + myxml.target.size))
         MockModel._mock_vms[dom.name()].append(xml)
+        MockModel._domain_inventory.invalidate(dom)
 
     @staticmethod
     def _get_device_node(dom, xml):
@@ -257,6 +270,7 @@ class MockModel(Model):
         xml = ET.tostring(node, encoding='unicode', pretty_print=True)
         if xml in MockModel._mock_vms[dom.name()]:
             MockModel._mock_vms[dom.name()].remove(xml)
+        MockModel._domain_inventory.invalidate(dom)
 
     @staticmethod
     def updateDeviceFlags(dom, xml, flags=0):
@@ -265,6 +279,7 @@ class MockModel(Model):
         if old_xml in MockModel._mock_vms[dom.name()]:
             MockModel._mock_vms[dom.name()].remove(old_xml)
         MockModel._mock_vms[dom.name()].append(xml)
+        MockModel._domain_inventory.invalidate(dom)
 
     @staticmethod
     def volResize(vol, size, flags=0):
@@ -355,8 +370,9 @@ class MockModel(Model):
 
         return self._model_storagevolume_lookup(pool, vol)
 
-    def _mock_storagevolume_doUpload(self, cb, vol, offset, data, data_size):
+    def _mock_storagevolume_doUpload(self, cb, vol, vol_data, data, data_size):
         vol_path = vol.path()
+        offset = vol_data['offset']
 
         # MockModel does not create the storage volume as a file
         # So create it to do the file upload
@@ -367,13 +383,13 @@ class MockModel(Model):
             open(vol_path, 'w').close()
 
         try:
-            with open(vol_path, 'a') as fd:
+            with open(vol_path, 'ab') as fd:
                 fd.seek(offset)
-                fd.write(data)
+                fd.write(data.read(data_size))
         except Exception as e:
             os.remove(vol_path)
             cb('', False)
-            raise OperationFailed('KCHVOL0029E', {'err': e.message})
+            raise OperationFailed('KCHVOL0029E', {'err': str(e)})
 
     def _mock_devices_get_list(
         self,
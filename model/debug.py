@@ -0,0 +1,66 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+from wok.plugins.kimchi.model.libvirtmetrics import call_metrics
+
+
+# statistics of the connection pool which only increase, by the name of
+# their Prometheus counter
+CONNECTION_COUNTERS = {
+    'borrowed': 'connection_borrowed',
+    'waited': 'connection_waited',
+    'wait_time': 'connection_wait_seconds',
+}
+
+
+class DebugModel(object):
+    def __init__(self, **kargs):
+        pass
+
+    def lookup(self, name=None):
+        return {'components': ['libvirt']}
+
+
+class LibvirtDebugModel(object):
+    def __init__(self, **kargs):
+        self.conn = kargs['conn']
+        self.events = kargs['eventsloop']
+
+    def lookup(self, name=None):
+        return {
+            'calls': call_metrics.get_stats(),
+            'connection': self.conn.get_stats(),
+            'event_loop': self.events.get_loop_stats(),
+        }
+
+    def prometheus(self):
+        gauges = {}
+        counters = {}
+        for key, value in self.conn.get_stats().items():
+            if key in CONNECTION_COUNTERS:
+                counters[CONNECTION_COUNTERS[key]] = value
+            else:
+                gauges[f'connection_{key}'] = value
+        loop_stats = self.events.get_loop_stats()
+        gauges['event_loop_lag_seconds'] = loop_stats['lag']
+        gauges['event_loop_max_lag_seconds'] = loop_stats['max_lag']
+        counters['event_loop_heartbeats'] = loop_stats['heartbeats']
+        return call_metrics.to_prometheus(gauges, counters)
+
+    def reset(self):
+        call_metrics.reset()
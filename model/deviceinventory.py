@@ -0,0 +1,192 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import copy
+
+import libvirt
+from wok.plugins.kimchi.model import hostdev
+from wok.plugins.kimchi.model.inventory import EventInventory
+from wok.plugins.kimchi.model.inventory import get_inventory
+from wok.utils import wok_log
+
+
+def get_device_inventory(conn):
+    """
+    Return the host device inventory shared by all the users of the libvirt
+    connection <conn>.
+    """
+    return get_inventory(DeviceInventory, conn)
+
+
+class DeviceInventory(EventInventory):
+    """
+    In-process inventory of the host devices of a libvirt connection: the
+    parsed XML of each device, the children of each device, the IOMMU group
+    of each device (its own or the one of its closest parent) and the
+    devices of each IOMMU group. The PCI class of each PCI device is read
+    from sysfs once, to tell the devices eligible to passthrough.
+
+    The inventory is built once from listAllDevices() and built again when
+    libvirt reports a device added, removed or changed, or when Kimchi calls
+    invalidate().
+
+    The device infos returned are copies, so the callers may change them.
+    """
+
+    def __init__(self, conn):
+        super(DeviceInventory, self).__init__(conn)
+        # key: device name; value: device info, as returned by get_dev_info()
+        self._devices = {}
+        # key: device name; value: names of its children
+        self._children = {}
+        # key: device name; value: IOMMU group number or None
+        self._groups = {}
+        # key: IOMMU group number; value: names of the devices in the group
+        self._group_index = {}
+        # key: PCI device name; value: PCI class or None when unknown
+        self._pci_classes = {}
+        # names of the devices eligible to passthrough
+        self._passthrough = set()
+
+    def _device_changed_cb(self, dev, opaque):
+        self.invalidate()
+
+    def get_devices(self, device_type=None):
+        """
+        Return the infos of all the devices, or of the devices of type
+        <device_type> only, sorted by name.
+        """
+        self._refresh()
+        with self._lock:
+            return [
+                copy.deepcopy(self._devices[name])
+                for name in sorted(self._devices)
+                if device_type is None
+                or self._devices[name]['device_type'] == device_type
+            ]
+
+    def get_device(self, name):
+        """Return the info of the device <name> or None when not found"""
+        self._refresh()
+        with self._lock:
+            info = self._devices.get(name)
+            return None if info is None else copy.deepcopy(info)
+
+    def get_passthrough_devices(self):
+        """Return the names of the devices eligible to passthrough, sorted"""
+        self._refresh()
+        with self._lock:
+            return sorted(self._passthrough)
+
+    def get_iommu_groups(self):
+        """
+        Return a dict with the names of the PCI devices of each IOMMU group,
+        by group number. The children of the PCI devices are not listed.
+        """
+        self._refresh()
+        with self._lock:
+            return {
+                group: [
+                    name for name in names
+                    if 'iommuGroup' in self._devices[name]
+                ]
+                for group, names in self._group_index.items()
+            }
+
+    def get_affected_devices(self, name):
+        """
+        Return the names of the devices affected by the passthrough of the
+        device <name>: the other devices of its IOMMU group or, on hosts
+        without IOMMU group support, its children recursively.
+        """
+        self._refresh()
+        with self._lock:
+            group = self._groups.get(name)
+            affected = []
+            if group is not None:
+                affected = [
+                    dev for dev in self._group_index[group] if dev != name]
+            if not affected:
+                affected = self._get_descendants(name)
+            return affected
+
+    def get_pci_class(self, name):
+        """Return the PCI class of the device <name> or None when unknown"""
+        self._refresh()
+        with self._lock:
+            return self._pci_classes.get(name)
+
+    def _get_descendants(self, name):
+        descendants = []
+        for child in self._children.get(name, []):
+            descendants.append(child)
+            descendants.extend(self._get_descendants(child))
+        return descendants
+
+    def _register(self, events):
+        return events.registerNodeDeviceEvents(
+            self.conn, self._device_changed_cb, None
+        )
+
+    def _load(self, conn):
+        devices = {}
+        for node_dev in conn.listAllDevices(0):
+            try:
+                info = hostdev.get_dev_info(node_dev)
+            except libvirt.libvirtError as e:
+                # Device might be removed just after we get the list.
+                # This is OK, just skip.
+                wok_log.debug(f'Error processing device {node_dev.name()}: {e}')
+                continue
+            devices[info['name']] = info
+
+        children = {}
+        for info in devices.values():
+            if info['parent'] is not None:
+                children.setdefault(info['parent'], []).append(info['name'])
+        for names in children.values():
+            names.sort()
+
+        groups = hostdev._get_iommu_groups(list(devices.values()))
+        group_index = {}
+        for name in sorted(groups):
+            if groups[name] is not None:
+                group_index.setdefault(groups[name], []).append(name)
+
+        pci_classes = {}
+        passthrough = set()
+        for name, info in devices.items():
+            if info['device_type'] in ('usb_device', 'scsi'):
+                passthrough.add(name)
+            elif info['device_type'] == 'pci':
+                try:
+                    pci_classes[name] = hostdev._get_pci_class(info)
+                except (IOError, ValueError):
+                    pci_classes[name] = None
+                    continue
+                if hostdev._is_pci_qualified(info, pci_classes[name]):
+                    passthrough.add(name)
+
+        return {
+            '_devices': devices,
+            '_children': children,
+            '_groups': groups,
+            '_group_index': group_index,
+            '_pci_classes': pci_classes,
+            '_passthrough': passthrough,
+        }
@@ -16,10 +16,7 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
-from wok.plugins.kimchi.model.vms import VMModel
-from wok.plugins.kimchi.model.vms import VMsModel
-from wok.plugins.kimchi.xmlutils.disk import get_vm_disk_info
-from wok.plugins.kimchi.xmlutils.disk import get_vm_disks
+from wok.plugins.kimchi.model.domaininventory import get_domain_inventory
 
 
 """
@@ -29,15 +26,5 @@ from wok.plugins.kimchi.xmlutils.disk import get_vm_disks
 
 
 def get_disk_used_by(conn, path):
-    used_by = []
-    # try to find this volume in existing vm
-    vms_list = VMsModel.get_vms(conn)
-    for vm in vms_list:
-        dom = VMModel.get_vm(vm, conn)
-        storages = get_vm_disks(dom)
-        for disk in storages.keys():
-            d_info = get_vm_disk_info(dom, disk)
-            if path == d_info['path']:
-                used_by.append(vm)
-
-    return used_by
+    # the domain inventory keeps a reverse index from disk path to VMs
+    return get_domain_inventory(conn).get_disk_users(path)
@@ -0,0 +1,224 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import libvirt
+import lxml.etree as ET
+from wok.plugins.kimchi.model.inventory import EventInventory
+from wok.plugins.kimchi.model.inventory import get_inventory
+from wok.plugins.kimchi.model.utils import DomainView
+from wok.plugins.kimchi.model.utils import xpath_get_text_from_root
+from wok.plugins.kimchi.xmlutils.disk import get_disk_info
+from wok.utils import wok_log
+
+
+XPATH_NETWORKS = "/domain/devices/interface[@type='network']/source/@network"
+# backing files listed in the live XML of a running domain
+XPATH_DISK_BACKING = 'backingStore//source/@file'
+XPATH_VOLUME_BACKING = '/volume/backingStore/path'
+
+
+def get_domain_inventory(conn):
+    """
+    Return the domain inventory shared by all the users of the libvirt
+    connection <conn>.
+    """
+    return get_inventory(DomainInventory, conn)
+
+
+class DomainInventory(EventInventory):
+    """
+    In-process inventory of the domains of a libvirt connection, keyed by
+    UUID. Each entry keeps the values the models scan all domains for: name,
+    state, disks, networks and host devices. A reverse index from disk path
+    to the domains using it is kept along with the entries, and another one
+    from backing file to the domains whose disks are overlays of it, as the
+    linked clones are.
+
+    The inventory is built once from listAllDomains() and then only the
+    domains reported as changed by libvirt (lifecycle, device added or
+    removed and metadata change events) or by Kimchi through invalidate() are
+    read again. Kimchi invalidates the domains it changes itself as the
+    events are delivered asynchronously.
+    """
+
+    def __init__(self, conn):
+        super(DomainInventory, self).__init__(conn)
+        # key: domain UUID; value: entry dict
+        self._entries = {}
+        # key: disk path; value: names of the domains using it
+        self._disk_index = {}
+        # key: backing file path; value: names of the domains backed by it
+        self._backing_index = {}
+
+    def invalidate(self, dom=None):
+        """
+        Read the domain <dom> again on next access. All the domains are read
+        again when <dom> is None.
+        """
+        super(DomainInventory, self).invalidate(
+            None if dom is None else dom.UUIDString())
+
+    def _domain_changed_cb(self, dom, opaque):
+        self.invalidate(dom)
+
+    def get_domains(self):
+        """
+        Return the entries of all domains. The entries are shared, so they
+        must not be changed by the callers.
+        """
+        self._refresh()
+        with self._lock:
+            return list(self._entries.values())
+
+    def get_disk_users(self, path):
+        """
+        Return the names of the domains using the disk <path>, sorted.
+        """
+        self._refresh()
+        with self._lock:
+            return list(self._disk_index.get(path, []))
+
+    def get_backing_users(self, path):
+        """
+        Return the names of the domains with a disk backed by the file <path>,
+        directly or through other backing files, sorted.
+        """
+        self._refresh()
+        with self._lock:
+            return list(self._backing_index.get(path, []))
+
+    def _register(self, events):
+        return events.registerDomainChangeEvents(
+            self.conn, self._domain_changed_cb, None
+        )
+
+    def _load(self, conn):
+        return self._index(self._list_entries(conn))
+
+    def _update(self, conn, uuids):
+        entries = dict(self._entries)
+        for vm_uuid in uuids:
+            self._refresh_entry(conn, entries, vm_uuid)
+        return self._index(entries)
+
+    @staticmethod
+    def _index(entries):
+        disk_index = {}
+        backing_index = {}
+        for entry in entries.values():
+            for disk in entry['disks']:
+                names = disk_index.setdefault(disk['path'], [])
+                if entry['name'] not in names:
+                    names.append(entry['name'])
+            for path in entry['backing']:
+                names = backing_index.setdefault(path, [])
+                if entry['name'] not in names:
+                    names.append(entry['name'])
+        for index in (disk_index, backing_index):
+            for names in index.values():
+                names.sort(key=str.lower)
+        return {
+            '_entries': entries,
+            '_disk_index': disk_index,
+            '_backing_index': backing_index,
+        }
+
+    def _list_entries(self, conn):
+        entries = {}
+        for dom in conn.listAllDomains(0):
+            try:
+                entry = self._get_entry(conn, dom)
+            except libvirt.libvirtError as e:
+                # VM might be deleted just after we get the list.
+                # This is OK, just skip.
+                wok_log.debug(f'Error processing VM {dom.UUIDString()}: {e}')
+                continue
+            entries[entry['uuid']] = entry
+        return entries
+
+    def _refresh_entry(self, conn, entries, vm_uuid):
+        try:
+            dom = conn.lookupByUUIDString(vm_uuid)
+            entries[vm_uuid] = self._get_entry(conn, dom)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                raise
+            # the domain was undefined
+            entries.pop(vm_uuid, None)
+
+    @staticmethod
+    def _get_backing_chain(conn, path):
+        """
+        Return the backing files of the volume <path>, closest first. The
+        files out of the storage pools are not followed.
+        """
+        chain = []
+        while True:
+            try:
+                xml = conn.storageVolLookupByPath(path).XMLDesc(0)
+            except libvirt.libvirtError:
+                break
+
+            backing = xpath_get_text_from_root(
+                ET.fromstring(xml), XPATH_VOLUME_BACKING)
+            if not backing or backing[0] in chain:
+                break
+            path = backing[0]
+            chain.append(path)
+        return chain
+
+    @staticmethod
+    def _get_entry(conn, dom):
+        view = DomainView(dom, 0)
+
+        name = dom.name()
+        nonascii_xml = view.get_metadata_node('name')
+        if nonascii_xml:
+            name = ET.fromstring(nonascii_xml).text
+
+        disks = []
+        backing = []
+        for disk in view.root.findall('devices/disk'):
+            try:
+                info = get_disk_info(disk)
+            except (AttributeError, KeyError) as e:
+                wok_log.debug(f'Unable to parse disk of VM {name}: {e}')
+                continue
+            disks.append(info)
+
+            # only the qcow2 images may have a backing file
+            if info['type'] != 'disk' or info['format'] != 'qcow2':
+                continue
+            chain = disk.xpath(XPATH_DISK_BACKING)
+            if not chain and disk.get('type') in ('file', 'block'):
+                chain = DomainInventory._get_backing_chain(conn, info['path'])
+            backing.extend(path for path in chain if path not in backing)
+
+        return {
+            'uuid': dom.UUIDString(),
+            'name': name,
+            'libvirt_name': dom.name(),
+            'state': dom.state(0)[0],
+            'disks': disks,
+            'backing': backing,
+            'networks': view.xpath(XPATH_NETWORKS),
+            'hostdevs': [
+                ET.tostring(hostdev, encoding='unicode')
+                for hostdev in view.root.findall('devices/hostdev')
+            ],
+        }
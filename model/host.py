@@ -16,18 +16,14 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
-import os
-from collections import defaultdict
-
 import libvirt
 from lxml import objectify
 from wok.exception import InvalidParameter
 from wok.exception import NotFoundError
 from wok.plugins.kimchi import disks
-from wok.plugins.kimchi.model import hostdev
 from wok.plugins.kimchi.model.config import CapabilitiesModel
-from wok.plugins.kimchi.model.vms import VMModel
-from wok.plugins.kimchi.model.vms import VMsModel
+from wok.plugins.kimchi.model.deviceinventory import get_device_inventory
+from wok.plugins.kimchi.model.domaininventory import get_domain_inventory
 from wok.xmlutils.utils import xpath_get_text
 
 
@@ -54,19 +50,12 @@ class DevicesModel(object):
             self.cap_map['fc_host'] = None
 
     def _get_unavailable_devices(self):
-        vm_list = VMsModel.get_vms(self.conn)
         unavailable_devs = []
-        for vm in vm_list:
-            dom = VMModel.get_vm(vm, self.conn)
-            xmlstr = dom.XMLDesc(0)
-            root = objectify.fromstring(xmlstr)
-            try:
-                hostDevices = root.devices.hostdev
-            except AttributeError:
-                continue
-
-            vm_devs = [DeviceModel.deduce_dev_name(
-                e, self.conn) for e in hostDevices]
+        for domain in get_domain_inventory(self.conn).get_domains():
+            vm_devs = [
+                DeviceModel.deduce_dev_name(objectify.fromstring(e), self.conn)
+                for e in domain['hostdevs']
+            ]
 
             for dev in vm_devs:
                 unavailable_devs.append(dev)
@@ -92,10 +81,8 @@ class DevicesModel(object):
             dev_names = self._get_devices_with_capability(_cap)
 
         if _passthrough is not None and _passthrough.lower() == 'true':
-            conn = self.conn.get()
-            passthrough_names = [
-                dev['name'] for dev in hostdev.get_passthrough_dev_infos(conn)
-            ]
+            inventory = get_device_inventory(self.conn)
+            passthrough_names = inventory.get_passthrough_devices()
 
             dev_names = list(set(dev_names) & set(passthrough_names))
 
@@ -118,10 +105,10 @@ class DevicesModel(object):
         return [name.name() for name in conn.listAllDevices(cap_flag)]
 
     def _get_passthrough_affected_devs(self, dev_name):
-        conn = self.conn.get()
-        info = DeviceModel(conn=self.conn).lookup(dev_name)
-        affected = hostdev.get_affected_passthrough_devices(conn, info)
-        return [dev_info['name'] for dev_info in affected]
+        inventory = get_device_inventory(self.conn)
+        if inventory.get_device(dev_name) is None:
+            raise NotFoundError('KCHHOST0003E', {'name': dev_name})
+        return inventory.get_affected_devices(dev_name)
 
     def _get_devices_fc_host(self):
         conn = self.conn.get()
@@ -147,36 +134,15 @@ class DevicesModel(object):
 class DeviceModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
-        self.iommu_groups = self.get_iommu_groups()
 
     def get_iommu_groups(self):
-        iommu_groups = defaultdict(list)
-        conn = self.conn
-
-        try:
-            devices = DevicesModel(conn=conn).get_list()
-
-        except Exception:
-            return iommu_groups
-
-        for device in devices:
-            info = hostdev.get_dev_info(
-                conn.get().nodeDeviceLookupByName(device))
-            if 'iommuGroup' not in info:
-                continue
-            iommu_group_nr = int(info['iommuGroup'])
-            iommu_groups[iommu_group_nr].append(device)
-
-        return iommu_groups
+        return get_device_inventory(self.conn).get_iommu_groups()
 
     def lookup(self, nodedev_name):
-        conn = self.conn.get()
-        try:
-            dev = conn.nodeDeviceLookupByName(nodedev_name)
-        except Exception:
+        info = get_device_inventory(self.conn).get_device(nodedev_name)
+        if info is None:
             raise NotFoundError('KCHHOST0003E', {'name': nodedev_name})
 
-        info = hostdev.get_dev_info(dev)
         info['multifunction'] = self.is_multifunction_pci(info)
         info['vga3d'] = self.is_device_3D_controller(info)
         return info
@@ -185,16 +151,10 @@ class DeviceModel(object):
         if 'iommuGroup' not in info:
             return False
         iommu_group_nr = int(info['iommuGroup'])
-        return len(self.iommu_groups[iommu_group_nr]) > 1
+        return len(self.get_iommu_groups().get(iommu_group_nr, [])) > 1
 
     def is_device_3D_controller(self, info):
-        try:
-            with open(os.path.join(info['path'], 'class')) as f:
-                pci_class = int(f.readline().strip(), 16)
-
-        except Exception:
-            return False
-
+        pci_class = get_device_inventory(self.conn).get_pci_class(info['name'])
         if pci_class == 0x030200:
             return True
 
@@ -239,8 +199,8 @@ class DeviceModel(object):
     @staticmethod
     def _deduce_dev_name_usb(e, conn):
         dev_names = DevicesModel(conn=conn).get_list(_cap='usb_device')
-        usb_infos = [DeviceModel(conn=conn).lookup(dev_name)
-                     for dev_name in dev_names]
+        dev_model = DeviceModel(conn=conn)
+        usb_infos = [dev_model.lookup(dev_name) for dev_name in dev_names]
 
         unknown_dev = None
 
@@ -304,17 +264,14 @@ class VolumeGroupModel(object):
         pass
 
     def lookup(self, name):
-        def _format(vg):
-            return {
-                'name': vg['vgname'],
-                'size': vg['size'],
-                'free': vg['free'],
-                'pvs': [pv['pvname'] for pv in disks.pvs(vg['vgname'])],
-                'lvs': [lv['lvname'] for lv in disks.lvs(vg['vgname'])],
-            }
-
-        vgs = [_format(vg) for vg in disks.vgs() if vg['vgname'] == name]
-        if not vgs:
+        vg = disks.get_vg(name)
+        if vg is None:
             raise InvalidParameter('KCHLVMS0001E', {'name': name})
 
-        return vgs[0]
+        return {
+            'name': vg['vgname'],
+            'size': vg['size'],
+            'free': vg['free'],
+            'pvs': [pv['pvname'] for pv in vg['pvs']],
+            'lvs': [lv['lvname'] for lv in vg['lvs']],
+        }
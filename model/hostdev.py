@@ -57,14 +57,19 @@ def _get_dev_info_tree(dev_infos):
     return root
 
 
-def _is_pci_qualified(pci_dev):
+def _get_pci_class(pci_dev):
+    with open(os.path.join(pci_dev['path'], 'class')) as f:
+        return int(f.readline().strip(), 16)
+
+
+def _is_pci_qualified(pci_dev, pci_class=None):
     # PCI bridge is not suitable to passthrough
     # KVM does not support passthrough graphic card now but supports
     # 3D controller
     blacklist_classes = (0x030000, 0x060000)
 
-    with open(os.path.join(pci_dev['path'], 'class')) as f:
-        pci_class = int(f.readline().strip(), 16)
+    if pci_class is None:
+        pci_class = _get_pci_class(pci_dev)
 
     if pci_class != 0x030200 and pci_class & 0xFF0000 in blacklist_classes:
         return False
@@ -85,39 +90,49 @@ def get_passthrough_dev_infos(libvirt_conn):
     return [dev_info for dev_info in dev_infos if is_eligible(dev_info)]
 
 
-def _get_same_iommugroup_devices(dev_infos, device_info):
+def _get_iommu_groups(dev_infos):
+    """
+    Return a dict with the IOMMU group of each device, by name. A child device
+    belongs to the same IOMMU group as its closest parent having one. The
+    group is None on hosts without IOMMU group support.
+    """
     dev_dict = dict([(dev_info['name'], dev_info) for dev_info in dev_infos])
+    groups = {}
 
-    def get_iommu_group(dev_info):
-        # Find out the iommu group of a given device.
-        # Child device belongs to the same iommu group as the parent device.
-        try:
-            return dev_info['iommuGroup']
-        except KeyError:
-            pass
+    for dev_info in dev_infos:
+        # walk up the parents until a device whose group is known, and set
+        # that group to all the devices found on the way
+        path = []
+        name = dev_info['name']
+        group = None
+        while name is not None:
+            if name in groups:
+                group = groups[name]
+                break
 
-        parent = dev_info['parent']
-        while parent is not None:
             try:
-                parent_info = dev_dict[parent]
+                info = dev_dict[name]
             except KeyError:
                 wok_log.error(
-                    'Parent %s of device %s does not exist', parent, dev_info['name']
+                    'Parent %s of device %s does not exist', name, path[-1]
                 )
                 break
 
-            try:
-                iommuGroup = parent_info['iommuGroup']
-            except KeyError:
-                pass
-            else:
-                return iommuGroup
+            path.append(name)
+            if 'iommuGroup' in info:
+                group = info['iommuGroup']
+                break
+            name = info['parent']
 
-            parent = parent_info['parent']
+        for name in path:
+            groups[name] = group
 
-        return None
+    return groups
 
-    iommu_group = get_iommu_group(device_info)
+
+def _get_same_iommugroup_devices(dev_infos, device_info):
+    groups = _get_iommu_groups(dev_infos)
+    iommu_group = groups.get(device_info['name'], device_info.get('iommuGroup'))
 
     if iommu_group is None:
         return []
@@ -126,7 +141,7 @@ def _get_same_iommugroup_devices(dev_infos, device_info):
         dev_info
         for dev_info in dev_infos
         if dev_info['name'] != device_info['name']
-        and get_iommu_group(dev_info) == iommu_group
+        and groups[dev_info['name']] == iommu_group
     ]
 
 
@@ -0,0 +1,165 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import threading
+
+
+# key: (inventory class, libvirt URI); value: inventory
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+
+def get_inventory(cls, conn):
+    """
+    Return the inventory of class <cls> shared by all the users of the
+    libvirt connection <conn>.
+    """
+    with _inventories_lock:
+        key = (cls, conn.uri)
+        inventory = _inventories.get(key)
+        if inventory is None:
+            inventory = _inventories[key] = cls(conn)
+        return inventory
+
+
+class EventInventory(object):
+    """
+    Base class of the in-process inventories of the objects of a libvirt
+    connection kept updated by the libvirt events.
+
+    The inventory is loaded once by _load() and then only the objects passed
+    to invalidate(), by the change events or by Kimchi, are read again by
+    _update(). Without those events the whole inventory is loaded again on
+    every access. The events are registered again, through _register(), when
+    the connection is recycled as the callbacks are lost with it.
+
+    _load() and _update() read libvirt without holding self._lock and return
+    the attributes of the new inventory, which replace the current ones at
+    once under self._lock. The subclasses call _refresh() before reading the
+    inventory with self._lock held, so the readers only wait on libvirt when
+    the inventory is outdated.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._events = None
+        # virConnect the change events were registered on
+        self._watched_conn = None
+        self._watching = False
+        # held while reading or replacing the inventory
+        self._lock = threading.Lock()
+        # held while loading the inventory, so concurrent readers of an
+        # outdated inventory share a single load
+        self._load_lock = threading.Lock()
+        # keys of the objects changed since the last access
+        self._dirty = set()
+        self._dirty_all = True
+        self._loading = False
+        self._dirty_lock = threading.Lock()
+
+    def watch(self, events):
+        """
+        Keep the inventory updated by the events delivered by the
+        LibvirtEvents instance <events>.
+        """
+        with self._load_lock:
+            self._events = events
+            self._watched_conn = None
+            self._watching = False
+
+    def invalidate(self, key=None):
+        """
+        Read the object <key> again on next access. All the objects are read
+        again when <key> is None.
+        """
+        with self._dirty_lock:
+            if key is None:
+                self._dirty_all = True
+            else:
+                self._dirty.add(key)
+
+    def _register(self, events):
+        """
+        Register the change events of the objects on the LibvirtEvents
+        instance <events>.
+        Returns: True when all the events were registered
+        """
+        raise NotImplementedError
+
+    def _load(self, conn):
+        """
+        Read all the objects from the virConnect <conn>.
+        Returns: dict with the new values of the inventory attributes
+        """
+        raise NotImplementedError
+
+    def _update(self, conn, keys):
+        """
+        Read the objects <keys> again from the virConnect <conn>.
+        Returns: dict with the new values of the inventory attributes
+        """
+        return self._load(conn)
+
+    def _is_current(self, conn):
+        with self._dirty_lock:
+            return (
+                self._watching and conn is self._watched_conn and
+                not self._loading and not self._dirty and not self._dirty_all
+            )
+
+    def _refresh(self):
+        conn = self.conn.get()
+        if self._is_current(conn):
+            return
+
+        with self._load_lock:
+            if self._events is not None and conn is not self._watched_conn:
+                # the callbacks are lost when the connection is recycled
+                self._watching = self._register(self._events)
+                self._watched_conn = conn
+                self.invalidate()
+
+            # an object changed while the inventory is read is read again
+            with self._dirty_lock:
+                dirty = self._dirty
+                dirty_all = self._dirty_all or not self._watching
+                self._dirty = set()
+                self._dirty_all = False
+                self._loading = True
+
+            try:
+                if dirty_all:
+                    values = self._load(conn)
+                elif dirty:
+                    values = self._update(conn, dirty)
+                else:
+                    # loaded by a concurrent reader
+                    values = {}
+
+                with self._lock:
+                    for name, value in values.items():
+                        setattr(self, name, value)
+            except Exception:
+                # the objects are read again on next access
+                with self._dirty_lock:
+                    self._dirty |= dirty
+                    self._dirty_all = self._dirty_all or dirty_all
+                raise
+            finally:
+                with self._dirty_lock:
+                    self._loading = False
@@ -16,26 +16,164 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import contextlib
+import queue
 import threading
 import time
 
 import libvirt
+from wok.exception import OperationFailed
 from wok.model.notifications import add_notification
 from wok.model.notifications import del_notification
 from wok.model.notifications import notificationsStore
+from wok.plugins.kimchi.model.libvirtmetrics import call_metrics
 from wok.plugins.kimchi.utils import is_libvirtd_up
 from wok.utils import wok_log
 
 
+# number of connections lent by LibvirtConnection.borrow() besides the one
+# shared by all the callers of LibvirtConnection.get()
+DEFAULT_POOL_SIZE = 4
+
+# libvirt sends a keepalive message every KEEPALIVE_INTERVAL seconds on an
+# idle connection and closes it after KEEPALIVE_COUNT unanswered messages.
+# The values are loose so a daemon busy with many domains is not seen as dead.
+KEEPALIVE_INTERVAL = 30
+KEEPALIVE_COUNT = 5
+
+# delays in seconds between two attempts to reconnect to libvirt
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+# seconds a request waits for libvirt to be reachable again
+RECONNECT_WAIT = 10
+
+
+class ConnectionPool(object):
+    """
+    Slots of the connections lent by LibvirtConnection.borrow(). A caller
+    waits when all the <size> connections are in use.
+
+    The statistics tell how often the pool was saturated, to tune its size.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        # the connections used last are lent first, as they are already open
+        self._idle = queue.LifoQueue()
+        for slot in range(size, 0, -1):
+            self._idle.put(slot)
+        self._lock = threading.Lock()
+        self._stats = {
+            'in_use': 0,
+            'max_in_use': 0,
+            'waiting': 0,
+            'borrowed': 0,
+            'waited': 0,
+            'wait_time': 0.0,
+        }
+
+    def acquire(self):
+        try:
+            slot = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self._stats['waiting'] += 1
+                self._stats['waited'] += 1
+            started = time.monotonic()
+            slot = self._idle.get()
+            with self._lock:
+                self._stats['waiting'] -= 1
+                self._stats['wait_time'] += time.monotonic() - started
+
+        with self._lock:
+            self._stats['in_use'] += 1
+            self._stats['borrowed'] += 1
+            self._stats['max_in_use'] = max(
+                self._stats['max_in_use'], self._stats['in_use'])
+        return slot
+
+    def release(self, slot):
+        with self._lock:
+            self._stats['in_use'] -= 1
+        self._idle.put(slot)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['size'] = self.size
+        return stats
+
+
+class Reconnector(object):
+    """
+    Try to reconnect to libvirt in background with an exponential backoff, so
+    the requests do not each retry the connection while libvirt is down.
+    """
+
+    def __init__(self, uri):
+        self.uri = uri
+        # set while libvirt is believed to be reachable
+        self.connected = threading.Event()
+        self.connected.set()
+        self.attempts = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self.connected.clear()
+            if self._thread is not None:
+                return
+
+            self._thread = threading.Thread(
+                target=self._run, name='KimchiLibvirtReconnect')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def wait(self, timeout=RECONNECT_WAIT):
+        return self.connected.wait(timeout)
+
+    def _run(self):
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            time.sleep(delay)
+            self.attempts += 1
+            try:
+                libvirt.open(self.uri).close()
+                break
+            except libvirt.libvirtError:
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                wok_log.debug(
+                    f'Unable to connect to libvirt, retrying in {delay}s.')
+
+        wok_log.info('Connection to libvirt restored.')
+        with self._lock:
+            self._thread = None
+            self.attempts = 0
+            self.connected.set()
+
+
 class LibvirtConnection(object):
     _connections = {}
     _connectionLock = threading.Lock()
+    # key: URI; value: ConnectionPool
+    _pools = {}
+    # key: URI; value: Reconnector
+    _reconnectors = {}
+    # the methods of the libvirt classes are only wrapped once
+    _wrapped = False
 
-    def __init__(self, uri):
+    def __init__(self, uri, pool_size=DEFAULT_POOL_SIZE):
         self.uri = uri
-        if self.uri not in LibvirtConnection._connections:
-            LibvirtConnection._connections[self.uri] = {}
+        with LibvirtConnection._connectionLock:
+            if self.uri not in LibvirtConnection._connections:
+                LibvirtConnection._connections[self.uri] = {}
+            if self.uri not in LibvirtConnection._pools:
+                LibvirtConnection._pools[self.uri] = ConnectionPool(pool_size)
+                LibvirtConnection._reconnectors[self.uri] = Reconnector(uri)
         self._connections = LibvirtConnection._connections[self.uri]
+        self._pool = LibvirtConnection._pools[self.uri]
+        self._reconnector = LibvirtConnection._reconnectors[self.uri]
         self.wrappables = self.get_wrappable_objects()
 
     def get_wrappable_objects(self):
@@ -64,41 +202,68 @@ class LibvirtConnection(object):
             objs.append(attr)
         return tuple(objs)
 
+    @staticmethod
+    def _recycle(conn):
+        """
+        Forget the broken connection <conn>, or all the connections when the
+        connection of the failed object is not known.
+        """
+        with LibvirtConnection._connectionLock:
+            for connections in LibvirtConnection._connections.values():
+                for conn_id, current in connections.items():
+                    if conn is None or current is conn:
+                        connections[conn_id] = None
+
+    @staticmethod
+    def _wrap_method(f, api, conn=None):
+        """
+        Wrap the libvirt method <f> to recycle the connection when it breaks
+        and to record the latency of the calls under the name <api>.
+        """
+        if getattr(f, 'kimchi_wrapped', False):
+            return f
+
+        def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            failed = True
+            try:
+                ret = f(*args, **kwargs)
+                failed = False
+                return ret
+            except libvirt.libvirtError as e:
+                edom = e.get_error_domain()
+                ecode = e.get_error_code()
+                EDOMAINS = (libvirt.VIR_FROM_REMOTE, libvirt.VIR_FROM_RPC)
+                ECODES = (
+                    libvirt.VIR_ERR_SYSTEM_ERROR,
+                    libvirt.VIR_ERR_INTERNAL_ERROR,
+                    libvirt.VIR_ERR_NO_CONNECT,
+                    libvirt.VIR_ERR_INVALID_CONN,
+                )
+                if edom in EDOMAINS and ecode in ECODES:
+                    wok_log.error(
+                        'Connection to libvirt broken. '
+                        'Recycling. ecode: %d edom: %d' % (ecode, edom)
+                    )
+                    broken = conn
+                    if broken is None and args:
+                        broken = getattr(args[0], '_conn', None)
+                    LibvirtConnection._recycle(broken)
+                raise
+            finally:
+                call_metrics.record(api, time.monotonic() - started, failed)
+
+        wrapper.__name__ = f.__name__
+        wrapper.__doc__ = f.__doc__
+        wrapper.kimchi_wrapped = True
+        return wrapper
+
     def get(self, conn_id=0):
         """
         Return current connection to libvirt or open a new one.  Wrap all
         callable libvirt methods so we can catch connection errors and handle
         them by restarting the server.
         """
-
-        def wrapMethod(f):
-            def wrapper(*args, **kwargs):
-                try:
-                    ret = f(*args, **kwargs)
-                    return ret
-                except libvirt.libvirtError as e:
-                    edom = e.get_error_domain()
-                    ecode = e.get_error_code()
-                    EDOMAINS = (libvirt.VIR_FROM_REMOTE, libvirt.VIR_FROM_RPC)
-                    ECODES = (
-                        libvirt.VIR_ERR_SYSTEM_ERROR,
-                        libvirt.VIR_ERR_INTERNAL_ERROR,
-                        libvirt.VIR_ERR_NO_CONNECT,
-                        libvirt.VIR_ERR_INVALID_CONN,
-                    )
-                    if edom in EDOMAINS and ecode in ECODES:
-                        wok_log.error(
-                            'Connection to libvirt broken. '
-                            'Recycling. ecode: %d edom: %d' % (ecode, edom)
-                        )
-                        with LibvirtConnection._connectionLock:
-                            self._connections[conn_id] = None
-                    raise
-
-            wrapper.__name__ = f.__name__
-            wrapper.__doc__ = f.__doc__
-            return wrapper
-
         if not is_libvirtd_up():
             wok_log.error('Libvirt service is not active.')
             add_notification('KCHCONN0002E', plugin_name='/plugins/kimchi')
@@ -112,49 +277,105 @@ class LibvirtConnection(object):
 
         with LibvirtConnection._connectionLock:
             conn = self._connections.get(conn_id)
-            if not conn:
-                conn = self._get_new_connection()
-
-                for name in dir(libvirt.virConnect):
-                    method = getattr(conn, name)
-                    if callable(method) and not name.startswith('_'):
-                        setattr(conn, name, wrapMethod(method))
+        if conn:
+            return conn
 
-                for cls in self.wrappables:
-                    for name in dir(cls):
-                        method = getattr(cls, name)
-                        if callable(method) and not name.startswith('_'):
-                            setattr(cls, name, wrapMethod(method))
+        # the connection is opened without the lock, so the other
+        # connections are still available meanwhile
+        conn = self._get_new_connection()
+        if conn is None:
+            return None
+        self._setup_connection(conn)
 
+        with LibvirtConnection._connectionLock:
+            self._wrap_classes()
+            current = self._connections.get(conn_id)
+            if not current:
                 self._connections[conn_id] = conn
-                # In case we're running into troubles with keeping the
-                # connections alive we should place here:
-                # conn.setKeepAlive(interval=5, count=3)
-                # However the values need to be considered wisely to not affect
-                # hosts which are hosting a lot of virtual machines
-            return conn
+                return conn
+
+        # another thread opened the same connection first
+        conn.close()
+        return current
+
+    @contextlib.contextmanager
+    def borrow(self):
+        """
+        Lend a connection of the pool for the duration of the block, so a
+        slow libvirt call does not delay the other requests waiting on the
+        shared connection returned by get().
+
+        The objects looked up on the borrowed connection must not be used
+        after the block. OperationFailed is raised when libvirt cannot be
+        reached.
+        """
+        slot = self._pool.acquire()
+        try:
+            conn = self.get(slot)
+            if conn is None:
+                raise OperationFailed('KCHCONN0001E')
+            yield conn
+        finally:
+            self._pool.release(slot)
+
+    def get_stats(self):
+        """
+        Return the usage statistics of the connection pool and the state of
+        the connection to libvirt.
+        """
+        stats = self._pool.get_stats()
+        stats['connected'] = self._reconnector.connected.is_set()
+        stats['reconnect_attempts'] = self._reconnector.attempts
+        return stats
+
+    def _setup_connection(self, conn):
+        for name in dir(libvirt.virConnect):
+            method = getattr(conn, name)
+            if callable(method) and not name.startswith('_'):
+                setattr(conn, name, self._wrap_method(
+                    method, f'virConnect.{name}', conn))
+
+        # keepalive requires the libvirt event loop to be registered
+        try:
+            conn.setKeepAlive(KEEPALIVE_INTERVAL, KEEPALIVE_COUNT)
+        except libvirt.libvirtError as e:
+            wok_log.debug(
+                f'Unable to enable libvirt keepalive: {e.get_error_message()}')
+
+    def _wrap_classes(self):
+        if LibvirtConnection._wrapped:
+            return
+
+        for cls in self.wrappables:
+            for name in dir(cls):
+                method = getattr(cls, name)
+                if callable(method) and not name.startswith('_'):
+                    setattr(cls, name, self._wrap_method(
+                        method, f'{cls.__name__}.{name}'))
+        LibvirtConnection._wrapped = True
 
     def _get_new_connection(self):
-        retries = 5
-        while True:
-            retries = retries - 1
+        # wait for the background reconnection instead of trying to connect
+        # again from each request while libvirt is down
+        for attempt in range(2):
+            if not self._reconnector.wait():
+                break
+
             try:
                 return libvirt.open(self.uri)
             except libvirt.libvirtError:
                 wok_log.error('Unable to connect to libvirt.')
-                if not retries:
-                    wok_log.error(
-                        'Unable to establish connection '
-                        'with libvirt. Please check '
-                        'your libvirt URI which is often '
-                        'defined in '
-                        '/etc/libvirt/libvirt.conf'
-                    )
-                    add_notification(
-                        'KCHCONN0001E', plugin_name='/plugins/kimchi'
-                    )
-                    return None
-            time.sleep(2)
+                self._reconnector.start()
+
+        wok_log.error(
+            'Unable to establish connection '
+            'with libvirt. Please check '
+            'your libvirt URI which is often '
+            'defined in '
+            '/etc/libvirt/libvirt.conf'
+        )
+        add_notification('KCHCONN0001E', plugin_name='/plugins/kimchi')
+        return None
 
     def isQemuURI(self):
         """
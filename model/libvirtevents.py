@@ -26,6 +26,10 @@ from wok.model.notifications import add_notification
 from wok.utils import wok_log
 
 
+# seconds between two runs of the timer measuring the event loop lag
+HEARTBEAT_INTERVAL = 1
+
+
 class LibvirtEvents(object):
     def __init__(self):
         # Register default implementation of event handlers
@@ -42,8 +46,13 @@ class LibvirtEvents(object):
         self.event_loop_thread.setDaemon(True)
         self.event_loop_thread.start()
 
-        # Set an event timeout to control the self._event_loop_run
-        if libvirt.virEventAddTimeout(0, self._kimchi_EventTimeout, None) < 0:
+        # The event loop sleeps until a watched file descriptor or a timer is
+        # ready. This timer only measures how late the loop runs callbacks.
+        self._loop_stats = {'lag': 0.0, 'max_lag': 0.0, 'heartbeats': 0}
+        self._next_heartbeat = time.monotonic() + HEARTBEAT_INTERVAL
+        if libvirt.virEventAddTimeout(
+            HEARTBEAT_INTERVAL * 1000, self._heartbeat, None
+        ) < 0:
             raise OperationFailed('KCHEVENT0002E')
 
     # Event loop method to be executed in background as thread
@@ -55,9 +64,21 @@ class LibvirtEvents(object):
     def is_event_loop_alive(self):
         return self.event_loop_thread.isAlive()
 
-    # Event loop handler used to limit length of waiting for any other event.
-    def _kimchi_EventTimeout(self, timer, opaque):
-        time.sleep(0.01)
+    def _heartbeat(self, timer, opaque):
+        now = time.monotonic()
+        lag = max(now - self._next_heartbeat, 0.0)
+        self._next_heartbeat = now + HEARTBEAT_INTERVAL
+        self._loop_stats['lag'] = lag
+        self._loop_stats['max_lag'] = max(self._loop_stats['max_lag'], lag)
+        self._loop_stats['heartbeats'] += 1
+
+    def get_loop_stats(self):
+        """
+        Return the delay in seconds of the last run of the event loop timer
+        ("lag"), the highest delay ("max_lag") and the number of runs. A high
+        lag means a callback is blocking the loop.
+        """
+        return dict(self._loop_stats)
 
     def event_enospc_cb(self, conn, dom, path, dev, action, reason, args):
         if reason == 'enospc':
@@ -126,12 +147,64 @@ class LibvirtEvents(object):
                 wok_log.error(
                     f'Unable to register pool event handler: {str(e)}')
 
+    def registerPoolChangeEvents(self, conn, cb, arg):
+        """
+        Register libvirt events to listen to any change in the storage pools.
+        <cb> receives the changed pool and whether it was just refreshed.
+        """
+        def lifecycle_cb(conn, pool, event, detail, opaque):
+            return cb(pool, False, opaque)
+
+        def refresh_cb(conn, pool, opaque):
+            return cb(pool, True, opaque)
+
+        events = [
+            (libvirt.VIR_STORAGE_POOL_EVENT_ID_LIFECYCLE, lifecycle_cb),
+            (libvirt.VIR_STORAGE_POOL_EVENT_ID_REFRESH, refresh_cb),
+        ]
+
+        for ev, ev_cb in events:
+            try:
+                conn.get().storagePoolEventRegisterAny(None, ev, ev_cb, arg)
+            except (AttributeError, libvirt.libvirtError) as e:
+                wok_log.error(
+                    f'Unable to register pool event handler: {str(e)}')
+
+    def registerNodeDeviceEvents(self, conn, cb, arg):
+        """
+        Register libvirt events to listen to any host device added, removed
+        or changed. <cb> receives the changed device.
+        Returns: True when all the events were registered
+        """
+        def lifecycle_cb(conn, dev, event, detail, opaque):
+            return cb(dev, opaque)
+
+        def update_cb(conn, dev, opaque):
+            return cb(dev, opaque)
+
+        events = [
+            (libvirt.VIR_NODE_DEVICE_EVENT_ID_LIFECYCLE, lifecycle_cb),
+            (libvirt.VIR_NODE_DEVICE_EVENT_ID_UPDATE, update_cb),
+        ]
+
+        registered = True
+        for ev, ev_cb in events:
+            try:
+                conn.get().nodeDeviceEventRegisterAny(None, ev, ev_cb, arg)
+            except (AttributeError, libvirt.libvirtError) as e:
+                wok_log.error(
+                    f'Unable to register node device event handler: {str(e)}')
+                registered = False
+        return registered
+
     def registerNetworkEvents(self, conn, cb, arg):
         """
-        Register libvirt events to listen to any network change
+        Register libvirt events to listen to any network defined, undefined,
+        started or stopped. <cb> receives the changed network.
+        Returns: True when the events were registered
         """
-        def lifecycle_cb(conn, dom, event, detail, opaque):
-            return cb(opaque)
+        def lifecycle_cb(conn, net, event, detail, opaque):
+            return cb(net, opaque)
 
         try:
             conn.get().networkEventRegisterAny(
@@ -140,9 +213,11 @@ class LibvirtEvents(object):
                 lifecycle_cb,
                 arg
             )
-        except libvirt.libvirtError as e:
+        except (AttributeError, libvirt.libvirtError) as e:
             wok_log.error(
                 f'Unable to register network event handler: {str(e)}')
+            return False
+        return True
 
     def registerDomainEvents(self, conn, cb, arg):
         """
@@ -165,3 +240,35 @@ class LibvirtEvents(object):
             except libvirt.libvirtError as e:
                 wok_log.error(
                     f'Unable to register domain event handler: {str(e)}')
+
+    def registerDomainChangeEvents(self, conn, cb, arg):
+        """
+        Register libvirt events to listen to any change in the definition,
+        state or devices of the domains. <cb> receives the changed domain.
+        Returns: True when all the events were registered
+        """
+        def lifecycle_cb(conn, dom, event, detail, opaque):
+            return cb(dom, opaque)
+
+        def device_cb(conn, dom, dev, opaque):
+            return cb(dom, opaque)
+
+        def metadata_cb(conn, dom, mtype, nsuri, opaque):
+            return cb(dom, opaque)
+
+        events = [
+            (libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, lifecycle_cb),
+            (libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_ADDED, device_cb),
+            (libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED, device_cb),
+            (libvirt.VIR_DOMAIN_EVENT_ID_METADATA_CHANGE, metadata_cb),
+        ]
+
+        registered = True
+        for ev, ev_cb in events:
+            try:
+                conn.get().domainEventRegisterAny(None, ev, ev_cb, arg)
+            except (AttributeError, libvirt.libvirtError) as e:
+                wok_log.error(
+                    f'Unable to register domain event handler: {str(e)}')
+                registered = False
+        return registered
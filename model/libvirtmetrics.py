@@ -0,0 +1,149 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import bisect
+import threading
+
+
+# upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+
+class CallMetrics(object):
+    """
+    Count the calls, the errors and the latency of each libvirt API, such as
+    "virDomain.XMLDesc", to find out which calls make a request slow.
+
+    Recording a call only takes a lock and a few additions.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # key: API name; value: [calls, errors, total time, bucket counts]
+        self._apis = {}
+        self._lock = threading.Lock()
+
+    def record(self, api, elapsed, failed=False):
+        index = bisect.bisect_left(self.buckets, elapsed)
+        with self._lock:
+            entry = self._apis.get(api)
+            if entry is None:
+                entry = self._apis[api] = [
+                    0, 0, 0.0, [0] * (len(self.buckets) + 1)]
+            entry[0] += 1
+            if failed:
+                entry[1] += 1
+            entry[2] += elapsed
+            entry[3][index] += 1
+
+    def reset(self):
+        with self._lock:
+            self._apis.clear()
+
+    def get_stats(self):
+        """
+        Return a dict with, for each API called: the number of calls and
+        errors, the total time in seconds and the cumulative number of calls
+        which lasted at most each bucket bound ("+Inf" for all of them).
+        """
+        with self._lock:
+            apis = {
+                api: (calls, errors, total, list(counts))
+                for api, (calls, errors, total, counts) in self._apis.items()
+            }
+
+        stats = {}
+        bounds = [str(b) for b in self.buckets] + ['+Inf']
+        for api, (calls, errors, total, counts) in apis.items():
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                buckets[bound] = cumulative
+            stats[api] = {
+                'calls': calls,
+                'errors': errors,
+                'time': total,
+                'buckets': buckets,
+            }
+        return stats
+
+    def to_prometheus(self, gauges=None, counters=None):
+        """
+        Return the statistics in the Prometheus text exposition format, with
+        the values of the dict <gauges> as kimchi_libvirt_<key> gauges and the
+        ones of the dict <counters>, which only increase, as
+        kimchi_libvirt_<key>_total counters.
+        """
+        lines = [
+            '# HELP kimchi_libvirt_call_duration_seconds '
+            'Duration of the libvirt API calls.',
+            '# TYPE kimchi_libvirt_call_duration_seconds histogram',
+        ]
+        stats = self.get_stats()
+        for api in sorted(stats):
+            api_stats = stats[api]
+            for bound, count in api_stats['buckets'].items():
+                lines.append(
+                    f'kimchi_libvirt_call_duration_seconds_bucket'
+                    f'{{api="{api}",le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'kimchi_libvirt_call_duration_seconds_sum{{api="{api}"}} '
+                f'{api_stats["time"]}'
+            )
+            lines.append(
+                f'kimchi_libvirt_call_duration_seconds_count{{api="{api}"}} '
+                f'{api_stats["calls"]}'
+            )
+
+        lines += [
+            '# HELP kimchi_libvirt_calls_total '
+            'Number of libvirt API calls.',
+            '# TYPE kimchi_libvirt_calls_total counter',
+        ]
+        for api in sorted(stats):
+            lines.append(
+                f'kimchi_libvirt_calls_total{{api="{api}"}} '
+                f'{stats[api]["calls"]}'
+            )
+
+        lines += [
+            '# HELP kimchi_libvirt_call_errors_total '
+            'Number of libvirt API calls which failed.',
+            '# TYPE kimchi_libvirt_call_errors_total counter',
+        ]
+        for api in sorted(stats):
+            lines.append(
+                f'kimchi_libvirt_call_errors_total{{api="{api}"}} '
+                f'{stats[api]["errors"]}'
+            )
+
+        for name, value in sorted((gauges or {}).items()):
+            metric = f'kimchi_libvirt_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {float(value)}')
+        for name, value in sorted((counters or {}).items()):
+            metric = f'kimchi_libvirt_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {float(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# calls of all the libvirt connections
+call_metrics = CallMetrics()
@@ -16,11 +16,25 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import cherrypy
 from wok.basemodel import BaseModel
 from wok.objectstore import ObjectStore
 from wok.plugins.kimchi import config
+from wok.plugins.kimchi.model.deviceinventory import get_device_inventory
+from wok.plugins.kimchi.model.domaininventory import get_domain_inventory
+from wok.plugins.kimchi.model.libvirtconnection import DEFAULT_POOL_SIZE
 from wok.plugins.kimchi.model.libvirtconnection import LibvirtConnection
 from wok.plugins.kimchi.model.libvirtevents import LibvirtEvents
+from wok.plugins.kimchi.model.networkinventory import get_network_inventory
+from wok.plugins.kimchi.model.poolhealth import DEFAULT_CHECK_INTERVAL
+from wok.plugins.kimchi.model.poolhealth import get_pool_health_monitor
+from wok.plugins.kimchi.model.poolrefresh import DEFAULT_REFRESH_WINDOW
+from wok.plugins.kimchi.model.poolrefresh import get_pool_refresher
+from wok.plugins.kimchi.model.storagevolumes import reap_stale_uploads
+from wok.plugins.kimchi.model.storagevolumes import UPLOAD_REAP_INTERVAL
+from wok.plugins.kimchi.model.vmstats import DEFAULT_HISTORY
+from wok.plugins.kimchi.model.vmstats import DEFAULT_INTERVAL
+from wok.plugins.kimchi.model.vmstats import get_vm_stats_sampler
 from wok.pushserver import send_wok_notification
 from wok.utils import get_all_model_instances
 from wok.utils import get_model_instances
@@ -29,21 +43,59 @@ from wok.utils import get_model_instances
 class Model(BaseModel):
     def __init__(self, libvirt_uri=None, objstore_loc=None):
 
+        kimchi_opts = config.config.get('kimchi', {})
         self.objstore = ObjectStore(objstore_loc or config.get_object_store())
-        self.conn = LibvirtConnection(libvirt_uri)
+        self.conn = LibvirtConnection(
+            libvirt_uri,
+            int(kimchi_opts.get('libvirt_pool_size', DEFAULT_POOL_SIZE)),
+        )
 
         # Register for libvirt events
         self.events = LibvirtEvents()
         self.events.handleEnospc(self.conn)
         self.events.registerPoolEvents(self.conn, self._events_handler,
                                        'storages')
-        self.events.registerNetworkEvents(self.conn, self._events_handler,
+        self.events.registerNetworkEvents(self.conn,
+                                          self._network_events_handler,
                                           'networks')
         self.events.registerDomainEvents(self.conn, self._events_handler,
                                          'vms')
+        get_domain_inventory(self.conn).watch(self.events)
+        get_device_inventory(self.conn).watch(self.events)
+        get_network_inventory(self.conn).watch(self.events)
+
+        refresher = get_pool_refresher(self.conn)
+        refresher.window = int(
+            kimchi_opts.get('pool_refresh_window', DEFAULT_REFRESH_WINDOW))
+        refresher.watch(self.events)
+
+        # Check the NFS and iSCSI servers in background
+        monitor = get_pool_health_monitor(self.conn)
+        monitor.interval = int(
+            kimchi_opts.get('pool_check_interval', DEFAULT_CHECK_INTERVAL))
+        monitor.start()
+        cherrypy.engine.subscribe('stop', monitor.stop)
+
+        # Abort the volume uploads abandoned by the clients
+        self.upload_reaper = cherrypy.process.plugins.BackgroundTask(
+            UPLOAD_REAP_INTERVAL, reap_stale_uploads, args=[self.conn]
+        )
+        self.upload_reaper.setName('KimchiUploadReaper')
+        self.upload_reaper.setDaemon(True)
+        self.upload_reaper.start()
+        cherrypy.engine.subscribe('stop', self.upload_reaper.cancel)
+
+        # Sample the statistics of all running VMs in background
+        self.vmstats = get_vm_stats_sampler(self.conn)
+        self.vmstats.interval = int(
+            kimchi_opts.get('stats_interval', DEFAULT_INTERVAL))
+        self.vmstats.history = int(
+            kimchi_opts.get('stats_history', DEFAULT_HISTORY))
+        self.vmstats.start()
+        cherrypy.engine.subscribe('stop', self.vmstats.stop)
 
         kargs = {'objstore': self.objstore, 'conn': self.conn,
-                 'eventsloop': self.events}
+                 'eventsloop': self.events, 'vmstats': self.vmstats}
 
         models = get_all_model_instances(__name__, __file__, kargs)
 
@@ -58,3 +110,6 @@ class Model(BaseModel):
         # Do not use any known method (POST, PUT, DELETE) as it is used by Wok
         # engine and may lead in having 2 notifications for the same action
         send_wok_notification('/plugins/kimchi', api, 'METHOD')
+
+    def _network_events_handler(self, net, api):
+        self._events_handler(api)
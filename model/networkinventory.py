@@ -0,0 +1,107 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import ipaddress
+
+import libvirt
+from wok.plugins.kimchi.model.inventory import EventInventory
+from wok.plugins.kimchi.model.inventory import get_inventory
+from wok.utils import wok_log
+from wok.xmlutils.utils import xpath_get_text
+
+
+XPATH_IPV4 = "/network/ip[not(@family) or @family='ipv4'][1]"
+
+
+def get_network_inventory(conn):
+    """
+    Return the network inventory shared by all the users of the libvirt
+    connection <conn>.
+    """
+    return get_inventory(NetworkInventory, conn)
+
+
+class NetworkInventory(EventInventory):
+    """
+    In-process inventory of the IPv4 subnets of the libvirt networks, keyed
+    by network name, to find a free subnet without reading the XML of all
+    the networks.
+
+    The inventory is built once from listAllNetworks() and then only the
+    networks reported as changed by the network lifecycle events or by
+    Kimchi through invalidate(), by network name, are read again.
+    """
+
+    def __init__(self, conn):
+        super(NetworkInventory, self).__init__(conn)
+        # key: network name; value: IPv4Network or None
+        self._subnets = {}
+
+    def _network_changed_cb(self, net, opaque):
+        self.invalidate(net.name())
+
+    def get_subnets(self):
+        """Return the IPv4Network of all the networks having a subnet"""
+        self._refresh()
+        with self._lock:
+            return [net for net in self._subnets.values() if net is not None]
+
+    def _register(self, events):
+        return events.registerNetworkEvents(
+            self.conn, self._network_changed_cb, None
+        )
+
+    def _load(self, conn):
+        subnets = {}
+        for net in conn.listAllNetworks(0):
+            try:
+                subnets[net.name()] = self._get_subnet(net)
+            except libvirt.libvirtError as e:
+                # Network might be deleted just after we get the list.
+                # This is OK, just skip.
+                wok_log.debug(f'Error processing network: {e}')
+        return {'_subnets': subnets}
+
+    def _update(self, conn, names):
+        subnets = dict(self._subnets)
+        for name in names:
+            try:
+                net = conn.networkLookupByName(name)
+                subnets[name] = self._get_subnet(net)
+            except libvirt.libvirtError as e:
+                if e.get_error_code() != libvirt.VIR_ERR_NO_NETWORK:
+                    raise
+                # the network was undefined
+                subnets.pop(name, None)
+        return {'_subnets': subnets}
+
+    @staticmethod
+    def _get_subnet(net):
+        xml = net.XMLDesc(0)
+        address = xpath_get_text(xml, XPATH_IPV4 + '/@address')
+        netmask = xpath_get_text(xml, XPATH_IPV4 + '/@netmask')
+        prefix = xpath_get_text(xml, XPATH_IPV4 + '/@prefix')
+        if not address or not (netmask or prefix):
+            return None
+
+        mask = netmask[0] if netmask else prefix[0]
+        try:
+            return ipaddress.IPv4Network(f'{address[0]}/{mask}', False)
+        except ValueError as e:
+            wok_log.debug(f'Invalid subnet of network {net.name()}: {e}')
+            return None
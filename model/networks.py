@@ -29,7 +29,9 @@ from wok.exception import NotFoundError
 from wok.exception import OperationFailed
 from wok.plugins.kimchi import network as netinfo
 from wok.plugins.kimchi.config import kimchiPaths
+from wok.plugins.kimchi.model.domaininventory import get_domain_inventory
 from wok.plugins.kimchi.model.featuretests import FeatureTests
+from wok.plugins.kimchi.model.networkinventory import get_network_inventory
 from wok.plugins.kimchi.osinfo import defaults as tmpl_defaults
 from wok.plugins.kimchi.xmlutils.interface import get_iface_xml
 from wok.plugins.kimchi.xmlutils.network import create_linux_bridge_xml
@@ -113,6 +115,9 @@ class NetworksModel(object):
             raise OperationFailed(
                 'KCHNET0008E', {'name': name, 'err': e.get_error_message()}
             )
+        finally:
+            # the event of the new network is delivered asynchronously
+            get_network_inventory(self.conn).invalidate(name)
 
         return name
 
@@ -122,17 +127,9 @@ class NetworksModel(object):
         return sorted(names)
 
     def _get_available_address(self, addr_pools=None):
-        if addr_pools is None:
-            addr_pools = []
-
-        invalid_addrs = []
-        for net_name in self.get_list():
-            network = NetworkModel.get_network(self.conn.get(), net_name)
-            xml = network.XMLDesc(0)
-            subnet = NetworkModel.get_network_from_xml(xml)['subnet']
-            subnet and invalid_addrs.append(ipaddress.IPv4Network(subnet, False))
-            addr_pools = addr_pools if addr_pools else netinfo.PrivateNets
-        return netinfo.get_one_free_network(invalid_addrs, addr_pools)
+        used_nets = get_network_inventory(self.conn).get_subnets()
+        return netinfo.get_one_free_network(
+            used_nets, addr_pools or netinfo.PrivateNets)
 
     def _set_network_subnet(self, params):
         netaddr = params.get('subnet', '')
@@ -166,6 +163,7 @@ class NetworksModel(object):
             # Add a delay to wait for the link change takes into effect.
             for i in range(10):
                 time.sleep(1)
+                netinfo.invalidate_netinfo()
                 if netinfo.operstate(iface) == 'up':
                     break
             else:
@@ -276,6 +274,8 @@ class NetworksModel(object):
             raise OperationFailed(
                 'KCHNET0025E', {'name': name, 'err': e.get_error_message()}
             )
+        finally:
+            netinfo.invalidate_netinfo()
 
     def _create_linux_bridge(self, interface):
         # get xml definition of interface
@@ -439,18 +439,13 @@ class NetworkModel(object):
         }
         state = DOM_STATE_MAP.get(filter)
         vms = []
-        conn = self.conn.get()
-        for dom in conn.listAllDomains(0):
-            networks = self._vm_get_networks(dom)
-            if network in networks and (state is None or state == dom.state(0)[0]):
-                vms.append(dom.name())
+        for domain in get_domain_inventory(self.conn).get_domains():
+            if network in domain['networks'] and (
+                state is None or state == domain['state']
+            ):
+                vms.append(domain['libvirt_name'])
         return vms
 
-    def _vm_get_networks(self, dom):
-        xml = dom.XMLDesc(0)
-        xpath = "/domain/devices/interface[@type='network']/source/@network"
-        return xpath_get_text(xml, xpath)
-
     def activate(self, name):
         network = self.get_network(self.conn.get(), name)
         try:
@@ -458,6 +453,9 @@ class NetworkModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed(
                 'KCHNET0022E', {'name': name, 'err': e.message})
+        finally:
+            # libvirt creates the bridge of the network
+            netinfo.invalidate_netinfo()
 
     def deactivate(self, name):
         in_use, used_by_vms, used_by_tmpls = self._is_network_in_use(name)
@@ -470,6 +468,7 @@ class NetworkModel(object):
 
         network = self.get_network(self.conn.get(), name)
         network.destroy()
+        netinfo.invalidate_netinfo()
 
     def delete(self, name):
         in_use, used_by_vms, used_by_tmpls = self._is_network_in_use(name)
@@ -486,6 +485,7 @@ class NetworkModel(object):
 
         self._remove_bridge(network)
         network.undefine()
+        get_network_inventory(self.conn).invalidate(name)
 
     @staticmethod
     def get_network(conn, name):
@@ -536,6 +536,7 @@ class NetworkModel(object):
                 iface = conn.interfaceLookupByName(bridge)
                 iface.isActive() and iface.destroy(0)
                 iface.undefine()
+                netinfo.invalidate_netinfo()
 
     def update(self, name, params):
         info = self.lookup(name)
@@ -0,0 +1,198 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import copy
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import cherrypy
+from wok.plugins.kimchi.model.libvirtstoragepool import StoragePoolDef
+from wok.utils import wok_log
+
+
+# seconds between two checks of a reachable storage server
+DEFAULT_CHECK_INTERVAL = 60
+# longest delay between two checks of an unreachable storage server
+MAX_CHECK_INTERVAL = 600
+# seconds between two runs of the monitor
+MONITOR_TICK = 5
+# storage servers checked at once, so a hung server does not delay the others
+CHECK_WORKERS = 4
+
+# storage pool types whose source is checked
+MONITORED_POOL_TYPES = ['netfs', 'iscsi']
+
+# key: libvirt URI; value: PoolHealthMonitor
+_monitors = {}
+_monitors_lock = threading.Lock()
+
+
+def get_pool_health_monitor(conn):
+    """
+    Return the storage server health monitor shared by all the users of the
+    libvirt connection <conn>.
+    """
+    with _monitors_lock:
+        monitor = _monitors.get(conn.uri)
+        if monitor is None:
+            monitor = _monitors[conn.uri] = PoolHealthMonitor(conn)
+        return monitor
+
+
+class PoolHealthMonitor(object):
+    """
+    Check in background whether the storage servers of the NFS and iSCSI pools
+    are reachable, so the requests read the last known state instead of
+    trying to mount the export or to log into the target every time.
+
+    Each pool is checked every <interval> seconds while its server is
+    reachable. The delay is doubled after every failed check, up to
+    MAX_CHECK_INTERVAL seconds.
+    """
+
+    def __init__(self, conn, interval=DEFAULT_CHECK_INTERVAL):
+        self.conn = conn
+        self.interval = interval
+        # key: pool name; value: dict with the pool arguments, the last known
+        # state and the time of the next check
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._workers = None
+        self.monitor_thread = None
+
+    def start(self):
+        # the monitor is shared by the models of the same connection
+        if self.monitor_thread is not None:
+            return
+
+        self._workers = ThreadPool(processes=CHECK_WORKERS)
+        # Using cherrypy BackgroundTask class due to issues when using
+        # threading module with cherrypy.
+        self.monitor_thread = cherrypy.process.plugins.BackgroundTask(
+            MONITOR_TICK, self._run
+        )
+        self.monitor_thread.setName('KimchiPoolHealthMonitor')
+        self.monitor_thread.setDaemon(True)
+        self.monitor_thread.start()
+
+    def stop(self):
+        if self.monitor_thread is None:
+            return
+
+        self.monitor_thread.cancel()
+        self.monitor_thread = None
+        self._workers.terminate()
+        self._workers = None
+
+    def is_online(self, pool_args, recheck=False):
+        """
+        Return whether the server of the pool described by <pool_args> (as
+        given to StoragePoolDef.create()) was reachable on its last check.
+
+        The pool is checked at once the first time it is seen, so only the
+        first request for a pool waits for the check, or when <recheck> is
+        True, for the actions that must not rely on a stale state.
+        """
+        name = pool_args['name']
+        with self._lock:
+            entry = self._pools.get(name)
+            if entry is None or entry['args'] != pool_args:
+                entry = self._pools[name] = {
+                    'args': copy.deepcopy(pool_args),
+                    'online': None,
+                    'checked': None,
+                    'changed': None,
+                    'failures': 0,
+                    'next': 0,
+                    'checking': False,
+                }
+
+            online = entry['online']
+            if not recheck and (online is not None or entry['checking']):
+                return online is not False
+            entry['checking'] = True
+
+        return self._check(name, entry)
+
+    def get_status(self, name):
+        """
+        Return a dict with the last known state of the pool <name>: "online"
+        (None when it was not checked yet) and the time of the last check
+        ("checked") and of the last state change ("changed").
+        """
+        with self._lock:
+            entry = self._pools.get(name)
+            if entry is None:
+                return {'online': None, 'checked': None, 'changed': None}
+            return {k: entry[k] for k in ('online', 'checked', 'changed')}
+
+    def forget(self, name=None):
+        """Stop checking the pool <name>, or all the pools when None"""
+        with self._lock:
+            if name is None:
+                self._pools.clear()
+            else:
+                self._pools.pop(name, None)
+
+    def _check(self, name, entry):
+        try:
+            StoragePoolDef.create(entry['args']).prepare(self.conn.get())
+            online = True
+        except Exception as e:
+            wok_log.debug(f'Storage server of pool {name} is unreachable: {e}')
+            online = False
+
+        now = time.time()
+        with self._lock:
+            entry['checking'] = False
+            entry['checked'] = now
+            if entry['online'] != online:
+                entry['changed'] = now
+                if entry['online'] is not None:
+                    state = 'online' if online else 'offline'
+                    wok_log.info(f'Storage pool {name} is {state}')
+            entry['online'] = online
+
+            if online:
+                entry['failures'] = 0
+                delay = self.interval
+            else:
+                entry['failures'] += 1
+                delay = min(
+                    self.interval * 2 ** (entry['failures'] - 1),
+                    MAX_CHECK_INTERVAL
+                )
+            entry['next'] = time.monotonic() + delay
+        return online
+
+    def _run(self):
+        now = time.monotonic()
+        with self._lock:
+            due = []
+            for name, entry in self._pools.items():
+                if not entry['checking'] and entry['next'] <= now:
+                    entry['checking'] = True
+                    due.append((name, entry))
+
+        workers = self._workers
+        for name, entry in due:
+            if workers is None:
+                entry['checking'] = False
+                continue
+            workers.apply_async(self._check, (name, entry))
@@ -0,0 +1,158 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import threading
+import time
+
+
+# seconds during which a storage pool is not refreshed again
+DEFAULT_REFRESH_WINDOW = 5
+
+# key: libvirt URI; value: PoolRefresher
+_refreshers = {}
+_refreshers_lock = threading.Lock()
+
+
+def get_pool_refresher(conn):
+    """
+    Return the storage pool refresher shared by all the users of the libvirt
+    connection <conn>.
+    """
+    with _refreshers_lock:
+        refresher = _refreshers.get(conn.uri)
+        if refresher is None:
+            refresher = _refreshers[conn.uri] = PoolRefresher(conn)
+        return refresher
+
+
+class PoolRefresher(object):
+    """
+    Coordinate the refreshes of the storage pools of a libvirt connection, as
+    refreshing a pool with many files or on network storage takes seconds.
+
+    Concurrent refresh requests for the same pool share a single refresh, and
+    a pool refreshed less than <window> seconds ago is not refreshed again.
+    A pool is refreshed on next request when Kimchi changes its volumes
+    through invalidate() or when libvirt reports a lifecycle event for it.
+    Refresh events only mark the pool as up to date, as libvirt has just
+    refreshed it.
+    """
+
+    def __init__(self, conn, window=DEFAULT_REFRESH_WINDOW):
+        self.conn = conn
+        self.window = window
+        self._events = None
+        # virConnect the pool events were registered on
+        self._watched_conn = None
+        # key: pool name; value: dict with the time of the last refresh, the
+        # Event of the refresh in progress and a counter of invalidations
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def watch(self, events):
+        """
+        Invalidate the pools reported as changed by the storage pool events
+        delivered by the LibvirtEvents instance <events>.
+        """
+        with self._lock:
+            self._events = events
+            self._watched_conn = None
+
+    def invalidate(self, pool_name=None):
+        """
+        Refresh the pool <pool_name> on next request. All the pools are
+        refreshed again when <pool_name> is None.
+        """
+        with self._lock:
+            self._invalidate(pool_name)
+
+    def _invalidate(self, pool_name=None):
+        names = list(self._pools) if pool_name is None else [pool_name]
+        for name in names:
+            state = self._get_state(name)
+            state['last'] = None
+            state['generation'] += 1
+
+    def _pool_changed_cb(self, pool, refreshed, opaque):
+        if not refreshed:
+            self.invalidate(pool.name())
+            return
+
+        with self._lock:
+            state = self._get_state(pool.name())
+            if state['running'] is None:
+                state['last'] = time.monotonic()
+
+    def _get_state(self, name):
+        return self._pools.setdefault(
+            name, {'last': None, 'running': None, 'generation': 0}
+        )
+
+    def _watch_conn(self):
+        if self._events is None:
+            return
+
+        conn = self.conn.get()
+        if conn is self._watched_conn:
+            return
+
+        # the callbacks are lost when the connection is recycled
+        self._events.registerPoolChangeEvents(
+            self.conn, self._pool_changed_cb, None)
+        self._watched_conn = conn
+        self._invalidate()
+
+    def refresh(self, pool):
+        """
+        Refresh the virStoragePool <pool> unless it was refreshed recently.
+        When the pool is already being refreshed, wait for that refresh
+        instead of starting a new one.
+        """
+        name = pool.name()
+        while True:
+            with self._lock:
+                self._watch_conn()
+                state = self._get_state(name)
+                running = state['running']
+                if running is None:
+                    last = state['last']
+                    if last is not None and (
+                        time.monotonic() - last < self.window
+                    ):
+                        return
+
+                    running = state['running'] = threading.Event()
+                    generation = state['generation']
+                    break
+
+            # the pool is read again if it was invalidated during the refresh
+            running.wait()
+
+        started = time.monotonic()
+        refreshed = False
+        try:
+            # a refresh may take long, do not hold the shared connection
+            with self.conn.borrow() as conn:
+                conn.storagePoolLookupByName(name).refresh(0)
+            refreshed = True
+        finally:
+            with self._lock:
+                if refreshed and state['generation'] == generation:
+                    state['last'] = started
+                state['running'] = None
+            running.set()
@@ -27,9 +27,17 @@ from wok.exception import OperationFailed
 from wok.plugins.kimchi.config import config
 from wok.plugins.kimchi.config import get_kimchi_version
 from wok.plugins.kimchi.config import kimchiPaths
+from wok.plugins.kimchi.disks import find_block_device
+from wok.plugins.kimchi.disks import get_vg
+from wok.plugins.kimchi.disks import invalidate_block_devices
+from wok.plugins.kimchi.disks import invalidate_lvm
 from wok.plugins.kimchi.model.config import CapabilitiesModel
+from wok.plugins.kimchi.model.domaininventory import get_domain_inventory
 from wok.plugins.kimchi.model.host import DeviceModel
 from wok.plugins.kimchi.model.libvirtstoragepool import StoragePoolDef
+from wok.plugins.kimchi.model.poolhealth import get_pool_health_monitor
+from wok.plugins.kimchi.model.poolhealth import MONITORED_POOL_TYPES
+from wok.plugins.kimchi.model.poolrefresh import get_pool_refresher
 from wok.plugins.kimchi.osinfo import defaults as tmpl_defaults
 from wok.plugins.kimchi.scan import Scanner
 from wok.plugins.kimchi.utils import is_s390x
@@ -70,7 +78,7 @@ class StoragePoolsModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
-        self.scanner = Scanner(self._clean_scan)
+        self.scanner = Scanner(self._clean_scan, self.objstore)
         self.scanner.delete()
         self.caps = CapabilitiesModel(**kargs)
         self.device = DeviceModel(**kargs)
@@ -158,19 +166,11 @@ class StoragePoolsModel(object):
                 'KCHPOOL0006E', {'err': e.get_error_message()})
 
     def _check_lvm(self, name, from_vg):
-        vgdisplay_cmd = ['vgdisplay', name]
-        output, error, returncode = run_command(vgdisplay_cmd)
-        # From vgdisplay error codes:
-        # 1  error reading VGDA
-        # 2  volume group doesn't exist
-        # 3  not all physical volumes of volume group online
-        # 4  volume group not found
-        # 5  no volume groups found at all
-        # 6  error reading VGDA from lvmtab
-        if from_vg and returncode in [2, 4, 5]:
+        vg_exists = get_vg(name) is not None
+        if from_vg and not vg_exists:
             raise InvalidOperation('KCHPOOL0038E', {'name': name})
 
-        if not from_vg and returncode not in [2, 4, 5]:
+        if not from_vg and vg_exists:
             raise InvalidOperation('KCHPOOL0036E', {'name': name})
 
     def create(self, params):
@@ -234,6 +234,11 @@ class StoragePoolsModel(object):
         except Exception:
             pass
 
+        if params['type'] == 'logical':
+            # the disks are now physical volumes of the new volume group
+            invalidate_block_devices()
+            invalidate_lvm()
+
         if params['type'] == 'netfs':
             output, error, returncode = run_command(
                 ['setsebool', '-P', 'virt_use_nfs=1']
@@ -309,8 +314,7 @@ class StoragePoolModel(object):
             return 0
 
         try:
-            pool.refresh(0)
-
+            get_pool_refresher(self.conn).refresh(pool)
         except Exception as e:
             wok_log.error(f'Pool refresh failed: {e}')
 
@@ -331,23 +335,31 @@ class StoragePoolModel(object):
                 source[key] = res
         return source
 
-    def _nfs_status_online(self, pool, poolArgs=None):
-        if not poolArgs:
-            xml = pool.XMLDesc(0)
-            pool_type = xpath_get_text(xml, '/pool/@type')[0]
-            source = self._get_storage_source(pool_type, xml)
-            poolArgs = {}
-            poolArgs['name'] = pool.name()
-            poolArgs['type'] = pool_type
-            poolArgs['source'] = {
-                'path': source['path'], 'host': source['addr']}
-        conn = self.conn.get()
-        poolDef = StoragePoolDef.create(poolArgs)
-        try:
-            poolDef.prepare(conn)
+    def _source_online(self, pool, pool_xml, recheck=False):
+        """
+        Return whether the storage server of the NFS or iSCSI pool <pool> was
+        reachable on its last background check, or on a new check when
+        <recheck> is True. Other pools are always reported as online.
+        """
+        pool_type = xpath_get_text(pool_xml, '/pool/@type')[0]
+        if pool_type not in MONITORED_POOL_TYPES:
             return True
-        except Exception:
-            return False
+
+        # iSCSI targets with CHAP can not be checked without the secret
+        if xpath_get_text(pool_xml, '/pool/source/auth/@type'):
+            return True
+
+        source = self._get_storage_source(pool_type, pool_xml)
+        if pool_type == 'netfs':
+            pool_source = {'path': source['path'], 'host': source['addr']}
+        else:
+            pool_source = {'target': source['path'], 'host': source['addr']}
+            if source['port']:
+                pool_source['port'] = int(source['port'])
+
+        poolArgs = {'name': pool.name(), 'type': pool_type,
+                    'source': pool_source}
+        return get_pool_health_monitor(self.conn).is_online(poolArgs, recheck)
 
     def lookup(self, name):
         pool = self.get_storagepool(name, self.conn)
@@ -358,11 +370,11 @@ class StoragePoolModel(object):
         path = xpath_get_text(xml, '/pool/target/path')[0]
         pool_type = xpath_get_text(xml, '/pool/@type')[0]
         source = self._get_storage_source(pool_type, xml)
-        # FIXME: nfs workaround - prevent any libvirt operation
-        # for a nfs if the corresponding NFS server is down.
-        if pool_type == 'netfs' and not self._nfs_status_online(pool):
+        # prevent any libvirt operation on a NFS or iSCSI pool if the
+        # corresponding storage server is down.
+        if not self._source_online(pool, xml):
             wok_log.debug(
-                'NFS pool %s is offline, reason: NFS ' 'server %s is unreachable.',
+                'Pool %s is offline, reason: storage server %s is unreachable.',
                 name,
                 source['addr'],
             )
@@ -402,9 +414,7 @@ class StoragePoolModel(object):
     def _update_lvm_disks(self, pool_name, disks):
         # check if all the disks/partitions exists in the host
         for disk in disks:
-            lsblk_cmd = ['lsblk', disk]
-            output, error, returncode = run_command(lsblk_cmd)
-            if returncode != 0:
+            if find_block_device(disk) is None:
                 wok_log.error(
                     '%s is not a valid disk/partition. Could not '
                     'add it to the pool %s.',
@@ -417,6 +427,8 @@ class StoragePoolModel(object):
         vgextend_cmd = ['vgextend', pool_name]
         vgextend_cmd += disks
         output, error, returncode = run_command(vgextend_cmd)
+        invalidate_block_devices()
+        invalidate_lvm()
         if returncode != 0:
             msg = 'Could not add disks to pool %s, error: %s'
             wok_log.error(msg, pool_name, error)
@@ -425,7 +437,9 @@ class StoragePoolModel(object):
         # refreshing pool state
         pool = self.get_storagepool(pool_name, self.conn)
         if pool.isActive():
-            pool.refresh(0)
+            refresher = get_pool_refresher(self.conn)
+            refresher.invalidate(pool_name)
+            refresher.refresh(pool)
 
     def update(self, name, params):
         pool = self.get_storagepool(name, self.conn)
@@ -451,7 +465,7 @@ class StoragePoolModel(object):
         # if the NFS server is not reachable.
         xml = pool.XMLDesc(0)
         pool_type = xpath_get_text(xml, '/pool/@type')[0]
-        if pool_type == 'netfs' and not self._nfs_status_online(pool):
+        if pool_type == 'netfs' and not self._source_online(pool, xml, True):
             # block the user from activating the pool.
             source = self._get_storage_source(pool_type, xml)
             raise OperationFailed(
@@ -486,7 +500,7 @@ class StoragePoolModel(object):
         # if the NFS server is not reachable.
         xml = pool.XMLDesc(0)
         pool_type = xpath_get_text(xml, '/pool/@type')[0]
-        if pool_type == 'netfs' and not self._nfs_status_online(pool):
+        if pool_type == 'netfs' and not self._source_online(pool, xml, True):
             # block the user from dactivating the pool.
             source = self._get_storage_source(pool_type, xml)
             raise OperationFailed(
@@ -523,22 +537,19 @@ class StoragePoolModel(object):
             raise OperationFailed(
                 'KCHPOOL0011E', {'name': name, 'err': e.get_error_message()}
             )
+        get_pool_health_monitor(self.conn).forget(name)
 
     def _get_vms_attach_to_storagepool(self, storagepool):
-        conn = self.conn.get()
-
         # get storage pool path
         pool = self.get_storagepool(storagepool, self.conn)
         path = ''.join(xpath_get_text(pool.XMLDesc(), '/pool/target/path'))
 
-        # activate and deactive quickly to get volumes
         vms = []
-        for dom in conn.listAllDomains(0):
-            xml = dom.XMLDesc(0)
-            files = "/domain/devices/disk[@device='disk']/source/@file"
-            for file in xpath_get_text(xml, files):
-                if file not in vms and file.startswith(path):
-                    vms.append(dom.name())
+        for domain in get_domain_inventory(self.conn).get_domains():
+            for disk in domain['disks']:
+                if disk['type'] == 'disk' and disk['path'].startswith(path):
+                    vms.append(domain['libvirt_name'])
+                    break
         return vms
 
 
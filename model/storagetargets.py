@@ -47,9 +47,10 @@ class StorageTargetsModel(object):
                     target_type=target_type,
                     server_port=_server_port,
                 )
-                conn = self.conn.get()
                 try:
-                    ret = conn.findStoragePoolSources(target_type, xml, 0)
+                    # the storage server may take long to answer
+                    with self.conn.borrow() as conn:
+                        ret = conn.findStoragePoolSources(target_type, xml, 0)
                 except libvirt.libvirtError as e:
                     wok_log.warning(
                         f'Query storage pool source fails because of '
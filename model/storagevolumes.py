@@ -16,16 +16,17 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
-import contextlib
+import io
 import os
+import re
 import tempfile
 import threading
 import time
 import urllib
+from http.client import HTTPException
 
 import libvirt
 import lxml.etree as ET
-import magic
 from lxml.builder import E
 from wok.asynctask import AsyncTask
 from wok.exception import InvalidOperation
@@ -36,9 +37,12 @@ from wok.exception import NotFoundError
 from wok.exception import OperationFailed
 from wok.model.tasks import TaskModel
 from wok.plugins.kimchi.config import READONLY_POOL_TYPE
-from wok.plugins.kimchi.isoinfo import IsoImage
+from wok.plugins.kimchi.disks import invalidate_lvm
+from wok.plugins.kimchi.isoinfo import get_iso_info
 from wok.plugins.kimchi.kvmusertests import UserTests
+from wok.plugins.kimchi.magicinfo import get_file_type
 from wok.plugins.kimchi.model.diskutils import get_disk_used_by
+from wok.plugins.kimchi.model.poolrefresh import get_pool_refresher
 from wok.plugins.kimchi.model.storagepools import StoragePoolModel
 from wok.plugins.kimchi.utils import get_next_clone_name
 from wok.utils import get_unique_file_name
@@ -48,13 +52,321 @@ from wok.xmlutils.utils import xpath_get_text
 
 VOLUME_TYPE_MAP = {0: 'file', 1: 'block', 2: 'directory', 3: 'network'}
 
-READ_CHUNK_SIZE = 1048576  # 1 MiB
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 8 MiB
+# number of times a lost download is resumed in a row
+DOWNLOAD_RETRIES = 5
+# seconds to wait for the remote server before resuming the download
+DOWNLOAD_TIMEOUT = 60
+# minimum seconds between two progress reports of a download
+PROGRESS_INTERVAL = 1
+# bytes read at once from an uploaded chunk; all-zero blocks are not sent
+UPLOAD_BLOCK_SIZE = 256 * 1024
+# seconds an upload may wait for its next chunk before it is aborted
+UPLOAD_IDLE_TIMEOUT = 600
+# seconds between two checks of the idle uploads
+UPLOAD_REAP_INTERVAL = 60
 REQUIRE_NAME_PARAMS = ['capacity']
 
 VALID_RAW_CONTENT = ['dos/mbr boot sector', 'x86 boot sector', 'data']
 
 upload_volumes = dict()
 
+# total size in a Content-Range header: "bytes 100-199/1000" or "bytes */1000"
+CONTENT_RANGE_TOTAL = re.compile(r'/(\d+)\s*$')
+
+
+def _get_range_total(headers):
+    match = CONTENT_RANGE_TOTAL.search(headers.get('Content-Range') or '')
+    return int(match.group(1)) if match else None
+
+
+class URLDownload(object):
+    """
+    Binary download of an URL in chunks of <chunk_size> bytes, read into a
+    single reusable buffer so the memory used does not depend on the size of
+    the file.
+
+    When the connection is lost, the download is resumed from the last byte
+    received with an HTTP Range request, up to <retries> times in a row.
+
+    When the server does not report the size of the file, the end of the
+    response is only trusted for chunked responses, whose end is marked by
+    the server. Otherwise the server is asked for the bytes after the last
+    one received, to tell a complete file from a lost connection.
+    """
+
+    def __init__(self, url, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                 retries=DOWNLOAD_RETRIES):
+        self.url = url
+        self.chunk_size = chunk_size
+        self.retries = retries
+        # bytes received so far
+        self.offset = 0
+        # size of the file or None when the server does not report it
+        self.size = None
+        self._response = None
+        # whether the end of the response is marked by the server
+        self._chunked = False
+
+    def open(self):
+        request = urllib.request.Request(self.url)
+        if self.offset:
+            request.add_header('Range', f'bytes={self.offset}-')
+
+        response = urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+        if self.offset and getattr(response, 'status', None) != 206:
+            response.close()
+            raise IOError(f'Unable to resume the download of {self.url}')
+
+        if not self.offset:
+            length = response.headers.get('Content-Length')
+            self.size = int(length) if length else None
+        elif self.size is None:
+            self.size = _get_range_total(response.headers)
+        self._chunked = getattr(response, 'chunked', False)
+        self._response = response
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def __iter__(self):
+        """
+        Yield memoryviews of the same buffer, so each chunk must be consumed
+        before the next one is read.
+        """
+        buf = bytearray(self.chunk_size)
+        view = memoryview(buf)
+        retries = self.retries
+
+        while True:
+            try:
+                if self._response is None:
+                    self.open()
+
+                nbytes = self._response.readinto(buf)
+                if not nbytes:
+                    complete = self._check_end()
+            except (IOError, HTTPException) as e:
+                if not retries:
+                    raise
+                retries -= 1
+                wok_log.warning(
+                    f'Resuming download of {self.url} at byte {self.offset}: {e}'
+                )
+                self.close()
+                continue
+
+            if not nbytes:
+                if not complete:
+                    raise IOError(
+                        f'Unable to verify that the download of {self.url} '
+                        f'is complete'
+                    )
+                break
+
+            retries = self.retries
+            self.offset += nbytes
+            yield view[:nbytes]
+
+    def _check_end(self):
+        """
+        Raise IOError when the response ended before the end of the file.
+        Return False when the server cannot tell whether the file is
+        complete.
+        """
+        if self.size is not None:
+            if self.offset < self.size:
+                raise IOError('Connection closed before the end of file')
+            return True
+
+        if self._chunked:
+            return True
+
+        request = urllib.request.Request(self.url)
+        request.add_header('Range', f'bytes={self.offset}-')
+        try:
+            response = urllib.request.urlopen(
+                request, timeout=DOWNLOAD_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            # no byte after the last one received
+            if e.code != 416:
+                raise
+            total = _get_range_total(e.headers)
+            e.close()
+            if total is not None and total != self.offset:
+                raise IOError('Connection closed before the end of file')
+            self.size = self.offset
+            return True
+
+        try:
+            if getattr(response, 'status', None) != 206:
+                return False
+            self.size = _get_range_total(response.headers)
+        finally:
+            response.close()
+        raise IOError('Connection closed before the end of file')
+
+
+class ProgressReporter(object):
+    """
+    Forward the progress of a task to its callback at most once every
+    <interval> seconds.
+    """
+
+    def __init__(self, cb, interval=PROGRESS_INTERVAL):
+        self.cb = cb
+        self.interval = interval
+        self._last = None
+
+    def update(self, message_func):
+        now = time.monotonic()
+        if self._last is not None and now - self._last < self.interval:
+            return
+        self._last = now
+        self.cb(message_func())
+
+
+class VolumeUpload(object):
+    """
+    Upload session of a storage volume. A single libvirt stream is kept open
+    from the first uploaded chunk until the last one, instead of a stream
+    being set up and torn down for every chunk.
+
+    The stream is opened with VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM when
+    libvirt supports it, so all-zero blocks are sent as holes.
+    """
+
+    ZERO_BLOCK = bytes(UPLOAD_BLOCK_SIZE)
+
+    def __init__(self, conn, vol, offset, length):
+        self.stream = None
+        self.sparse = False
+
+        flags = getattr(libvirt, 'VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM', 0)
+        if flags:
+            try:
+                self.stream = conn.get().newStream(0)
+                vol.upload(self.stream, offset, length, flags)
+                self.sparse = True
+            except libvirt.libvirtError as e:
+                wok_log.debug(f'Sparse upload not supported: {e}')
+                self.abort()
+
+        if self.stream is None:
+            self.stream = conn.get().newStream(0)
+            vol.upload(self.stream, offset, length, 0)
+
+    def send(self, fd, size):
+        """Send <size> bytes read from the binary file object <fd>"""
+        buf = bytearray(UPLOAD_BLOCK_SIZE)
+        view = memoryview(buf)
+        zero = memoryview(self.ZERO_BLOCK)
+        hole = 0
+
+        while size > 0:
+            nbytes = fd.readinto(view[: min(size, UPLOAD_BLOCK_SIZE)])
+            if not nbytes:
+                raise IOError('Unexpected end of uploaded chunk')
+            size -= nbytes
+
+            if self.sparse and view[:nbytes] == zero[:nbytes]:
+                hole += nbytes
+                continue
+
+            if hole:
+                self.stream.sendHole(hole)
+                hole = 0
+
+            # libvirt only accepts read-only buffers
+            data = bytes(view[:nbytes])
+            while data:
+                sent = self.stream.send(data)
+                data = data[sent:]
+
+        if hole:
+            self.stream.sendHole(hole)
+
+    def finish(self):
+        self.stream.finish()
+        self.stream = None
+
+    def abort(self):
+        if self.stream is None:
+            return
+
+        try:
+            self.stream.abort()
+        except libvirt.libvirtError as e:
+            wok_log.debug(f'Unable to abort upload stream: {e}')
+        self.stream = None
+
+
+def abort_volume_upload(vol_path, vol_data, message=''):
+    """
+    End the upload session <vol_data> of the volume <vol_path>: abort its
+    libvirt stream, forget the session and fail its task with <message>.
+    The volume itself is not deleted.
+    """
+    if vol_data['upload'] is not None:
+        vol_data['upload'].abort()
+    if upload_volumes.get(vol_path) is vol_data:
+        del upload_volumes[vol_path]
+    vol_data['cb'](message, False)
+
+
+def reap_stale_uploads(conn, timeout=UPLOAD_IDLE_TIMEOUT):
+    """
+    Abort the uploads which did not receive any chunk for <timeout> seconds
+    and delete their volumes, so an upload abandoned by the client does not
+    keep a libvirt stream open.
+    """
+    now = time.monotonic()
+    for vol_path, vol_data in list(upload_volumes.items()):
+        if now - vol_data['last'] < timeout:
+            continue
+
+        # an upload is not idle while one of its chunks is being sent
+        if not vol_data['lock'].acquire(False):
+            continue
+        try:
+            if upload_volumes.get(vol_path) is not vol_data:
+                continue
+
+            wok_log.warning(f'Aborting idle upload of volume {vol_path}')
+            abort_volume_upload(
+                vol_path, vol_data,
+                f'No data received for {timeout} seconds'
+            )
+            try:
+                vol = conn.get().storageVolLookupByPath(vol_path)
+                pool_name = vol.storagePoolLookupByVolume().name()
+                vol.delete(0)
+                get_pool_refresher(conn).invalidate(pool_name)
+            except libvirt.libvirtError as e:
+                wok_log.error(f'Unable to delete volume {vol_path}: {e}')
+        finally:
+            vol_data['lock'].release()
+
+
+def get_chunk_file(chunk):
+    """
+    Return a binary file object with the data of the uploaded <chunk> and its
+    size, so the data is not loaded in memory nor decoded.
+    """
+    if getattr(chunk, 'file', None) is not None:
+        fd = chunk.file
+        fd.seek(0, os.SEEK_END)
+        size = fd.tell()
+        fd.seek(0)
+        return fd, size
+
+    data = getattr(chunk, 'value', chunk)
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return io.BytesIO(data), len(data)
+
 
 class StorageVolumesModel(object):
     def __init__(self, **kargs):
@@ -162,6 +474,9 @@ class StorageVolumesModel(object):
                 'KCHVOL0007E',
                 {'name': name, 'pool': pool_name, 'err': e.get_error_message()},
             )
+        get_pool_refresher(self.conn).invalidate(pool_name)
+        if params['pool_type'] == 'logical':
+            invalidate_lvm()
 
         vol_info = StorageVolumeModel(conn=self.conn, objstore=self.objstore).lookup(
             pool_name, name
@@ -169,11 +484,20 @@ class StorageVolumesModel(object):
         vol_path = vol_info['path']
 
         if params.get('upload', False):
+            stale = upload_volumes.get(vol_path)
+            if stale is not None:
+                # the volume was deleted out of Kimchi and created again
+                with stale['lock']:
+                    abort_volume_upload(
+                        vol_path, stale, 'The volume was created again')
+
             upload_volumes[vol_path] = {
                 'lock': threading.Lock(),
                 'offset': 0,
                 'cb': cb,
                 'expected_vol_size': params['capacity'],
+                'upload': None,
+                'last': time.monotonic(),
             }
             cb('ready for upload')
         else:
@@ -187,91 +511,130 @@ class StorageVolumesModel(object):
         pool_model = StoragePoolModel(conn=self.conn, objstore=self.objstore)
         pool = pool_model.lookup(pool_name)
 
-        if pool['type'] in ['dir', 'netfs']:
-            file_path = os.path.join(pool['path'], name)
-        else:
-            file_path = tempfile.mkstemp(prefix=name)[1]
+        download = URLDownload(url)
+        progress = ProgressReporter(cb)
 
-        with contextlib.closing(urllib.request.urlopen(url)) as response:
-            with open(file_path, 'w') as volume_file:
-                remote_size = response.getheader('Content-Length', '-')
-                downloaded_size = 0
+        def _report():
+            remote_size = '-' if download.size is None else download.size
+            return f'{download.offset}/{remote_size}'
 
+        try:
+            download.open()
+            if pool['type'] in ['dir', 'netfs']:
+                file_path = os.path.join(pool['path'], name)
+                self._download_to_file(download, file_path, progress, _report)
+                # the new file is only known by libvirt after a refresh
+                virt_pool = StoragePoolModel.get_storagepool(
+                    pool_name, self.conn)
+                refresher = get_pool_refresher(self.conn)
+                refresher.invalidate(pool_name)
+                refresher.refresh(virt_pool)
+            elif download.size is not None:
+                self._download_to_volume(
+                    download, pool_name, name, progress, _report)
+            else:
+                # the volume can only be created once the size is known
+                fd, file_path = tempfile.mkstemp(prefix=name)
+                os.close(fd)
                 try:
-                    while True:
-                        chunk_data = response.read(
-                            READ_CHUNK_SIZE).decode('utf-8')
-                        if not chunk_data:
-                            break
-
-                        volume_file.write(chunk_data)
-                        downloaded_size += len(chunk_data)
-                        cb(f'{downloaded_size}/{remote_size}')
-                except (IOError, libvirt.libvirtError) as e:
-                    if os.path.isfile(file_path):
-                        os.remove(file_path)
-
-                    raise OperationFailed(
-                        'KCHVOL0007E', {'name': name,
-                                        'pool': pool_name, 'err': str(e)}
-                    )
-
-        if pool['type'] in ['dir', 'netfs']:
-            virt_pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
-            virt_pool.refresh(0)
-        else:
+                    self._download_to_file(
+                        download, file_path, progress, _report)
+                    self._upload_file(file_path, pool_name, name)
+                finally:
+                    os.remove(file_path)
+        except (IOError, HTTPException, libvirt.libvirtError) as e:
+            raise OperationFailed(
+                'KCHVOL0007E', {'name': name, 'pool': pool_name, 'err': str(e)}
+            )
+        finally:
+            download.close()
 
-            def _stream_handler(stream, nbytes, fd):
-                return fd.read(nbytes)
+        cb('OK', True)
 
-            virt_stream = virt_vol = None
+    def _download_to_file(self, download, file_path, progress, report):
+        try:
+            with open(file_path, 'wb') as volume_file:
+                for chunk in download:
+                    volume_file.write(chunk)
+                    progress.update(report)
+        except (IOError, HTTPException):
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+            raise
 
-            try:
-                task = self.create(
-                    pool_name,
-                    {
-                        'name': name,
-                        'format': 'raw',
-                        'capacity': downloaded_size,
-                        'allocation': downloaded_size,
-                    },
-                )
-                self.task.wait(task['id'])
-                virt_vol = StorageVolumeModel.get_storagevolume(
-                    pool_name, name, self.conn
-                )
+    def _create_raw_volume(self, pool_name, name, size):
+        # the capacity of the new volume is given in MiB
+        capacity = -(-size // (1024 * 1024))
+        task = self.create(
+            pool_name,
+            {
+                'name': name,
+                'format': 'raw',
+                'capacity': capacity,
+                'allocation': capacity,
+            },
+        )
+        self.task.wait(task['id'])
+        return StorageVolumeModel.get_storagevolume(pool_name, name, self.conn)
 
-                virt_stream = self.conn.get().newStream(0)
-                virt_vol.upload(virt_stream, 0, downloaded_size, 0)
+    def _download_to_volume(self, download, pool_name, name, progress, report):
+        """
+        Pipe the download straight into the libvirt upload stream of a new
+        volume, so it does not need to be staged in a local file.
+        """
+        virt_stream = virt_vol = None
+        try:
+            virt_vol = self._create_raw_volume(pool_name, name, download.size)
+            virt_stream = self.conn.get().newStream(0)
+            virt_vol.upload(virt_stream, 0, download.size, 0)
+
+            for chunk in download:
+                # libvirt only accepts read-only buffers
+                data = bytes(chunk)
+                while data:
+                    sent = virt_stream.send(data)
+                    data = data[sent:]
+                progress.update(report)
+
+            virt_stream.finish()
+        except (IOError, HTTPException, libvirt.libvirtError):
+            self._abort_upload(virt_stream, virt_vol)
+            raise
+
+    def _upload_file(self, file_path, pool_name, name):
+        def _stream_handler(stream, nbytes, fd):
+            return fd.read(nbytes)
+
+        virt_stream = virt_vol = None
+        try:
+            size = os.path.getsize(file_path)
+            virt_vol = self._create_raw_volume(pool_name, name, size)
+            virt_stream = self.conn.get().newStream(0)
+            virt_vol.upload(virt_stream, 0, size, 0)
 
-                with open(file_path) as fd:
-                    virt_stream.sendAll(_stream_handler, fd)
+            with open(file_path, 'rb') as fd:
+                virt_stream.sendAll(_stream_handler, fd)
 
-                virt_stream.finish()
-            except (IOError, libvirt.libvirtError) as e:
-                try:
-                    if virt_stream:
-                        virt_stream.abort()
-                    if virt_vol:
-                        virt_vol.delete(0)
-                except libvirt.libvirtError as e:
-                    wok_log.error(str(e))
-                finally:
-                    raise OperationFailed(
-                        'KCHVOL0007E', {'name': name,
-                                        'pool': pool_name, 'err': str(e)}
-                    )
-            finally:
-                os.remove(file_path)
+            virt_stream.finish()
+        except (IOError, libvirt.libvirtError):
+            self._abort_upload(virt_stream, virt_vol)
+            raise
 
-        cb('OK', True)
+    def _abort_upload(self, virt_stream, virt_vol):
+        try:
+            if virt_stream:
+                virt_stream.abort()
+            if virt_vol:
+                virt_vol.delete(0)
+        except libvirt.libvirtError as e:
+            wok_log.error(str(e))
 
     def get_list(self, pool_name):
         pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
         if not pool.isActive():
             raise InvalidOperation('KCHVOL0006E', {'pool': pool_name})
         try:
-            pool.refresh(0)
+            get_pool_refresher(self.conn).refresh(pool)
         except Exception as e:
             wok_log.error(f'Pool refresh failed: {e}')
         return sorted(pool.listVolumes())
@@ -316,14 +679,14 @@ class StorageVolumeModel(object):
             # it's 'raw'.
             fmt = 'raw'
 
-        iso_img = None
+        iso_info = None
 
         # 'raw' volumes from 'logical' pools may actually be 'iso';
         # libvirt always reports them as 'raw'
         pool_info = self.storagepool.lookup(pool)
         if pool_info['type'] == 'logical' and fmt == 'raw':
             try:
-                iso_img = IsoImage(path)
+                iso_info = get_iso_info(path)
             except IsoFormatError:
                 # not 'iso' afterall
                 pass
@@ -338,11 +701,8 @@ class StorageVolumeModel(object):
             # if so, don't check it's contents for validity
             if not os.path.islink(path):
                 try:
-                    ms = magic.open(magic.NONE)
-                    ms.load()
-                    if ms.file(path).lower() not in VALID_RAW_CONTENT:
+                    if get_file_type(path).lower() not in VALID_RAW_CONTENT:
                         isvalid = False
-                    ms.close()
                 except UnicodeDecodeError:
                     isvalid = False
             else:  # We are a symlink
@@ -374,13 +734,15 @@ class StorageVolumeModel(object):
             if os.path.islink(path):
                 path = os.path.join(os.path.dirname(path), os.readlink(path))
             os_distro = os_version = 'unknown'
+            bootable = False
             try:
-                if iso_img is None:
-                    iso_img = IsoImage(path)
-                os_distro, os_version = iso_img.probe()
-                bootable = True
+                if iso_info is None:
+                    iso_info = get_iso_info(path)
+                os_distro = iso_info['distro']
+                os_version = iso_info['version']
+                bootable = iso_info['bootable']
             except IsoFormatError:
-                bootable = False
+                pass
 
             res.update(
                 dict(
@@ -410,12 +772,21 @@ class StorageVolumeModel(object):
 
         volume = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
         vol_path = volume.path()
+        vol_data = upload_volumes.get(vol_path)
+        if vol_data is not None:
+            with vol_data['lock']:
+                abort_volume_upload(
+                    vol_path, vol_data, 'The volume was deleted')
+
         try:
             volume.delete(0)
         except libvirt.libvirtError as e:
             raise OperationFailed(
                 'KCHVOL0010E', {'name': name, 'err': e.get_error_message()}
             )
+        get_pool_refresher(self.conn).invalidate(pool)
+        if pool_info['type'] == 'logical':
+            invalidate_lvm()
 
         try:
             os.remove(vol_path)
@@ -444,6 +815,8 @@ class StorageVolumeModel(object):
             raise OperationFailed(
                 'KCHVOL0011E', {'name': name, 'err': e.get_error_message()}
             )
+        # the volume may be a logical volume
+        invalidate_lvm()
 
     def clone(self, pool, name, new_pool=None, new_name=None):
         """Clone a storage volume.
@@ -534,33 +907,50 @@ class StorageVolumeModel(object):
                     'err': e.get_error_message(),
                 },
             )
+        get_pool_refresher(self.conn).invalidate(new_pool_name)
+        invalidate_lvm()
 
         self.lookup(new_pool_name, new_vol_name)
 
         cb('OK', True)
 
-    def doUpload(self, cb, vol, offset, data, data_size):
+    def doUpload(self, cb, vol, vol_data, data, data_size):
         try:
-            st = self.conn.get().newStream(0)
-            vol.upload(st, offset, data_size)
-            st.send(data.encode('utf-8'))
-            st.finish()
+            upload = vol_data['upload']
+            if upload is None:
+                offset = vol_data['offset']
+                upload = vol_data['upload'] = VolumeUpload(
+                    self.conn, vol, offset, vol.info()[1] - offset
+                )
+            upload.send(data, data_size)
         except Exception as e:
-            st and st.abort()
-            cb('', False)
+            self.abortUpload(cb, vol, vol_data)
+            raise OperationFailed('KCHVOL0029E', {'err': str(e)})
 
-            try:
-                vol.delete(0)
-            except Exception:
-                pass
+    def finishUpload(self, cb, vol, vol_data):
+        upload = vol_data['upload']
+        if upload is None:
+            return
 
+        try:
+            upload.finish()
+        except Exception as e:
+            self.abortUpload(cb, vol, vol_data)
             raise OperationFailed('KCHVOL0029E', {'err': str(e)})
 
+    def abortUpload(self, cb, vol, vol_data):
+        abort_volume_upload(vol.path(), vol_data)
+
+        try:
+            vol.delete(0)
+        except Exception:
+            pass
+
     def update(self, pool, name, params):
-        chunk_data = params['chunk'].fullvalue()
+        chunk_data, data_size = get_chunk_file(params['chunk'])
         chunk_size = int(params['chunk_size'])
 
-        if len(chunk_data) != chunk_size:
+        if data_size != chunk_size:
             raise OperationFailed('KCHVOL0026E')
 
         vol = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
@@ -574,18 +964,25 @@ class StorageVolumeModel(object):
         cb = vol_data['cb']
         lock = vol_data['lock']
         with lock:
+            # the upload was aborted while this chunk was waiting
+            if upload_volumes.get(vol_path) is not vol_data:
+                raise OperationFailed('KCHVOL0027E', {'vol': vol_path})
+
+            vol_data['last'] = time.monotonic()
             offset = vol_data['offset']
             if (offset + chunk_size) > vol_capacity:
                 raise OperationFailed('KCHVOL0028E')
 
             cb(f'{offset}/{vol_capacity}')
-            self.doUpload(cb, vol, offset, chunk_data, chunk_size)
+            self.doUpload(cb, vol, vol_data, chunk_data, chunk_size)
             cb(f'{offset + chunk_size}/{vol_capacity}')
 
             vol_data['offset'] += chunk_size
+            vol_data['last'] = time.monotonic()
             if (vol_data['offset'] == vol_capacity) or (
                 vol_data['offset'] == vol_data['expected_vol_size']
             ):
+                self.finishUpload(cb, vol, vol_data)
                 del upload_volumes[vol_path]
                 cb('OK', True)
 
@@ -604,7 +1001,7 @@ class IsoVolumesModel(object):
         for pool_name in pools:
             try:
                 pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
-                pool.refresh(0)
+                get_pool_refresher(self.conn).refresh(pool)
                 volumes = pool.listVolumes()
             except Exception as e:
                 # Skip inactive pools
@@ -23,7 +23,6 @@ import stat
 import urllib.parse
 
 import libvirt
-import magic
 import psutil
 from wok.exception import InvalidOperation
 from wok.exception import InvalidParameter
@@ -31,6 +30,7 @@ from wok.exception import NotFoundError
 from wok.exception import OperationFailed
 from wok.plugins.kimchi.config import get_kimchi_version
 from wok.plugins.kimchi.kvmusertests import UserTests
+from wok.plugins.kimchi.magicinfo import get_file_type
 from wok.plugins.kimchi.model.cpuinfo import CPUInfoModel
 from wok.plugins.kimchi.utils import create_disk_image
 from wok.plugins.kimchi.utils import is_libvirtd_up
@@ -99,10 +99,8 @@ class TemplatesModel(object):
         if not os.path.exists(path):
             raise InvalidParameter('KCHTMPL0002E', {'path': path})
 
-        # create magic object to discover file type
-        file_type = magic.open(magic.MAGIC_NONE)
-        file_type.load()
-        ftype = file_type.file(path)
+        # discover file type
+        ftype = get_file_type(path)
 
         # cdrom
         iscdrom = [t for t in ISO_TYPE if t in ftype]
@@ -461,25 +459,32 @@ class LibvirtVMTemplate(VMTemplate):
     def fork_vm_storage(self, vm_uuid):
         # Provision storages:
         disk_and_vol_list = self.to_volume_list(vm_uuid)
+        for v in disk_and_vol_list:
+            self.provision_volume(v)
+
+        return disk_and_vol_list
+
+    def provision_volume(self, v):
+        """
+        Create the volume <v>, as returned by to_volume_list(), in its storage
+        pool or as a disk image when it has no pool.
+        """
         try:
-            for v in disk_and_vol_list:
-                if v['pool'] is not None:
-                    pool = self._get_storage_pool(v['pool'])
-                    # outgoing text to libvirt, decode('utf-8')
-                    pool.createXML(v['xml'].decode('utf-8'), 0)
-                else:
-                    capacity = v['capacity']
-                    format_type = v['format']
-                    path = v['path']
-                    create_disk_image(
-                        format_type=format_type, path=path, capacity=capacity
-                    )
+            if v['pool'] is not None:
+                pool = self._get_storage_pool(v['pool'])
+                # outgoing text to libvirt, decode('utf-8')
+                pool.createXML(v['xml'].decode('utf-8'), 0)
+            else:
+                capacity = v['capacity']
+                format_type = v['format']
+                path = v['path']
+                create_disk_image(
+                    format_type=format_type, path=path, capacity=capacity
+                )
 
         except libvirt.libvirtError as e:
             raise OperationFailed('KCHVMSTOR0008E', {'error': str(e)})
 
-        return disk_and_vol_list
-
     def set_cpu_info(self):
         # undefined topology: consider these values to calculate maxvcpus
         sockets = 1
@@ -17,6 +17,7 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 import base64
+import copy
 
 import libvirt
 from lxml import etree
@@ -39,6 +40,22 @@ def get_vm_name(vm_name, t_name, name_list):
     raise OperationFailed('KCHUTILS0003E')
 
 
+def get_vm_names(prefix, count, name_list):
+    """
+    Return <count> names "<prefix>-<n>" which are not in <name_list>, with
+    the lowest numbers.
+    """
+    names = []
+    used = set(name_list)
+    i = 0
+    while len(names) < count:
+        i += 1
+        vm_name = '%s-%i' % (prefix, i)
+        if vm_name not in used:
+            names.append(vm_name)
+    return names
+
+
 def get_ascii_nonascii_name(name):
     nonascii_name = None
     if name.encode('ascii', 'ignore').decode('utf-8') != name:
@@ -128,6 +145,78 @@ def get_metadata_node(dom, tag, mode='current'):
     return ''
 
 
+def get_metadata_node_from_xml(root, tag):
+    """
+    Same as get_metadata_node() but read the Kimchi metadata from an already
+    parsed domain XML, so no extra libvirt call is needed.
+    Returns: the node XML or '' when it does not exist
+    """
+    kimchi = root.find(f'metadata/{{{KIMCHI_META_URL}}}metadata')
+    if kimchi is None:
+        return ''
+
+    for node in kimchi.iterchildren(tag=etree.Element):
+        if etree.QName(node).localname != tag:
+            continue
+
+        # get_metadata_node() returns the node without the Kimchi namespace
+        node = copy.deepcopy(node)
+        for elem in node.iter(tag=etree.Element):
+            elem.tag = etree.QName(elem).localname
+        etree.cleanup_namespaces(node)
+        return etree.tostring(node)
+    return ''
+
+
+def xpath_get_text_from_root(root, expr):
+    """
+    Same as xpath_get_text() but for an already parsed XML, so the document is
+    not parsed again for every expression.
+    """
+    return [str(x) if isinstance(x, str) else x.text for x in root.xpath(expr)]
+
+
+class DomainView(object):
+    """
+    Parsed XML of a domain, fetched and parsed only once while handling a
+    request. The values read from it are memoized, so the helpers sharing the
+    same view do not need to query libvirt or parse the XML again.
+
+    The XML is fetched with the VIR_DOMAIN_XML_SECURE flag by default, so the
+    graphics password is also available.
+    """
+
+    def __init__(self, dom, flags=libvirt.VIR_DOMAIN_XML_SECURE):
+        self.dom = dom
+        self.flags = flags
+        self._root = None
+        self._texts = {}
+        self._metadata = {}
+
+    @property
+    def root(self):
+        if self._root is None:
+            self._root = etree.fromstring(self.dom.XMLDesc(self.flags))
+        return self._root
+
+    def xpath(self, expr):
+        if expr not in self._texts:
+            self._texts[expr] = xpath_get_text_from_root(self.root, expr)
+        return self._texts[expr]
+
+    def get_metadata_node(self, tag):
+        if tag not in self._metadata:
+            self._metadata[tag] = get_metadata_node_from_xml(self.root, tag)
+        return self._metadata[tag]
+
+    def has_device(self, tag):
+        return self.root.find(f'devices/{tag}') is not None
+
+    def get_targets(self, tag):
+        """Return the target names of the <tag> devices, in document order"""
+        return self.xpath(f'/domain/devices/{tag}/target/@dev')
+
+
 def metadata_exists(dom):
     xml = dom.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
     root = etree.fromstring(xml)
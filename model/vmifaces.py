@@ -27,6 +27,7 @@ from wok.exception import InvalidParameter
 from wok.exception import MissingParameter
 from wok.exception import NotFoundError
 from wok.plugins.kimchi.model.config import CapabilitiesModel
+from wok.plugins.kimchi.model.domaininventory import get_domain_inventory
 from wok.plugins.kimchi.model.vms import DOM_STATE_MAP
 from wok.plugins.kimchi.model.vms import VMModel
 from wok.plugins.kimchi.xmlutils.interface import get_iface_xml
@@ -115,6 +116,7 @@ class VMIfacesModel(object):
         if DOM_STATE_MAP[dom.info()[0]] != 'shutoff':
             flags |= libvirt.VIR_DOMAIN_AFFECT_LIVE
         dom.attachDeviceFlags(xml, flags)
+        get_domain_inventory(self.conn).invalidate(dom)
 
         return params['mac']
 
@@ -228,6 +230,7 @@ class VMIfaceModel(object):
             flags |= libvirt.VIR_DOMAIN_AFFECT_LIVE
 
         dom.detachDeviceFlags(etree.tostring(iface).decode('utf-8'), flags)
+        get_domain_inventory(self.conn).invalidate(dom)
 
     def update(self, vm, mac, params):
         dom = VMModel.get_vm(vm, self.conn)
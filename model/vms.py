@@ -28,7 +28,7 @@ import subprocess
 import threading
 import time
 import uuid
-from xml.etree import ElementTree
+from multiprocessing.pool import ThreadPool
 
 import libvirt
 import lxml.etree as ET
@@ -52,13 +52,17 @@ from wok.plugins.kimchi.config import READONLY_POOL_TYPE
 from wok.plugins.kimchi.kvmusertests import UserTests
 from wok.plugins.kimchi.model.config import CapabilitiesModel
 from wok.plugins.kimchi.model.cpuinfo import CPUInfoModel
+from wok.plugins.kimchi.model.domaininventory import get_domain_inventory
 from wok.plugins.kimchi.model.featuretests import FeatureTests
+from wok.plugins.kimchi.model.poolrefresh import get_pool_refresher
 from wok.plugins.kimchi.model.templates import PPC_MEM_ALIGN
 from wok.plugins.kimchi.model.templates import TemplateModel
 from wok.plugins.kimchi.model.templates import validate_memory
+from wok.plugins.kimchi.model.utils import DomainView
 from wok.plugins.kimchi.model.utils import get_ascii_nonascii_name
 from wok.plugins.kimchi.model.utils import get_metadata_node
 from wok.plugins.kimchi.model.utils import get_vm_name
+from wok.plugins.kimchi.model.utils import get_vm_names
 from wok.plugins.kimchi.model.utils import remove_metadata_node
 from wok.plugins.kimchi.model.utils import set_metadata_node
 from wok.plugins.kimchi.osinfo import defaults
@@ -66,6 +70,7 @@ from wok.plugins.kimchi.osinfo import MEM_DEV_SLOTS
 from wok.plugins.kimchi.screenshot import VMScreenshot
 from wok.plugins.kimchi.utils import get_next_clone_name
 from wok.plugins.kimchi.utils import is_s390x
+from wok.plugins.kimchi.utils import pool_name_from_uri
 from wok.plugins.kimchi.utils import template_name_from_uri
 from wok.plugins.kimchi.xmlutils.bootorder import get_bootmenu_node
 from wok.plugins.kimchi.xmlutils.bootorder import get_bootorder_node
@@ -99,6 +104,22 @@ DOM_STATE_MAP = {
     7: 'pmsuspended',
 }
 
+# statistics groups requested when retrieving the info of all VMs at once
+BULK_STATS = (
+    libvirt.VIR_DOMAIN_STATS_STATE
+    | libvirt.VIR_DOMAIN_STATS_CPU_TOTAL
+    | libvirt.VIR_DOMAIN_STATS_BALLOON
+    | libvirt.VIR_DOMAIN_STATS_VCPU
+)
+
+# bulk statistics needed to build the same list returned by virDomain.info()
+BULK_INFO_STATS = (
+    'state.state',
+    'balloon.maximum',
+    'balloon.current',
+    'vcpu.current',
+)
+
 # update parameters which are updatable when the VM is online
 VM_ONLINE_UPDATE_PARAMS = [
     'cpu_info',
@@ -125,8 +146,20 @@ VM_OFFLINE_UPDATE_PARAMS = [
     'autostart',
 ]
 
+# number of disks cloned at once into the same storage pool
+CLONE_DISKS_PER_POOL = 2
+
+# number of VMs created at once by a batch creation
+CREATE_VMS_WORKERS = 8
+# number of volumes created at once into the same storage pool by a batch
+# creation
+CREATE_VOLUMES_PER_POOL = 4
+
 XPATH_DOMAIN_DISK = "/domain/devices/disk[@device='disk']/source/@file"
 XPATH_DOMAIN_DISK_BY_FILE = "./devices/disk[@device='disk']/source[@file='%s']"
+XPATH_DOMAIN_DISK_DRIVER_BY_FILE = (
+    "./devices/disk[@device='disk'][source/@file='%s']/driver"
+)
 XPATH_DOMAIN_NAME = '/domain/name'
 XPATH_DOMAIN_MAC = '/domain/devices/interface/mac/@address'
 XPATH_DOMAIN_MAC_BY_ADDRESS = "./devices/interface/mac[@address='%s']"
@@ -161,14 +194,28 @@ class VMsModel(object):
         self.objstore = kargs['objstore']
         self.caps = CapabilitiesModel(**kargs)
         self.task = TaskModel(**kargs)
+        # VMModel also holds a VMsModel instance, so create it on demand
+        self._kargs = kargs
+        self._vm = None
 
     def create(self, params):
         t_name = template_name_from_uri(params['template'])
+        # several VMs are created at once from the same template
+        batch = 'count' in params or 'name_prefix' in params
+        if batch and params.get('name'):
+            raise InvalidParameter('KCHVM0095E')
+
         vm_list = self.get_list()
-        name = get_vm_name(params.get('name'), t_name, vm_list)
-        # incoming text, from js json, is unicode, do not need decode
-        if name in vm_list:
-            raise InvalidOperation('KCHVM0001E', {'name': name})
+        if batch:
+            prefix = params.get('name_prefix')
+            if not prefix:
+                prefix = '%s-vm' % t_name.replace('/', '-')
+            names = get_vm_names(prefix, params.get('count', 1), vm_list)
+        else:
+            name = get_vm_name(params.get('name'), t_name, vm_list)
+            # incoming text, from js json, is unicode, do not need decode
+            if name in vm_list:
+                raise InvalidOperation('KCHVM0001E', {'name': name})
 
         vm_overrides = dict()
         pool_uri = params.get('storagepool')
@@ -181,16 +228,22 @@ class VMsModel(object):
         if not self.caps.qemu_stream and t.info.get('iso_stream', False):
             raise InvalidOperation('KCHVM0005E')
 
+        # the template is validated once for all the VMs of a batch
         t.validate()
         data = {
-            'name': name,
             'template': t,
             'graphics': params.get('graphics', {}),
             'title': params.get('title', ''),
             'description': params.get('description', ''),
         }
-        taskid = AsyncTask(
-            f'/plugins/kimchi/vms/{name}', self._create_task, data).id
+        if batch:
+            data['names'] = names
+            taskid = AsyncTask(
+                '/plugins/kimchi/vms', self._create_batch_task, data).id
+        else:
+            data['name'] = name
+            taskid = AsyncTask(
+                f'/plugins/kimchi/vms/{name}', self._create_task, data).id
 
         return self.task.lookup(taskid)
 
@@ -261,26 +314,190 @@ class VMsModel(object):
         if nonascii_name is not None:
             meta_elements.append(E.name(nonascii_name))
 
-        set_metadata_node(VMModel.get_vm(name, self.conn), meta_elements)
+        dom = VMModel.get_vm(name, self.conn)
+        set_metadata_node(dom, meta_elements)
+        get_domain_inventory(self.conn).invalidate(dom)
         cb('OK', True)
 
+    def _create_batch_task(self, cb, params):
+        """
+        Create several VMs from the same template. The volumes of the VMs are
+        created concurrently, up to CREATE_VOLUMES_PER_POOL volumes at a time
+        in the same storage pool, and the VMs are defined as soon as their
+        volumes are ready. Should any VM fail, the VMs and the volumes already
+        created are removed.
+
+        params: A dict with the following values:
+            - names: The names for the new VMs
+            - template: The template being used to create the VMs
+        """
+        t = params['template']
+        names = params['names']
+        total = len(names)
+
+        # the volumes and the XML of the VMs are built before any of them is
+        # created, so an invalid template does not leave VMs behind
+        cb('Preparing the new VMs')
+        vms = []
+        for vm_name in names:
+            vm_uuid = str(uuid.uuid4())
+            name, nonascii_name = get_ascii_nonascii_name(vm_name)
+            vms.append({
+                'name': name,
+                'nonascii_name': nonascii_name,
+                'uuid': vm_uuid,
+                'volumes': t.to_volume_list(vm_uuid),
+                'xml': t.to_vm_xml(
+                    name,
+                    vm_uuid,
+                    libvirt_stream_protocols=(
+                        self.caps.libvirt_stream_protocols),
+                    graphics=params.get('graphics', {}),
+                    mem_hotplug_support=self.caps.mem_hotplug_support,
+                    title=params.get('title', ''),
+                    description=params.get('description', ''),
+                ),
+            })
+
+        limits = {}
+        for vm in vms:
+            for vol in vm['volumes']:
+                limits.setdefault(
+                    vol['pool'],
+                    threading.BoundedSemaphore(CREATE_VOLUMES_PER_POOL)
+                )
+
+        lock = threading.Lock()
+        failed = threading.Event()
+        created = []
+
+        with RollbackContext() as rollback:
+
+            def _defer(func, *args):
+                # the rollback is shared by all the workers
+                with lock:
+                    rollback.prependDefer(func, *args)
+
+            def _create(vm):
+                # do not start a new VM when the batch is already lost
+                if failed.is_set():
+                    return None
+
+                try:
+                    self._create_batch_vm(vm, t, limits, _defer)
+                except Exception as e:
+                    failed.set()
+                    wok_log.error(f'Unable to create VM {vm["name"]}: {e}')
+                    return vm['name'], str(e)
+
+                with lock:
+                    created.append(vm['name'])
+                    cb(f'Created VM {vm["name"]} ({len(created)}/{total})')
+                return None
+
+            cb(f'Creating {total} VMs')
+            workers = ThreadPool(processes=min(CREATE_VMS_WORKERS, total))
+            try:
+                errors = workers.map(_create, vms)
+            finally:
+                workers.terminate()
+                refresher = get_pool_refresher(self.conn)
+                for pool in limits:
+                    if pool is not None:
+                        refresher.invalidate(pool_name_from_uri(pool))
+                get_domain_inventory(self.conn).invalidate()
+
+            errors = [error for error in errors if error is not None]
+            if errors:
+                raise OperationFailed('KCHVM0096E', {
+                    'names': ', '.join(name for name, _ in errors),
+                    'err': '; '.join(err for _, err in errors),
+                })
+
+            rollback.commitAll()
+
+        cb('OK', True)
+
+    def _create_batch_vm(self, vm, t, limits, defer):
+        """Create a VM of a batch creation.
+
+        Arguments:
+        vm -- A dict with the name, the UUID, the volumes and the XML of the
+            new VM, as built by _create_batch_task().
+        t -- The template being used to create the VM.
+        limits -- A dict with the semaphore of each storage pool.
+        defer -- A function to register the undo actions of the batch.
+        """
+        icon = t.info.get('icon')
+        if icon:
+            try:
+                with self.objstore as session:
+                    session.store('vm', vm['uuid'], {
+                                  'icon': icon}, get_kimchi_version())
+                defer(self._delete_vm_icon, vm['uuid'])
+            except Exception as e:
+                # It is possible to continue Kimchi executions without store
+                # vm icon info
+                wok_log.error(
+                    f'Error trying to update database with guest '
+                    f'icon information due error: {e}'
+                )
+
+        for vol in vm['volumes']:
+            with limits[vol['pool']]:
+                t.provision_volume(vol)
+            defer(self._delete_vm_volume, vol)
+
+        conn = self.conn.get()
+        try:
+            dom = conn.defineXML(vm['xml'])
+        except libvirt.libvirtError as e:
+            raise OperationFailed(
+                'KCHVM0007E', {'name': vm['name'],
+                               'err': e.get_error_message()}
+            )
+        defer(dom.undefine)
+
+        meta_elements = []
+        distro = t.info.get('os_distro')
+        version = t.info.get('os_version')
+        if distro is not None:
+            meta_elements.append(E.os({'distro': distro, 'version': version}))
+
+        if vm['nonascii_name'] is not None:
+            meta_elements.append(E.name(vm['nonascii_name']))
+
+        set_metadata_node(dom, meta_elements)
+
+    def _delete_vm_icon(self, vm_uuid):
+        with self.objstore as session:
+            session.delete('vm', vm_uuid, ignore_missing=True)
+
+    def _delete_vm_volume(self, vol):
+        try:
+            self.conn.get().storageVolLookupByPath(vol['path']).delete(0)
+        except libvirt.libvirtError:
+            # the disk images created out of a storage pool are not volumes
+            if vol['pool'] is not None:
+                raise
+            os.remove(vol['path'])
+
     def get_list(self):
         return VMsModel.get_vms(self.conn)
 
     @staticmethod
     def get_vms(conn):
-        conn_ = conn.get()
-        names = []
-        for dom in conn_.listAllDomains(0):
-            nonascii_xml = get_metadata_node(dom, 'name')
-            if nonascii_xml:
-                nonascii_node = ET.fromstring(nonascii_xml)
-                names.append(nonascii_node.text)
-            else:
-                names.append(dom.name())
+        domains = get_domain_inventory(conn).get_domains()
+        names = [domain['name'] for domain in domains]
+        return sorted(names, key=str.lower)
 
-        names = sorted(names, key=str.lower)
-        return names
+    def get_full_list(self):
+        """Return the full description of all the virtual machines, as
+        VMModel.lookup() does for a single one, in a single pass.
+        """
+        if self._vm is None:
+            self._vm = VMModel(**self._kargs)
+        return self._vm._lookup_all()
 
 
 class VMModel(object):
@@ -305,14 +522,14 @@ class VMModel(object):
         cls = import_class(
             'wok.plugins.kimchi.model.vmsnapshots.VMSnapshotsModel')
         self.vmsnapshots = cls(**kargs)
-        self.stats = {}
-        self._serial_procs = []
-
-    def has_topology(self, dom):
-        xml = dom.XMLDesc(0)
-        sockets = xpath_get_text(xml, XPATH_TOPOLOGY + '/@sockets')
-        cores = xpath_get_text(xml, XPATH_TOPOLOGY + '/@cores')
-        threads = xpath_get_text(xml, XPATH_TOPOLOGY + '/@threads')
+        self.vmstats = kargs['vmstats']
+
+    def has_topology(self, dom, view=None):
+        if view is None:
+            view = DomainView(dom, 0)
+        sockets = view.xpath(XPATH_TOPOLOGY + '/@sockets')
+        cores = view.xpath(XPATH_TOPOLOGY + '/@cores')
+        threads = view.xpath(XPATH_TOPOLOGY + '/@threads')
         return sockets and cores and threads
 
     def update(self, name, params):
@@ -370,9 +587,10 @@ class VMModel(object):
             vm_name = name
             if DOM_STATE_MAP[dom.info()[0]] == 'shutoff':
                 vm_name, dom = self._static_vm_update(name, dom, params)
+            get_domain_inventory(self.conn).invalidate(dom)
             return vm_name
 
-    def clone(self, name):
+    def clone(self, name, linked=False):
         """Clone a virtual machine based on an existing one.
 
         The new virtual machine will have the exact same configuration as the
@@ -385,6 +603,10 @@ class VMModel(object):
         'default' will always be used when cloning SCSI and iSCSI disks and
         when the original storage pool cannot hold the new volume.
 
+        The disks are copied concurrently, up to CLONE_DISKS_PER_POOL disks at
+        a time in the same storage pool. A linked clone does not copy the
+        disks: its disks are new qcow2 volumes backed by the original ones.
+
         An exception will be raised if the virtual machine <name> is not
         shutoff, if there is no available space to copy a new volume to the
         storage pool 'default' (when there was also no space to copy it to the
@@ -393,6 +615,8 @@ class VMModel(object):
 
         Parameters:
         name -- The name of the existing virtual machine to be cloned.
+        linked -- Whether the new disks are qcow2 overlays of the original
+            ones instead of copies (optional).
 
         Return:
         A Task running the clone operation.
@@ -423,7 +647,7 @@ class VMModel(object):
         taskid = AsyncTask(
             f'/plugins/kimchi/vms/{new_name}/clone',
             self._clone_task,
-            {'name': name, 'new_name': new_name},
+            {'name': name, 'new_name': new_name, 'linked': linked},
         ).id
 
         return self.task.lookup(taskid)
@@ -436,9 +660,11 @@ class VMModel(object):
         params -- A dict with the following values:
             "name": the name of the original VM.
             "new_name": the name of the new VM.
+            "linked": whether the disks are cloned as qcow2 overlays.
         """
         name = params['name']
         new_name = params['new_name']
+        linked = params.get('linked', False)
 
         # fetch base XML
         cb('reading source VM XML')
@@ -462,7 +688,7 @@ class VMModel(object):
         with RollbackContext() as rollback:
             # copy disks
             cb('copying VM disks')
-            xml = self._clone_update_disks(xml, rollback)
+            xml = self._clone_update_disks(xml, rollback, linked)
 
             # update objstore entry
             cb('updating object store')
@@ -482,6 +708,7 @@ class VMModel(object):
             except libvirt.libvirtError as e:
                 raise OperationFailed(
                     'KCHVM0035E', {'name': name, 'err': str(e)})
+            get_domain_inventory(self.conn).invalidate(dom)
 
             rollback.commitAll()
 
@@ -520,7 +747,7 @@ class VMModel(object):
 
         return xml
 
-    def _clone_update_disks(self, xml, rollback):
+    def _clone_update_disks(self, xml, rollback, linked=False):
         """Clone disks from a virtual machine. The disks are copied as new
         volumes and the new VM's XML is updated accordingly.
 
@@ -529,6 +756,8 @@ class VMModel(object):
             "/domain/uuid".
         rollback -- A rollback context so the new volumes can be removed if an
             error occurs during the cloning operation.
+        linked -- Whether the new volumes are qcow2 overlays backed by the
+            original volumes instead of copies of them.
 
         Return:
         The XML descriptor <xml> with the new disk paths instead of the
@@ -541,6 +770,16 @@ class VMModel(object):
         vir_conn = self.conn.get()
         domain_name = xpath_get_text(xml, XPATH_DOMAIN_NAME)[0]
 
+        # the pools are looked up only once and the space taken by the new
+        # volumes is subtracted from the space available on them
+        pools = {}
+
+        def _get_pool(pool_name):
+            if pool_name not in pools:
+                pools[pool_name] = self.storagepool.lookup(pool_name)
+            return pools[pool_name]
+
+        clones = []
         for i, path in enumerate(all_paths):
             try:
                 vir_orig_vol = vir_conn.storageVolLookupByPath(path)
@@ -548,38 +787,42 @@ class VMModel(object):
 
                 orig_pool_name = vir_pool.name()
                 orig_vol_name = vir_orig_vol.name()
+                capacity = vir_orig_vol.info()[1]
+                orig_format = xpath_get_text(
+                    vir_orig_vol.XMLDesc(0), '/volume/target/format/@type'
+                )
             except libvirt.libvirtError as e:
                 raise OperationFailed(
                     'KCHVM0035E', {'name': domain_name, 'err': str(e)}
                 )
 
-            orig_pool = self.storagepool.lookup(orig_pool_name)
-            orig_vol = self.storagevolume.lookup(orig_pool_name, orig_vol_name)
+            orig_pool = _get_pool(orig_pool_name)
+            if orig_pool['type'] not in ['dir', 'netfs', 'logical', 'scsi',
+                                         'iscsi']:
+                # unexpected storage pool type
+                raise InvalidOperation(
+                    'KCHPOOL0014E', {'type': orig_pool['type']})
 
             new_pool_name = orig_pool_name
-            new_pool = orig_pool
+            if linked:
+                # the overlays are files, so they can only be created on the
+                # original pool when it holds files
+                if orig_pool['type'] not in ['dir', 'netfs']:
+                    new_pool_name = 'default'
 
-            if orig_pool['type'] in ['dir', 'netfs', 'logical']:
+            elif orig_pool['type'] in ['dir', 'netfs', 'logical']:
                 # if a volume in a pool 'dir', 'netfs' or 'logical' cannot hold
                 # a new volume with the same size, the pool 'default' should
                 # be used
-                if orig_vol['capacity'] > orig_pool['available']:
+                if capacity > orig_pool['available']:
                     wok_log.warning(
                         f"storage pool '{orig_pool_name}' doesn't have "
                         f'enough free space to store image '
                         f"'{path}'; falling back to 'default'"
                     )
                     new_pool_name = 'default'
-                    new_pool = self.storagepool.lookup('default')
-
-                    # ...and if even the pool 'default' cannot hold a new
-                    # volume, raise an exception
-                    if orig_vol['capacity'] > new_pool['available']:
-                        domain_name = xpath_get_text(xml, XPATH_DOMAIN_NAME)[0]
-                        raise InvalidOperation(
-                            'KCHVM0034E', {'name': domain_name})
 
-            elif orig_pool['type'] in ['scsi', 'iscsi']:
+            else:
                 # SCSI and iSCSI always fall back to the storage pool 'default'
                 wok_log.warning(
                     f'cannot create new volume for clone in '
@@ -587,41 +830,147 @@ class VMModel(object):
                     f"'default'"
                 )
                 new_pool_name = 'default'
-                new_pool = self.storagepool.lookup('default')
 
-                # if the pool 'default' cannot hold a new volume, raise
-                # an exception
-                if orig_vol['capacity'] > new_pool['available']:
-                    domain_name = xpath_get_text(xml, XPATH_DOMAIN_NAME)[0]
-                    raise InvalidOperation('KCHVM0034E', {'name': domain_name})
+            if not linked:
+                new_pool = _get_pool(new_pool_name)
 
-            else:
-                # unexpected storage pool type
-                raise InvalidOperation(
-                    'KCHPOOL0014E', {'type': orig_pool['type']})
+                # ...and if even the pool 'default' cannot hold a new
+                # volume, raise an exception
+                if capacity > new_pool['available']:
+                    raise InvalidOperation(
+                        'KCHVM0034E', {'name': domain_name})
+                new_pool['available'] -= capacity
 
             # new volume name: <UUID>-<loop-index>.<original extension>
             # e.g. 1234-5678-9012-3456-0.img
-            ext = os.path.splitext(path)[1]
-            new_vol_name = f'{uuid}-{i}{ext}'
-            task = self.storagevolume.clone(
-                orig_pool_name, orig_vol_name, new_name=new_vol_name
+            ext = '.qcow2' if linked else os.path.splitext(path)[1]
+            clones.append(
+                {
+                    'path': path,
+                    'pool': orig_pool_name,
+                    'name': orig_vol_name,
+                    'format': orig_format[0] if orig_format else 'raw',
+                    'capacity': capacity,
+                    'new_pool': new_pool_name,
+                    'new_name': f'{uuid}-{i}{ext}',
+                }
             )
-            self.task.wait(task['id'], 3600)  # 1 h
 
-            # get the new volume path and update the XML descriptor
-            new_vol = self.storagevolume.lookup(new_pool_name, new_vol_name)
-            xml = xml_item_update(
-                xml, XPATH_DOMAIN_DISK_BY_FILE % path, new_vol['path'], 'file'
-            )
+        if linked:
+            errors = [self._clone_linked_volume(clone) for clone in clones]
+        else:
+            errors = self._clone_volumes(clones)
+
+        for clone, error in zip(clones, errors):
+            if error is not None:
+                continue
 
             # remove the new volume should an error occur later
             rollback.prependDefer(
-                self.storagevolume.delete, new_pool_name, new_vol_name
+                self.storagevolume.delete, clone['new_pool'], clone['new_name']
+            )
+
+        for error in errors:
+            if error is not None:
+                raise OperationFailed(
+                    'KCHVM0035E', {'name': domain_name, 'err': error})
+
+        # update the XML descriptor with the new volume paths
+        for clone in clones:
+            try:
+                new_vol_path = (
+                    vir_conn.storagePoolLookupByName(clone['new_pool'])
+                    .storageVolLookupByName(clone['new_name'])
+                    .path()
+                )
+            except libvirt.libvirtError as e:
+                raise OperationFailed(
+                    'KCHVM0035E', {'name': domain_name, 'err': str(e)}
+                )
+
+            if linked:
+                xml = xml_item_update(
+                    xml, XPATH_DOMAIN_DISK_DRIVER_BY_FILE % clone['path'],
+                    'qcow2', 'type'
+                )
+            xml = xml_item_update(
+                xml, XPATH_DOMAIN_DISK_BY_FILE % clone['path'], new_vol_path,
+                'file'
             )
 
         return xml
 
+    def _clone_volumes(self, clones):
+        """Copy volumes concurrently, up to CLONE_DISKS_PER_POOL volumes at a
+        time in the same destination pool.
+
+        Arguments:
+        clones -- A list of dicts with the original pool and volume names
+            ("pool" and "name") and the new ones ("new_pool" and "new_name").
+
+        Return:
+        A list with the error message of each clone, or None for the clones
+        which completed successfully.
+        """
+        if not clones:
+            return []
+
+        limits = {}
+        for clone in clones:
+            limits.setdefault(
+                clone['new_pool'],
+                threading.BoundedSemaphore(CLONE_DISKS_PER_POOL)
+            )
+
+        def _clone(clone):
+            with limits[clone['new_pool']]:
+                try:
+                    task = self.storagevolume.clone(
+                        clone['pool'],
+                        clone['name'],
+                        new_pool=clone['new_pool'],
+                        new_name=clone['new_name'],
+                    )
+                    self.task.wait(task['id'], 3600)  # 1 h
+                    task = self.task.lookup(task['id'])
+                except Exception as e:
+                    return str(e)
+
+            if task['status'] != 'finished':
+                return task['message']
+            return None
+
+        pool = ThreadPool(processes=len(clones))
+        try:
+            return pool.map(_clone, clones)
+        finally:
+            pool.terminate()
+
+    def _clone_linked_volume(self, clone):
+        """Create a qcow2 volume backed by the original volume of <clone>,
+        which is described as in _clone_volumes(). The new volume only holds
+        the changes made by the new VM, so the original volume must not be
+        changed while the new VM exists.
+
+        Return:
+        The error message or None if the volume was created.
+        """
+        vol_xml = E.volume(
+            E.name(clone['new_name']),
+            E.capacity(str(clone['capacity']), unit='bytes'),
+            E.target(E.format(type='qcow2')),
+            E.backingStore(E.path(clone['path']),
+                           E.format(type=clone['format'])),
+        )
+        try:
+            vir_pool = self.conn.get().storagePoolLookupByName(
+                clone['new_pool'])
+            vir_pool.createXML(ET.tostring(vol_xml, encoding='unicode'), 0)
+        except libvirt.libvirtError as e:
+            return e.get_error_message()
+        get_pool_refresher(self.conn).invalidate(clone['new_pool'])
+        return None
+
     def _clone_update_objstore(self, old_uuid, new_uuid, rollback):
         """Update Kimchi's object store with the cloning VM.
 
@@ -715,10 +1064,13 @@ class VMModel(object):
         node = self._build_access_elem(dom, users, groups)
         set_metadata_node(dom, [node])
 
-    def _get_access_info(self, dom):
+    def _get_access_info(self, view):
+        return self._parse_access_info(view.get_metadata_node('access'))
+
+    @staticmethod
+    def _parse_access_info(access_xml):
         users = groups = list()
-        access_xml = get_metadata_node(
-            dom, 'access') or """<access></access>"""
+        access_xml = access_xml or """<access></access>"""
         access_info = dictize(access_xml)
         auth = config.get('authentication', 'method')
         if 'auth' in access_info['access'] and (
@@ -890,12 +1242,12 @@ class VMModel(object):
 
         return new_xml
 
-    def _update_topology(self, dom, new_xml, topology):
+    def _update_topology(self, dom, new_xml, topology, view=None):
         sockets = str(topology['sockets'])
         cores = str(topology['cores'])
         threads = str(topology['threads'])
 
-        if self.has_topology(dom):
+        if self.has_topology(dom, view):
             # topology is being updated
             xpath = XPATH_TOPOLOGY
             new_xml = xml_item_update(new_xml, xpath, sockets, 'sockets')
@@ -927,8 +1279,10 @@ class VMModel(object):
             new_xml = self._update_description(new_xml, params['description'])
 
         # Update CPU info
+        # the current topology is read from a single fetch of the XML
+        view = DomainView(dom, 0)
         cpu_info = params.get('cpu_info', {})
-        cpu_info = self._update_cpu_info(new_xml, dom, cpu_info)
+        cpu_info = self._update_cpu_info(new_xml, dom, cpu_info, view)
 
         vcpus = str(cpu_info['vcpus'])
         new_xml = xml_item_update(new_xml, XPATH_VCPU, vcpus, 'current')
@@ -938,8 +1292,8 @@ class VMModel(object):
 
         topology = cpu_info['topology']
         if topology:
-            new_xml = self._update_topology(dom, new_xml, topology)
-        elif self.has_topology(dom):
+            new_xml = self._update_topology(dom, new_xml, topology, view)
+        elif self.has_topology(dom, view):
             # topology is being undefined: remove it
             new_xml = xml_item_remove(new_xml, XPATH_TOPOLOGY)
 
@@ -997,8 +1351,7 @@ class VMModel(object):
         return nonascii_name if nonascii_name is not None else vm_name, dom
 
     def _get_new_memory(self, root, newMem, oldMem, memDevs):
-        memDevsAmount = self._get_mem_dev_total_size(
-            ET.tostring(root, encoding='unicode'))
+        memDevsAmount = self._get_mem_dev_total_size(root)
 
         if newMem > (oldMem << 10):
             return newMem - memDevsAmount
@@ -1013,9 +1366,7 @@ class VMModel(object):
                 )
                 root.find('./devices').remove(dev)
                 if ((oldMem << 10) - totRemoved) <= newMem:
-                    return newMem - self._get_mem_dev_total_size(
-                        ET.tostring(root, encoding='unicode')
-                    )
+                    return newMem - self._get_mem_dev_total_size(root)
 
         if newMem == (oldMem << 10):
             return newMem - memDevsAmount
@@ -1035,7 +1386,7 @@ class VMModel(object):
             # Just update value in max memory tag
             maxMemTag.text = str(newMaxMem)
         elif (maxMemTag is not None) and (newMem == newMaxMem):
-            if self._get_mem_dev_total_size(ET.tostring(root, encoding='unicode')) == 0:
+            if self._get_mem_dev_total_size(root) == 0:
                 # Remove the tag
                 root.remove(maxMemTag)
             else:
@@ -1105,8 +1456,7 @@ class VMModel(object):
 
             if (maxMemTag is not None) and (not hasMaxMem):
                 if newMem == newMaxMem and (
-                    self._get_mem_dev_total_size(
-                        ET.tostring(root, encoding='unicode')) == 0
+                    self._get_mem_dev_total_size(root) == 0
                 ):
                     root.remove(maxMemTag)
 
@@ -1129,19 +1479,22 @@ class VMModel(object):
     def get_vm_cpu_threads(self, vm_xml):
         return xpath_get_text(vm_xml, XPATH_TOPOLOGY + '/@threads')[0]
 
-    def get_vm_cpu_topology(self, dom):
+    def get_vm_cpu_topology(self, dom, view=None):
+        if view is None:
+            view = DomainView(dom, 0)
+
         topology = {}
-        if self.has_topology(dom):
-            sockets = int(self.get_vm_cpu_sockets(dom.XMLDesc(0)))
-            cores = int(self.get_vm_cpu_cores(dom.XMLDesc(0)))
-            threads = int(self.get_vm_cpu_threads(dom.XMLDesc(0)))
+        if self.has_topology(dom, view):
+            sockets = int(view.xpath(XPATH_TOPOLOGY + '/@sockets')[0])
+            cores = int(view.xpath(XPATH_TOPOLOGY + '/@cores')[0])
+            threads = int(view.xpath(XPATH_TOPOLOGY + '/@threads')[0])
 
             topology = {'sockets': sockets, 'cores': cores, 'threads': threads}
 
         return topology
 
-    def _update_cpu_info(self, new_xml, dom, new_info):
-        topology = self.get_vm_cpu_topology(dom)
+    def _update_cpu_info(self, new_xml, dom, new_info, view=None):
+        topology = self.get_vm_cpu_topology(dom, view)
 
         # if current is not defined in vcpu, vcpus is equal to maxvcpus
         xml_maxvcpus = xpath_get_text(new_xml, 'vcpu')
@@ -1191,8 +1544,7 @@ class VMModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed('KCHCPUHOTP0002E', {'err': str(e)})
 
-    def _get_mem_dev_total_size(self, xml):
-        root = ET.fromstring(xml)
+    def _get_mem_dev_total_size(self, root):
         totMemDevs = 0
         for size in root.findall('./devices/memory/target/size'):
             totMemDevs += convert_data_size(size.text, size.get('unit'), 'KiB')
@@ -1249,131 +1601,6 @@ class VMModel(object):
         except Exception as e:
             raise OperationFailed('KCHVM0047E', {'error': str(e)})
 
-    def _has_video(self, dom):
-        dom = ElementTree.fromstring(dom.XMLDesc(0))
-        return dom.find('devices/video') is not None
-
-    def _update_guest_stats(self, name):
-        try:
-            dom = VMModel.get_vm(name, self.conn)
-
-            vm_uuid = dom.UUIDString()
-            info = dom.info()
-            state = DOM_STATE_MAP[info[0]]
-
-            if state != 'running':
-                self.stats[vm_uuid] = {}
-                return
-
-            if self.stats.get(vm_uuid, None) is None:
-                self.stats[vm_uuid] = {}
-
-            timestamp = time.time()
-            prevStats = self.stats.get(vm_uuid, {})
-            seconds = timestamp - prevStats.get('timestamp', 0)
-            self.stats[vm_uuid].update({'timestamp': timestamp})
-
-            self._get_percentage_cpu_usage(vm_uuid, info, seconds)
-            self._get_percentage_mem_usage(vm_uuid, dom, seconds)
-            self._get_network_io_rate(vm_uuid, dom, seconds)
-            self._get_disk_io_rate(vm_uuid, dom, seconds)
-        except Exception as e:
-            # VM might be deleted just after we get the list.
-            # This is OK, just skip.
-            wok_log.debug(f'Error processing VM stats: {e}')
-
-    def _get_percentage_cpu_usage(self, vm_uuid, info, seconds):
-        prevCpuTime = self.stats[vm_uuid].get('cputime', 0)
-
-        cpus = info[3]
-        cpuTime = info[4] - prevCpuTime
-
-        base = ((cpuTime) * 100.0) / (seconds * 1000.0 * 1000.0 * 1000.0)
-        percentage = max(0.0, min(100.0, base / cpus))
-
-        self.stats[vm_uuid].update({'cputime': info[4], 'cpu': percentage})
-
-    def _get_percentage_mem_usage(self, vm_uuid, dom, seconds):
-        # Get the guest's memory stats
-        memStats = dom.memoryStats()
-        if ('available' in memStats) and ('unused' in memStats):
-            memUsed = memStats.get('available') - memStats.get('unused')
-            percentage = (memUsed * 100.0) / memStats.get('available')
-        elif ('rss' in memStats) and ('actual' in memStats):
-            percentage = memStats.get('rss') * 100.0 / memStats.get('actual')
-        else:
-            wok_log.error('Failed to measure memory usage of the guest.')
-
-        percentage = max(0.0, min(100.0, percentage))
-
-        self.stats[vm_uuid].update({'mem_usage': percentage})
-
-    def _get_network_io_rate(self, vm_uuid, dom, seconds):
-        prevNetRxKB = self.stats[vm_uuid].get('netRxKB', 0)
-        prevNetTxKB = self.stats[vm_uuid].get('netTxKB', 0)
-        currentMaxNetRate = self.stats[vm_uuid].get('max_net_io', 100)
-
-        rx_bytes = 0
-        tx_bytes = 0
-
-        tree = ElementTree.fromstring(dom.XMLDesc(0))
-        for target in tree.findall('devices/interface/target'):
-            dev = target.get('dev')
-            io = dom.interfaceStats(dev)
-            rx_bytes += io[0]
-            tx_bytes += io[4]
-
-        netRxKB = float(rx_bytes) / 1000
-        netTxKB = float(tx_bytes) / 1000
-
-        rx_stats = (netRxKB - prevNetRxKB) / seconds
-        tx_stats = (netTxKB - prevNetTxKB) / seconds
-
-        rate = rx_stats + tx_stats
-        max_net_io = round(max(currentMaxNetRate, int(rate)), 1)
-
-        self.stats[vm_uuid].update(
-            {
-                'net_io': rate,
-                'max_net_io': max_net_io,
-                'netRxKB': netRxKB,
-                'netTxKB': netTxKB,
-            }
-        )
-
-    def _get_disk_io_rate(self, vm_uuid, dom, seconds):
-        prevDiskRdKB = self.stats[vm_uuid].get('diskRdKB', 0)
-        prevDiskWrKB = self.stats[vm_uuid].get('diskWrKB', 0)
-        currentMaxDiskRate = self.stats[vm_uuid].get('max_disk_io', 100)
-
-        rd_bytes = 0
-        wr_bytes = 0
-
-        tree = ElementTree.fromstring(dom.XMLDesc(0))
-        for target in tree.findall('devices/disk/target'):
-            dev = target.get('dev')
-            io = dom.blockStats(dev)
-            rd_bytes += io[1]
-            wr_bytes += io[3]
-
-        diskRdKB = float(rd_bytes) / 1024
-        diskWrKB = float(wr_bytes) / 1024
-
-        rd_stats = (diskRdKB - prevDiskRdKB) / seconds
-        wr_stats = (diskWrKB - prevDiskWrKB) / seconds
-
-        rate = rd_stats + wr_stats
-        max_disk_io = round(max(currentMaxDiskRate, int(rate)), 1)
-
-        self.stats[vm_uuid].update(
-            {
-                'disk_io': rate,
-                'max_disk_io': max_disk_io,
-                'diskRdKB': diskRdKB,
-                'diskWrKB': diskWrKB,
-            }
-        )
-
     def lookup(self, name):
         dom = self.get_vm(name, self.conn)
         try:
@@ -1388,19 +1615,17 @@ class VMModel(object):
             raise OperationFailed('KCHVM0009E', {'name': name, 'err': str(e)})
         state = DOM_STATE_MAP[info[0]]
         screenshot = None
-        # (type, listen, port, passwd, passwdValidTo)
-        graphics = self.get_graphics(name, self.conn)
-        graphics_port = graphics[2]
-        graphics_port = graphics_port if state == 'running' else None
+        # all the values below are read from the same parsed XML
+        view = DomainView(dom)
         # only take a screenshot if configured to do so
         take_screenshot = kimchi_config.get('kimchi', {}).get('take_screenshot', True)
         try:
-            if take_screenshot and state == 'running' and self._has_video(dom):
+            if (
+                take_screenshot
+                and state == 'running'
+                and view.has_device('video')
+            ):
                 screenshot = self.vmscreenshot.lookup(name)
-            elif state == 'shutoff':
-                # reset vm stats when it is powered off to avoid sending
-                # incorrect (old) data
-                self.stats[dom.UUIDString()] = {}
         except NotFoundError:
             pass
 
@@ -1411,31 +1636,181 @@ class VMModel(object):
                 extra_info = {}
         icon = extra_info.get('icon')
 
-        self._update_guest_stats(name)
-        vm_stats = self.stats.get(dom.UUIDString(), {})
-        res = {}
-        res['cpu_utilization'] = vm_stats.get('cpu', 0)
-        res['mem_utilization'] = vm_stats.get('mem_usage', 0)
-        res['net_throughput'] = vm_stats.get('net_io', 0)
-        res['net_throughput_peak'] = vm_stats.get('max_net_io', 100)
-        res['io_throughput'] = vm_stats.get('disk_io', 0)
-        res['io_throughput_peak'] = vm_stats.get('max_disk_io', 100)
-        users, groups = self._get_access_info(dom)
+        users, groups = self._get_access_info(view)
 
-        xml = dom.XMLDesc(0)
-        maxvcpus = int(xpath_get_text(xml, XPATH_VCPU)[0])
+        vm_info = self._get_vm_info(name, dom.UUIDString(), info, view)
+        vm_info.update(
+            {
+                'screenshot': screenshot,
+                'icon': icon,
+                'graphics': self._get_graphics_info(
+                    self._get_graphics_from_view(view), state
+                ),
+                'users': users,
+                'groups': groups,
+                'persistent': True if dom.isPersistent() else False,
+                'autostart': dom.autostart(),
+            }
+        )
+        return vm_info
 
-        cpu_info = {'vcpus': info[3], 'maxvcpus': maxvcpus, 'topology': {}}
+    def _lookup_all(self):
+        """Retrieve the full description of all the virtual machines.
+
+        The result is the same as calling "lookup" for every VM, but the
+        libvirt bulk APIs are used instead: the state, memory and vCPUs of all
+        VMs come from a single virConnect.getAllDomainStats() call, the
+        statistics from the background sampler, the XML of each VM
+        is fetched and parsed only once and the object store is read in a
+        single session.
+
+        Return:
+        A list with the description of all the VMs, sorted by name.
+        """
+        conn = self.conn.get()
+        try:
+            records = conn.getAllDomainStats(BULK_STATS, 0)
+        except libvirt.libvirtError as e:
+            # not all libvirt drivers implement the bulk stats API
+            wok_log.debug(f'Unable to get bulk domain statistics: {e}')
+            records = [(dom, {}) for dom in conn.listAllDomains(0)]
+
+        persistent = set(
+            dom.UUIDString()
+            for dom in conn.listAllDomains(
+                libvirt.VIR_CONNECT_LIST_DOMAINS_PERSISTENT)
+        )
+        autostart = set(
+            dom.UUIDString()
+            for dom in conn.listAllDomains(
+                libvirt.VIR_CONNECT_LIST_DOMAINS_AUTOSTART)
+        )
+
+        domains = []
+        for dom, record in records:
+            try:
+                info = self._get_info_from_record(dom, record)
+                view = DomainView(dom)
+                # fetch and parse the XML now to skip deleted VMs
+                view.root
+            except libvirt.libvirtError as e:
+                # VM might be deleted just after we get the list.
+                # This is OK, just skip.
+                wok_log.debug(f'Error processing VM {dom.name()}: {e}')
+                continue
+            domains.append((dom.UUIDString(), info, view))
+
+        take_screenshot = kimchi_config.get('kimchi', {}).get('take_screenshot', True)
+        icons = {}
+        screenshots = {}
+        with self.objstore as session:
+            for vm_uuid, info, view in domains:
+                try:
+                    icons[vm_uuid] = session.get('vm', vm_uuid, True).get('icon')
+                except NotFoundError:
+                    icons[vm_uuid] = None
+
+                if not (
+                    take_screenshot
+                    and DOM_STATE_MAP[info[0]] == 'running'
+                    and view.has_device('video')
+                ):
+                    continue
+
+                try:
+                    params = session.get('screenshot', vm_uuid)
+                except NotFoundError:
+                    params = {'uuid': vm_uuid}
+                screenshots[vm_uuid] = LibvirtVMScreenshot(params, self.conn)
+
+        vms = []
+        for vm_uuid, info, view in domains:
+            state = DOM_STATE_MAP[info[0]]
+            screenshot = None
+            if vm_uuid in screenshots:
+                try:
+                    screenshot = screenshots[vm_uuid].lookup()
+                except NotFoundError:
+                    del screenshots[vm_uuid]
+
+            name = view.root.findtext('name')
+            nonascii_xml = view.get_metadata_node('name')
+            if nonascii_xml:
+                name = ET.fromstring(nonascii_xml).text
+
+            users, groups = self._get_access_info(view)
+
+            vm_info = self._get_vm_info(name, vm_uuid, info, view)
+            vm_info.update(
+                {
+                    'screenshot': screenshot,
+                    'icon': icons[vm_uuid],
+                    'graphics': self._get_graphics_info(
+                        self._get_graphics_from_view(view), state
+                    ),
+                    'users': users,
+                    'groups': groups,
+                    'persistent': vm_uuid in persistent,
+                    'autostart': 1 if vm_uuid in autostart else 0,
+                }
+            )
+            vms.append(vm_info)
+
+        # screenshot info changed after scratch generation
+        if screenshots:
+            try:
+                with self.objstore as session:
+                    for vm_uuid, screenshot in screenshots.items():
+                        session.store(
+                            'screenshot', vm_uuid, screenshot.info,
+                            get_kimchi_version()
+                        )
+            except Exception as e:
+                # It is possible to continue Kimchi executions without store
+                # screenshots
+                wok_log.error(
+                    f'Error trying to update database with guest '
+                    f'screenshot information due error: {e}'
+                )
 
-        if self.has_topology(dom):
-            sockets = int(xpath_get_text(xml, XPATH_TOPOLOGY + '/@sockets')[0])
-            cores = int(xpath_get_text(xml, XPATH_TOPOLOGY + '/@cores')[0])
-            threads = int(xpath_get_text(xml, XPATH_TOPOLOGY + '/@threads')[0])
+        return sorted(vms, key=lambda vm: vm['name'].lower())
+
+    @staticmethod
+    def _get_info_from_record(dom, record):
+        """Build the same list returned by virDomain.info() from a record
+        returned by virConnect.getAllDomainStats(). Fall back to info() when
+        the record does not have all the needed values.
+        """
+        if not all(stat in record for stat in BULK_INFO_STATS):
+            return dom.info()
+
+        return [
+            record['state.state'],
+            record['balloon.maximum'],
+            record['balloon.current'],
+            record['vcpu.current'],
+            record.get('cpu.time', 0),
+        ]
 
+    def _get_vm_info(self, name, vm_uuid, info, view):
+        """Build the VM description from its DomainView and the list returned
+        by virDomain.info(). Only the values which do not need any other
+        libvirt call are filled here.
+        """
+        state = DOM_STATE_MAP[info[0]]
+
+        maxvcpus = int(view.xpath(XPATH_VCPU)[0])
+
+        cpu_info = {'vcpus': info[3], 'maxvcpus': maxvcpus, 'topology': {}}
+
+        sockets = view.xpath(XPATH_TOPOLOGY + '/@sockets')
+        cores = view.xpath(XPATH_TOPOLOGY + '/@cores')
+        threads = view.xpath(XPATH_TOPOLOGY + '/@threads')
+        if sockets and cores and threads:
             cpu_info['topology'] = {
-                'sockets': sockets,
-                'cores': cores,
-                'threads': threads,
+                'sockets': int(sockets[0]),
+                'cores': int(cores[0]),
+                'threads': int(threads[0]),
             }
 
         # Kimchi does not make use of 'currentMemory' tag, it only updates
@@ -1443,73 +1818,75 @@ class VMModel(object):
         # Libvirt always updates 'memory', so we can use this tag retrieving
         # from Libvirt API maxMemory() function, regardeless of the VM state
         # Case VM changed currentMemory outside Kimchi, sum mem devs
-        memory = dom.maxMemory() >> 10
+        memory = info[1] >> 10
         curr_mem = info[2] >> 10
 
         # On CentOS, dom.info does not retrieve memory. So, if machine does
         # not have memory hotplug, parse memory from xml
         if curr_mem == 0:
-            curr_mem = int(xpath_get_text(xml, XPATH_MEMORY)[0]) >> 10
+            curr_mem = int(view.xpath(XPATH_MEMORY)[0]) >> 10
 
         if memory != curr_mem:
-            memory = curr_mem + (self._get_mem_dev_total_size(xml) >> 10)
-
-        # assure there is no zombie process left
-        for proc in self._serial_procs[:]:
-            if not proc.is_alive():
-                proc.join(1)
-                self._serial_procs.remove(proc)
+            memory = curr_mem + (self._get_mem_dev_total_size(view.root) >> 10)
 
         # Get max memory, or return "memory" if not set
-        maxmemory = xpath_get_text(xml, XPATH_MAX_MEMORY)
+        maxmemory = view.xpath(XPATH_MAX_MEMORY)
         if len(maxmemory) > 0:
             maxmemory = convert_data_size(maxmemory[0], 'KiB', 'MiB')
         else:
             maxmemory = memory
 
         # get boot order and bootmenu
-        boot = xpath_get_text(xml, XPATH_BOOT)
-        bootmenu = 'yes' if 'yes' in xpath_get_text(
-            xml, XPATH_BOOTMENU) else 'no'
+        boot = view.xpath(XPATH_BOOT)
+        bootmenu = 'yes' if 'yes' in view.xpath(XPATH_BOOTMENU) else 'no'
 
         vm_info = {
             'name': name,
-            'title': ''.join(xpath_get_text(xml, XPATH_TITLE)),
-            'description': ''.join(xpath_get_text(xml, XPATH_DESCRIPTION)),
+            'title': ''.join(view.xpath(XPATH_TITLE)),
+            'description': ''.join(view.xpath(XPATH_DESCRIPTION)),
             'state': state,
-            'stats': res,
-            'uuid': dom.UUIDString(),
+            'stats': self.vmstats.get_stats(vm_uuid),
+            'uuid': vm_uuid,
             'memory': {'current': memory, 'maxmemory': maxmemory},
             'cpu_info': cpu_info,
-            'screenshot': screenshot,
-            'icon': icon,
-            # (type, listen, port, passwd, passwdValidTo)
-            'graphics': {
-                'type': graphics[0],
-                'listen': graphics[1],
-                'port': graphics_port,
-                'passwd': graphics[3],
-                'passwdValidTo': graphics[4],
-            },
-            'users': users,
-            'groups': groups,
             'access': 'full',
-            'persistent': True if dom.isPersistent() else False,
             'bootorder': boot,
             'bootmenu': bootmenu,
-            'autostart': dom.autostart(),
         }
         if platform.machine() in ['s390', 's390x']:
-            vm_console = xpath_get_text(xml, XPATH_DOMAIN_CONSOLE_TARGET)
+            vm_console = view.xpath(XPATH_DOMAIN_CONSOLE_TARGET)
             vm_info['console'] = vm_console[0] if vm_console else ''
 
         return vm_info
 
+    @staticmethod
+    def _get_graphics_info(graphics, state):
+        # (type, listen, port, passwd, passwdValidTo)
+        return {
+            'type': graphics[0],
+            'listen': graphics[1],
+            'port': graphics[2] if state == 'running' else None,
+            'passwd': graphics[3],
+            'passwdValidTo': graphics[4],
+        }
+
     def _vm_get_disk_paths(self, dom):
         xml = dom.XMLDesc(0)
         xpath = "/domain/devices/disk[@device='disk']/source/@file"
         return xpath_get_text(xml, xpath)
 
+    def _get_linked_clones(self, name, paths):
+        """
+        Return the names of the VMs whose disks are overlays of the disks
+        <paths> of the VM <name>, sorted.
+        """
+        inventory = get_domain_inventory(self.conn)
+        clones = set()
+        for path in paths:
+            clones.update(inventory.get_backing_users(path))
+        clones.discard(name)
+        return sorted(clones, key=str.lower)
+
     @staticmethod
     def get_vm(name, conn):
         def raise_exception(error_code):
@@ -1541,9 +1918,16 @@ class VMModel(object):
         if not dom.isPersistent():
             raise InvalidOperation('KCHVM0036E', {'name': name})
 
-        self._vmscreenshot_delete(dom.UUIDString())
         paths = self._vm_get_disk_paths(dom)
+        # the linked clones would lose their base images
+        clones = self._get_linked_clones(name, paths)
+        if clones:
+            raise InvalidOperation(
+                'KCHVM0097E', {'name': name, 'clones': ', '.join(clones)})
+
+        self._vmscreenshot_delete(dom.UUIDString())
         info = self.lookup(name)
+        inventory = get_domain_inventory(self.conn)
 
         if info['state'] != 'shutoff':
             self.poweroff(name)
@@ -1569,8 +1953,19 @@ class VMModel(object):
             raise OperationFailed(
                 'KCHVM0021E', {'name': name, 'err': e.get_error_message()}
             )
+        inventory.invalidate(dom)
 
         for path in paths:
+            # do not remove a disk shared with other VMs or backing them
+            used_by = inventory.get_disk_users(path)
+            used_by += inventory.get_backing_users(path)
+            if used_by:
+                wok_log.warning(
+                    f'Not deleting storage volume {path} of VM {name} as it '
+                    f'is still used by: {", ".join(used_by)}'
+                )
+                continue
+
             try:
                 vol = conn.storageVolLookupByPath(path)
                 pool = vol.storagePoolLookupByVolume()
@@ -1615,12 +2010,19 @@ class VMModel(object):
         if DOM_STATE_MAP[dom.info()[0]] == 'running':
             raise InvalidOperation('KCHVM0048E', {'name': name})
 
+        # the guest would change the base images of the linked clones
+        clones = self._get_linked_clones(name, self._vm_get_disk_paths(dom))
+        if clones:
+            raise InvalidOperation(
+                'KCHVM0098E', {'name': name, 'clones': ', '.join(clones)})
+
         try:
             dom.create()
         except libvirt.libvirtError as e:
             raise OperationFailed(
                 'KCHVM0019E', {'name': name, 'err': e.get_error_message()}
             )
+        get_domain_inventory(self.conn).invalidate(dom)
 
     def poweroff(self, name):
         dom = self.get_vm(name, self.conn)
@@ -1635,6 +2037,7 @@ class VMModel(object):
             raise OperationFailed(
                 'KCHVM0020E', {'name': name, 'err': e.get_error_message()}
             )
+        get_domain_inventory(self.conn).invalidate(dom)
 
     def shutdown(self, name):
         dom = self.get_vm(name, self.conn)
@@ -1682,28 +2085,34 @@ class VMModel(object):
     @staticmethod
     def get_graphics(name, conn):
         dom = VMModel.get_vm(name, conn)
-        xml = dom.XMLDesc(libvirt.VIR_DOMAIN_XML_SECURE)
+        return VMModel._get_graphics_from_view(DomainView(dom))
 
+    @staticmethod
+    def _get_graphics_from_view(view):
+        """
+        Parse the graphics information from a domain XML fetched with the
+        VIR_DOMAIN_XML_SECURE flag, so the password is also available.
+        """
         expr = '/domain/devices/graphics/@type'
-        res = xpath_get_text(xml, expr)
+        res = view.xpath(expr)
         graphics_type = res[0] if res else None
 
         expr = '/domain/devices/graphics/@listen'
-        res = xpath_get_text(xml, expr)
+        res = view.xpath(expr)
         graphics_listen = res[0] if res else None
 
         graphics_port = graphics_passwd = graphics_passwdValidTo = None
         if graphics_type:
             expr = "/domain/devices/graphics[@type='%s']/@port"
-            res = xpath_get_text(xml, expr % graphics_type)
+            res = view.xpath(expr % graphics_type)
             graphics_port = int(res[0]) if res else None
 
             expr = "/domain/devices/graphics[@type='%s']/@passwd"
-            res = xpath_get_text(xml, expr % graphics_type)
+            res = view.xpath(expr % graphics_type)
             graphics_passwd = res[0] if res else None
 
             expr = "/domain/devices/graphics[@type='%s']/@passwdValidTo"
-            res = xpath_get_text(xml, expr % graphics_type)
+            res = view.xpath(expr % graphics_type)
             if res:
                 to = time.mktime(time.strptime(res[0], '%Y-%m-%dT%H:%M:%S'))
                 graphics_passwdValidTo = to - time.mktime(time.gmtime())
@@ -1735,21 +2144,15 @@ class VMModel(object):
         )
 
         try:
-            proc = serialconsole.main(name, self.conn.get().getURI())
-
-            proc.join(2)
-            if not proc.is_alive():
-                raise OperationFailed('KCHVM0082E', {'name': name})
-
-            self._serial_procs.append(proc)
-
-        except OperationFailed:
-            raise
+            opened = serialconsole.get_console_server(self.conn).open(name)
 
         except Exception as e:
             wok_log.error(str(e))
             raise OperationFailed('KCHVM0077E', {'name': name})
 
+        if not opened:
+            raise OperationFailed('KCHVM0082E', {'name': name})
+
     def connect(self, name):
         # (type, listen, port, passwd, passwdValidTo)
         graphics_port = self.get_graphics(name, self.conn)[2]
@@ -1790,6 +2193,7 @@ class VMModel(object):
             vir_dom.suspend()
         except libvirt.libvirtError as e:
             raise OperationFailed('KCHVM0038E', {'name': name, 'err': str(e)})
+        get_domain_inventory(self.conn).invalidate(vir_dom)
 
     def resume(self, name):
         """Resume the virtual machine's execution and puts it in the
@@ -1810,6 +2214,7 @@ class VMModel(object):
             vir_dom.resume()
         except libvirt.libvirtError as e:
             raise OperationFailed('KCHVM0040E', {'name': name, 'err': str(e)})
+        get_domain_inventory(self.conn).invalidate(vir_dom)
 
     def _check_if_host_not_localhost(self, remote_host):
         hostname = socket.gethostname()
@@ -2154,11 +2559,15 @@ class VMModel(object):
             self._create_vm_remote_paths(name, remote_host, user)
 
         try:
-            if enable_rdma:
-                param_uri = 'rdma://' + remote_host
-                dom.migrate(dest_conn, flags, uri=param_uri)
-            else:
-                dom.migrate(dest_conn, flags)
+            # the migration lasts until the memory is copied, do not hold the
+            # shared connection meanwhile
+            with self.conn.borrow() as conn:
+                dom = conn.lookupByUUIDString(dom.UUIDString())
+                if enable_rdma:
+                    param_uri = 'rdma://' + remote_host
+                    dom.migrate(dest_conn, flags, uri=param_uri)
+                else:
+                    dom.migrate(dest_conn, flags)
         except libvirt.libvirtError as e:
             cb('Migrate failed', False)
             raise OperationFailed('KCHVM0058E', {'err': str(e), 'name': name})
@@ -2197,6 +2606,15 @@ class VMScreenshotModel(object):
             )
         return img_path
 
+    def get_image(self, name):
+        """
+        Return the latest thumbnail of the VM <name> kept in memory, as
+        returned by VMScreenshot.get_image(), or None.
+        """
+        dom = VMModel.get_vm(name, self.conn)
+        return LibvirtVMScreenshot({'uuid': dom.UUIDString()},
+                                   self.conn).get_image()
+
     @staticmethod
     def get_screenshot(vm_uuid, objstore, conn):
         try:
@@ -2219,6 +2637,29 @@ class VMScreenshotModel(object):
         return LibvirtVMScreenshot(params, conn)
 
 
+class VMStatsModel(object):
+    def __init__(self, **kargs):
+        self.conn = kargs['conn']
+        self.vmstats = kargs['vmstats']
+
+    def lookup(self, name):
+        dom = VMModel.get_vm(name, self.conn)
+        return self.vmstats.get_stats(dom.UUIDString())
+
+
+class VMStatsHistoryModel(object):
+    def __init__(self, **kargs):
+        self.conn = kargs['conn']
+        self.vmstats = kargs['vmstats']
+
+    def lookup(self, name):
+        dom = VMModel.get_vm(name, self.conn)
+        return {
+            'interval': self.vmstats.interval,
+            'samples': self.vmstats.get_history(dom.UUIDString()),
+        }
+
+
 class LibvirtVMScreenshot(VMScreenshot):
     def __init__(self, vm_uuid, conn):
         VMScreenshot.__init__(self, vm_uuid)
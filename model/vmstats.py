@@ -0,0 +1,337 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import array
+import threading
+import time
+
+import cherrypy
+import libvirt
+from wok.plugins.kimchi.model.utils import DomainView
+from wok.utils import wok_log
+
+
+# seconds between two samples and number of samples kept per VM
+DEFAULT_INTERVAL = 5
+DEFAULT_HISTORY = 60
+
+# statistics groups requested to libvirt on every sample
+SAMPLER_STATS = (
+    libvirt.VIR_DOMAIN_STATS_STATE
+    | libvirt.VIR_DOMAIN_STATS_CPU_TOTAL
+    | libvirt.VIR_DOMAIN_STATS_BALLOON
+    | libvirt.VIR_DOMAIN_STATS_VCPU
+    | libvirt.VIR_DOMAIN_STATS_INTERFACE
+    | libvirt.VIR_DOMAIN_STATS_BLOCK
+)
+
+# key: virDomain.memoryStats() key; value: bulk statistics key
+MEM_STATS = {
+    'actual': 'balloon.current',
+    'available': 'balloon.available',
+    'unused': 'balloon.unused',
+    'rss': 'balloon.rss',
+}
+
+# values stored for each sample, in order
+SAMPLE_FIELDS = ('timestamp', 'cpu', 'mem', 'net_io', 'disk_io')
+
+# the lowest value reported as the peak of network and disk throughput
+MIN_PEAK = 100
+
+
+class StatsRingBuffer(object):
+    """
+    Keep the last <size> samples of a VM in a flat array of doubles, so the
+    memory used does not depend on how long the VM has been running.
+    """
+
+    def __init__(self, size, fields=SAMPLE_FIELDS):
+        self.size = size
+        self.fields = fields
+        self._data = array.array('d', [0.0] * (size * len(fields)))
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, sample):
+        width = len(self.fields)
+        start = self._next * width
+        self._data[start:start + width] = array.array('d', sample)
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    def _row(self, index):
+        width = len(self.fields)
+        start = index * width
+        return dict(zip(self.fields, self._data[start:start + width]))
+
+    def last(self):
+        if self._count == 0:
+            return None
+        return self._row((self._next - 1) % self.size)
+
+    def samples(self):
+        """Return the samples from the oldest to the newest one"""
+        first = (self._next - self._count) % self.size
+        return [self._row((first + i) % self.size) for i in range(self._count)]
+
+    def peak(self, field):
+        offset = self.fields.index(field)
+        width = len(self.fields)
+        first = (self._next - self._count) % self.size
+        return max(
+            (self._data[((first + i) % self.size) * width + offset]
+             for i in range(self._count)),
+            default=0.0,
+        )
+
+
+# key: libvirt URI; value: VMStatsSampler
+_samplers = {}
+_samplers_lock = threading.Lock()
+
+
+def get_vm_stats_sampler(conn):
+    """
+    Return the VM statistics sampler shared by all the users of the libvirt
+    connection <conn>.
+    """
+    with _samplers_lock:
+        sampler = _samplers.get(conn.uri)
+        if sampler is None:
+            sampler = _samplers[conn.uri] = VMStatsSampler(conn)
+        return sampler
+
+
+class VMStatsSampler(object):
+    """
+    Sample the statistics of all running VMs at a fixed interval using the
+    libvirt bulk statistics API. The rates are computed between two samples,
+    so they do not depend on how often the clients ask for them.
+    """
+
+    def __init__(self, conn, interval=DEFAULT_INTERVAL, history=DEFAULT_HISTORY):
+        self.conn = conn
+        self.interval = interval
+        self.history = history
+        # key: VM UUID; value: StatsRingBuffer
+        self._buffers = {}
+        # key: VM UUID; value: raw counters of the last sample
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.sampler_thread = None
+
+    def start(self):
+        # the sampler is shared by the models of the same connection
+        if self.sampler_thread is not None:
+            return
+
+        # Using cherrypy BackgroundTask class due to issues when using
+        # threading module with cherrypy.
+        self.sampler_thread = cherrypy.process.plugins.BackgroundTask(
+            self.interval, self._sample
+        )
+        self.sampler_thread.setName('KimchiVMStatsSampler')
+        self.sampler_thread.setDaemon(True)
+        self.sampler_thread.start()
+
+    def stop(self):
+        if self.sampler_thread is None:
+            return
+
+        self.sampler_thread.cancel()
+        self.sampler_thread = None
+
+    def get_stats(self, vm_uuid):
+        """Return the latest statistics of a VM as shown in the VM lookup"""
+        with self._lock:
+            buf = self._buffers.get(vm_uuid)
+            last = buf.last() if buf is not None else None
+            if last is None:
+                last = dict.fromkeys(SAMPLE_FIELDS, 0)
+                net_peak = disk_peak = 0
+            else:
+                net_peak = buf.peak('net_io')
+                disk_peak = buf.peak('disk_io')
+
+        return {
+            'cpu_utilization': last['cpu'],
+            'mem_utilization': last['mem'],
+            'net_throughput': last['net_io'],
+            'net_throughput_peak': round(max(MIN_PEAK, int(net_peak)), 1),
+            'io_throughput': last['disk_io'],
+            'io_throughput_peak': round(max(MIN_PEAK, int(disk_peak)), 1),
+        }
+
+    def get_history(self, vm_uuid):
+        """Return all the samples kept for a VM, from the oldest one"""
+        with self._lock:
+            buf = self._buffers.get(vm_uuid)
+            samples = buf.samples() if buf is not None else []
+
+        return [
+            {
+                'timestamp': s['timestamp'],
+                'cpu_utilization': s['cpu'],
+                'mem_utilization': s['mem'],
+                'net_throughput': s['net_io'],
+                'io_throughput': s['disk_io'],
+            }
+            for s in samples
+        ]
+
+    def _sample(self):
+        # Any exception raised here stops the background task
+        try:
+            conn = self.conn.get()
+            if conn is None:
+                return
+
+            running = set()
+            for dom, record in self._get_records(conn):
+                try:
+                    vm_uuid = dom.UUIDString()
+                    self._add_sample(vm_uuid, record)
+                    running.add(vm_uuid)
+                except Exception as e:
+                    # VM might be stopped or deleted just after we get the
+                    # list. This is OK, just skip.
+                    wok_log.debug(f'Error processing VM stats: {e}')
+
+            # forget the VMs which are not running anymore
+            with self._lock:
+                for vm_uuid in set(self._buffers) - running:
+                    del self._buffers[vm_uuid]
+                for vm_uuid in set(self._counters) - running:
+                    del self._counters[vm_uuid]
+        except Exception as e:
+            wok_log.error(f'Unable to sample VM statistics: {e}')
+
+    def _get_records(self, conn):
+        flags = libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_RUNNING
+        try:
+            return conn.getAllDomainStats(SAMPLER_STATS, flags)
+        except libvirt.libvirtError as e:
+            # not all libvirt drivers implement the bulk stats API
+            wok_log.debug(f'Unable to get bulk domain statistics: {e}')
+
+        records = []
+        for dom in conn.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_RUNNING):
+            try:
+                records.append((dom, self._get_record(dom)))
+            except libvirt.libvirtError as e:
+                wok_log.debug(f'Error processing VM stats: {e}')
+        return records
+
+    @staticmethod
+    def _get_record(dom):
+        """
+        Build the same record returned by virConnect.getAllDomainStats() for
+        a single domain using the per domain APIs.
+        """
+        info = dom.info()
+        record = {
+            'state.state': info[0],
+            'vcpu.current': info[3],
+            'cpu.time': info[4],
+        }
+
+        mem_stats = dom.memoryStats()
+        for key, stat in MEM_STATS.items():
+            if key in mem_stats:
+                record[stat] = mem_stats[key]
+
+        view = DomainView(dom, 0)
+        targets = view.get_targets('interface')
+        record['net.count'] = len(targets)
+        for i, target in enumerate(targets):
+            io = dom.interfaceStats(target)
+            record[f'net.{i}.rx.bytes'] = io[0]
+            record[f'net.{i}.tx.bytes'] = io[4]
+
+        targets = view.get_targets('disk')
+        record['block.count'] = len(targets)
+        for i, target in enumerate(targets):
+            io = dom.blockStats(target)
+            record[f'block.{i}.rd.bytes'] = io[1]
+            record[f'block.{i}.wr.bytes'] = io[3]
+
+        return record
+
+    @staticmethod
+    def _get_io(record, group, rd, wr):
+        rd_bytes = 0
+        wr_bytes = 0
+
+        for i in range(record.get(f'{group}.count', 0)):
+            rd_bytes += record.get(f'{group}.{i}.{rd}.bytes', 0)
+            wr_bytes += record.get(f'{group}.{i}.{wr}.bytes', 0)
+
+        return rd_bytes, wr_bytes
+
+    @staticmethod
+    def _get_mem_usage(record):
+        if 'balloon.available' in record and 'balloon.unused' in record:
+            available = record['balloon.available']
+            used = available - record['balloon.unused']
+        elif 'balloon.rss' in record and 'balloon.current' in record:
+            available = record['balloon.current']
+            used = record['balloon.rss']
+        else:
+            return 0.0
+
+        if available <= 0:
+            return 0.0
+        return max(0.0, min(100.0, used * 100.0 / available))
+
+    def _add_sample(self, vm_uuid, record):
+        now = time.monotonic()
+        cputime = record.get('cpu.time', 0)
+        rx_bytes, tx_bytes = self._get_io(record, 'net', 'rx', 'tx')
+        rd_bytes, wr_bytes = self._get_io(record, 'block', 'rd', 'wr')
+
+        with self._lock:
+            prev = self._counters.get(vm_uuid)
+            self._counters[vm_uuid] = (
+                now, cputime, rx_bytes, tx_bytes, rd_bytes, wr_bytes)
+
+        # rates can only be computed from the second sample on
+        if prev is None or now <= prev[0]:
+            return
+
+        seconds = now - prev[0]
+        vcpus = max(1, record.get('vcpu.current', 1))
+
+        cpu = (cputime - prev[1]) * 100.0 / (seconds * 1000.0 * 1000.0 * 1000.0)
+        cpu = max(0.0, min(100.0, cpu / vcpus))
+
+        # network throughput in KB/s and disk throughput in KiB/s
+        net_io = max(0.0, ((rx_bytes - prev[2]) + (tx_bytes - prev[3]))
+                     / 1000.0 / seconds)
+        disk_io = max(0.0, ((rd_bytes - prev[4]) + (wr_bytes - prev[5]))
+                      / 1024.0 / seconds)
+
+        sample = (time.time(), cpu, self._get_mem_usage(record), net_io, disk_io)
+        with self._lock:
+            buf = self._buffers.get(vm_uuid)
+            if buf is None:
+                buf = self._buffers[vm_uuid] = StatsRingBuffer(self.history)
+            buf.append(sample)
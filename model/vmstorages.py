@@ -26,6 +26,7 @@ from wok.exception import NotFoundError
 from wok.exception import OperationFailed
 from wok.plugins.kimchi.model.config import CapabilitiesModel
 from wok.plugins.kimchi.model.diskutils import get_disk_used_by
+from wok.plugins.kimchi.model.domaininventory import get_domain_inventory
 from wok.plugins.kimchi.model.storagevolumes import StorageVolumeModel
 from wok.plugins.kimchi.model.utils import get_vm_config_flag
 from wok.plugins.kimchi.model.vms import DOM_STATE_MAP
@@ -147,6 +148,7 @@ class VMStoragesModel(object):
             dom.attachDeviceFlags(xml, get_vm_config_flag(dom, 'all'))
         except Exception as e:
             raise OperationFailed('KCHVMSTOR0008E', {'error': str(e)})
+        get_domain_inventory(self.conn).invalidate(dom)
 
         # Don't put a try-block here. Let the exception be raised. If we
         #   allow disks used_by to be out of sync, data corruption could
@@ -240,6 +242,7 @@ class VMStorageModel(object):
             )
         except Exception as e:
             raise OperationFailed('KCHVMSTOR0010E', {'error': str(e)})
+        get_domain_inventory(self.conn).invalidate(dom)
 
         if used_by is not None and vm_name in used_by:
             used_by.remove(vm_name)
@@ -279,6 +282,7 @@ class VMStorageModel(object):
             dom.updateDeviceFlags(xml, get_vm_config_flag(dom, 'all'))
         except Exception as e:
             raise OperationFailed('KCHVMSTOR0009E', {'error': str(e)})
+        get_domain_inventory(self.conn).invalidate(dom)
 
         try:
             if old_disk_used_by is not None and vm_name in old_disk_used_by:
@@ -17,14 +17,18 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 #
+import bisect
 import glob
 import ipaddress
+import json
 import os
 from distutils.spawn import find_executable
 
 import ethtool
+from wok.plugins.kimchi.utils import TTLCache
 from wok.stringutils import encode_value
 from wok.utils import run_command
+from wok.utils import wok_log
 
 
 APrivateNets = ipaddress.IPv4Network('10.0.0.0/8', False)
@@ -47,6 +51,191 @@ BONDING_SLAVES = '/sys/class/net/%s/bonding/slaves'
 BRIDGE_PORTS = '/sys/class/net/%s/brif'
 
 
+# seconds during which the network interfaces read are reused
+NETINFO_TTL = 5
+
+# seconds ovs-vsctl waits for the OVS database
+OVS_TIMEOUT = 5
+
+
+def _read_sysfs(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _ovs_uuids(value):
+    # OVS JSON format: ["uuid", <uuid>] or ["set", [["uuid", <uuid>], ...]]
+    if value[0] == 'uuid':
+        return [value[1]]
+    if value[0] == 'set':
+        return [uuid for _, uuid in value[1]]
+    return []
+
+
+class NetInfoSnapshot(object):
+    """
+    Network interfaces of the host read in a single pass: the interfaces
+    listed in sysfs with their type, bond slaves, bridge ports, VLAN device
+    and state, the OVS bridges and ports from a single ovs-vsctl call and
+    the MAC and IPv4 address of each device.
+
+    The module level functions are served from a snapshot shared for
+    NETINFO_TTL seconds, so listing the interfaces does not read sysfs or
+    run ovs-vsctl again for every interface.
+    """
+
+    def __init__(self):
+        self.interfaces = []
+        self.nics = []
+        self.wlans = []
+        self.bondings = []
+        self.bridges = []
+        self.vlans = []
+        self.ovs_bridges = []
+        # key: bond name; value: slaves
+        self.slaves = {}
+        # key: bridge name; value: ports, including the OVS ones
+        self.ports = {}
+        # interfaces being a port of a bridge or enslaved to a master device
+        self.brports = set()
+        self.bondslaves = set()
+        # key: VLAN name; value: VLAN device
+        self.vlan_devices = {}
+        # key: interface name; value: interface flags
+        self.flags = {}
+        # key: device name; value: (MAC address, IPv4 network or '')
+        self.addresses = {}
+
+        self._read_interfaces()
+        self._read_vlans()
+        self._read_ovs()
+        self._read_addresses()
+
+    def _read_interfaces(self):
+        for path in glob.glob(NET_PATH + '/*'):
+            iface = path.rsplit('/', 1)[-1]
+            self.interfaces.append(iface)
+
+            if os.path.exists(os.path.join(path, 'wireless')):
+                self.wlans.append(iface)
+            elif os.path.exists(os.path.join(path, 'device')):
+                self.nics.append(iface)
+
+            if os.path.isdir(os.path.join(path, 'bonding')):
+                self.bondings.append(iface)
+                slaves = _read_sysfs(BONDING_SLAVES % iface)
+                self.slaves[iface] = slaves.split() if slaves else []
+
+            if os.path.isdir(os.path.join(path, 'bridge')):
+                self.bridges.append(iface)
+                try:
+                    self.ports[iface] = os.listdir(BRIDGE_PORTS % iface)
+                except OSError:
+                    self.ports[iface] = []
+
+            if os.path.exists(NET_BRPORT % iface):
+                self.brports.add(iface)
+            if os.path.exists(NET_MASTER % iface):
+                self.bondslaves.add(iface)
+
+            flags = _read_sysfs(os.path.join(path, 'flags'))
+            if flags is not None:
+                self.flags[iface] = int(flags, 16)
+
+    def _read_vlans(self):
+        for path in glob.glob(PROC_NET_VLAN + '*'):
+            vlan = path.rsplit('/', 1)[-1]
+            if vlan not in self.interfaces:
+                continue
+
+            self.vlans.append(vlan)
+            with open(path) as vlan_file:
+                for line in vlan_file:
+                    if 'Device:' in line:
+                        dummy, self.vlan_devices[vlan] = line.split()
+                        break
+
+    def _read_ovs(self):
+        if not is_openvswitch_running():
+            return
+
+        ovs_cmd = find_executable('ovs-vsctl')
+
+        # openvswitch not installed: there is no OVS bridge configured
+        if ovs_cmd is None:
+            return
+
+        out, _, r_code = run_command(
+            [ovs_cmd, '--timeout=%d' % OVS_TIMEOUT, '--format=json',
+             '--columns=name,ports', 'list', 'Bridge', '--',
+             '--columns=_uuid,name', 'list', 'Port'],
+            silent=True,
+        )
+        if r_code != 0:
+            return
+
+        # one JSON document per command
+        decoder = json.JSONDecoder()
+        tables = []
+        out = out.strip()
+        try:
+            while out:
+                table, end = decoder.raw_decode(out)
+                tables.append(table['data'])
+                out = out[end:].strip()
+            bridges, ports = tables
+        except (ValueError, KeyError) as e:
+            wok_log.error(f'Unable to parse the OVS bridges: {e}')
+            return
+
+        port_names = dict((_ovs_uuids(uuid)[0], name) for uuid, name in ports)
+        for name, br_ports in bridges:
+            self.ovs_bridges.append(name)
+            # the internal port of the bridge is not listed by list-ports
+            self.ports[name] = sorted(
+                port_names[uuid] for uuid in _ovs_uuids(br_ports)
+                if uuid in port_names and port_names[uuid] != name
+            )
+            self.brports.update(self.ports[name])
+
+    def _read_addresses(self):
+        try:
+            infos = ethtool.get_interfaces_info(ethtool.get_devices())
+        except IOError:
+            # a device was removed meanwhile, read them one by one
+            infos = []
+            for dev in ethtool.get_devices():
+                try:
+                    infos.extend(ethtool.get_interfaces_info(dev))
+                except IOError:
+                    continue
+
+        for info in infos:
+            netaddr = (info.ipv4_address and
+                       '%s/%s' % (info.ipv4_address, info.ipv4_netmask) or '')
+            self.addresses[info.device] = (info.mac_address, netaddr)
+
+
+_netinfo = TTLCache(NetInfoSnapshot, NETINFO_TTL)
+
+
+def get_netinfo():
+    """Return the NetInfoSnapshot of the host, read again when outdated"""
+    return _netinfo.get()
+
+
+def invalidate_netinfo():
+    """Read the network interfaces again on next access, as they changed"""
+    _netinfo.invalidate()
+
+
+def _contains(names, iface):
+    return encode_value(iface) in map(encode_value, names)
+
+
 def wlans():
     """Get all wlans declared in /sys/class/net/*/wireless.
 
@@ -54,7 +243,7 @@ def wlans():
         List[str]: a list with the wlans found.
 
     """
-    return [b.split('/')[-2] for b in glob.glob(WLAN_PATH)]
+    return list(get_netinfo().wlans)
 
 
 def nics():
@@ -67,8 +256,7 @@ def nics():
         List[str]: a list with the nics found.
 
     """
-    return list(set([b.split('/')[-2] for b in glob.glob(NIC_PATH)]) -
-                set(wlans()))
+    return list(get_netinfo().nics)
 
 
 def is_nic(iface):
@@ -81,7 +269,7 @@ def is_nic(iface):
         bool: True if iface is a nic, False otherwise.
 
     """
-    return encode_value(iface) in map(encode_value, nics())
+    return _contains(get_netinfo().nics, iface)
 
 
 def bondings():
@@ -91,7 +279,7 @@ def bondings():
         List[str]: a list with the bonds found.
 
     """
-    return [b.split('/')[-2] for b in glob.glob(BONDING_PATH)]
+    return list(get_netinfo().bondings)
 
 
 def is_bonding(iface):
@@ -104,7 +292,7 @@ def is_bonding(iface):
         bool: True if iface is a bond, False otherwise.
 
     """
-    return encode_value(iface) in map(encode_value, bondings())
+    return _contains(get_netinfo().bondings, iface)
 
 
 def vlans():
@@ -114,10 +302,7 @@ def vlans():
         List[str]: a list with the vlans found.
 
     """
-    return list(
-        set([b.split('/')[-1] for b in glob.glob(NET_PATH + '/*')]) &
-        set([b.split('/')[-1] for b in glob.glob(PROC_NET_VLAN + '*')])
-    )
+    return list(get_netinfo().vlans)
 
 
 def is_vlan(iface):
@@ -130,7 +315,11 @@ def is_vlan(iface):
         bool: True if iface is a vlan, False otherwise.
 
     """
-    return encode_value(iface) in map(encode_value, vlans())
+    return _contains(get_netinfo().vlans, iface)
+
+
+def _bridges(info):
+    return list(set(info.bridges + info.ovs_bridges))
 
 
 def bridges():
@@ -140,8 +329,7 @@ def bridges():
         List[str]: a list with the bridges found.
 
     """
-    return list(set([b.split('/')[-2] for b in glob.glob(BRIDGE_PATH)] +
-                    ovs_bridges()))
+    return _bridges(get_netinfo())
 
 
 def is_bridge(iface):
@@ -154,7 +342,7 @@ def is_bridge(iface):
         bool: True if iface is a bridge, False otherwise.
 
     """
-    return encode_value(iface) in map(encode_value, bridges())
+    return _contains(bridges(), iface)
 
 
 def is_openvswitch_running():
@@ -181,20 +369,7 @@ def ovs_bridges():
         List[str]: a list with the OVS bridges found.
 
     """
-    if not is_openvswitch_running():
-        return []
-
-    ovs_cmd = find_executable('ovs-vsctl')
-
-    # openvswitch not installed: there is no OVS bridge configured
-    if ovs_cmd is None:
-        return []
-
-    out, _, r_code = run_command([ovs_cmd, 'list-br'], silent=True)
-    if r_code != 0:
-        return []
-
-    return [x.strip() for x in out.rstrip('\n').split('\n') if x.strip()]
+    return list(get_netinfo().ovs_bridges)
 
 
 def is_ovs_bridge(iface):
@@ -212,7 +387,7 @@ def is_ovs_bridge(iface):
         bool: True if iface is an OVS bridge, False otherwise.
 
     """
-    return iface in ovs_bridges()
+    return iface in get_netinfo().ovs_bridges
 
 
 def ovs_bridge_ports(ovsbr):
@@ -230,20 +405,11 @@ def ovs_bridge_ports(ovsbr):
         List[str]: a list with the ports of this bridge.
 
     """
-    if not is_openvswitch_running():
+    info = get_netinfo()
+    if ovsbr not in info.ovs_bridges:
         return []
 
-    ovs_cmd = find_executable('ovs-vsctl')
-
-    # openvswitch not installed: there is no OVS bridge configured
-    if ovs_cmd is None:
-        return []
-
-    out, _, r_code = run_command([ovs_cmd, 'list-ports', ovsbr], silent=True)
-    if r_code != 0:
-        return []
-
-    return [x.strip() for x in out.rstrip('\n').split('\n') if x.strip()]
+    return list(info.ports[ovsbr])
 
 
 def all_interfaces():
@@ -253,7 +419,7 @@ def all_interfaces():
         List[str]: a list with all interfaces of the host.
 
     """
-    return [d.rsplit('/', 1)[-1] for d in glob.glob(NET_PATH + '/*')]
+    return list(get_netinfo().interfaces)
 
 
 def slaves(bonding):
@@ -266,6 +432,10 @@ def slaves(bonding):
         List[str]: a list with all slaves.
 
     """
+    info = get_netinfo()
+    if bonding in info.slaves:
+        return list(info.slaves[bonding])
+
     with open(BONDING_SLAVES % bonding) as bonding_file:
         res = bonding_file.readline().split()
     return res
@@ -281,8 +451,9 @@ def ports(bridge):
         List[str]: a list with all ports.
 
     """
-    if bridge in ovs_bridges():
-        return ovs_bridge_ports(bridge)
+    info = get_netinfo()
+    if bridge in info.ports:
+        return list(info.ports[bridge])
 
     return os.listdir(BRIDGE_PORTS % bridge)
 
@@ -297,12 +468,7 @@ def is_brport(nic):
         bool: True if iface is a port of a bridge, False otherwise.
 
     """
-    ovs_brports = []
-
-    for ovsbr in ovs_bridges():
-        ovs_brports += ovs_bridge_ports(ovsbr)
-
-    return os.path.exists(NET_BRPORT % nic) or nic in ovs_brports
+    return nic in get_netinfo().brports
 
 
 def is_bondlave(nic):
@@ -315,7 +481,7 @@ def is_bondlave(nic):
         bool: True if iface is a bond slave, False otherwise.
 
     """
-    return os.path.exists(NET_MASTER % nic)
+    return nic in get_netinfo().bondslaves
 
 
 def operstate(dev):
@@ -328,7 +494,9 @@ def operstate(dev):
         str: "up" or "down"
 
     """
-    flags = ethtool.get_flags(encode_value(dev))
+    flags = get_netinfo().flags.get(dev)
+    if flags is None:
+        flags = ethtool.get_flags(encode_value(dev))
     return 'up' if flags & (ethtool.IFF_RUNNING | ethtool.IFF_UP) else 'down'
 
 
@@ -342,15 +510,26 @@ def get_vlan_device(vlan):
         str: the device of the VLAN.
 
     """
-    dev = None
+    return get_netinfo().vlan_devices.get(vlan)
 
-    if os.path.exists(PROC_NET_VLAN + vlan):
-        with open(PROC_NET_VLAN + vlan) as vlan_file:
-            for line in vlan_file:
-                if 'Device:' in line:
-                    dummy, dev = line.split()
-                    break
-    return dev
+
+def _get_bridge_port_device(info, bridge):
+    #   br  --- v  --- bond --- nic1
+    if not _contains(_bridges(info), bridge):
+        raise ValueError('unknown bridge %s' % bridge)
+    nics_list = []
+    for port in info.ports.get(bridge, []):
+        if _contains(info.vlans, port):
+            device = info.vlan_devices.get(port)
+            if _contains(info.bondings, device):
+                nics_list.extend(info.slaves[device])
+            else:
+                nics_list.append(device)
+        if _contains(info.bondings, port):
+            nics_list.extend(info.slaves[port])
+        else:
+            nics_list.append(port)
+    return nics_list
 
 
 def get_bridge_port_device(bridge):
@@ -363,22 +542,12 @@ def get_bridge_port_device(bridge):
         List[str]: the nic list.
 
     """
-    #   br  --- v  --- bond --- nic1
-    if encode_value(bridge) not in map(encode_value, bridges()):
-        raise ValueError('unknown bridge %s' % bridge)
-    nics_list = []
-    for port in ports(bridge):
-        if encode_value(port) in map(encode_value, vlans()):
-            device = get_vlan_device(port)
-            if encode_value(device) in map(encode_value, bondings()):
-                nics_list.extend(slaves(device))
-            else:
-                nics_list.append(device)
-        if encode_value(port) in map(encode_value, bondings()):
-            nics_list.extend(slaves(port))
-        else:
-            nics_list.append(port)
-    return nics_list
+    return _get_bridge_port_device(get_netinfo(), bridge)
+
+
+def _aggregated_bridges(info):
+    return [bridge for bridge in _bridges(info) if
+            (set(_get_bridge_port_device(info, bridge)) & set(info.nics))]
 
 
 def aggregated_bridges():
@@ -388,8 +557,12 @@ def aggregated_bridges():
         List[str]: the aggregated bridges list.
 
     """
-    return [bridge for bridge in bridges() if
-            (set(get_bridge_port_device(bridge)) & set(nics()))]
+    return _aggregated_bridges(get_netinfo())
+
+
+def _bare_nics(info):
+    return [nic for nic in info.nics
+            if not (nic in info.brports or nic in info.bondslaves)]
 
 
 def bare_nics():
@@ -402,7 +575,7 @@ def bare_nics():
         List[str]: the list of bare nics of the host.
 
     """
-    return [nic for nic in nics() if not (is_brport(nic) or is_bondlave(nic))]
+    return _bare_nics(get_netinfo())
 
 
 def is_bare_nic(iface):
@@ -415,7 +588,7 @@ def is_bare_nic(iface):
         bool: True if iface is a bare nic, False otherwise.
 
     """
-    return encode_value(iface) in map(encode_value, bare_nics())
+    return _contains(bare_nics(), iface)
 
 
 #  The nic will not be exposed when it is a port of a bridge or
@@ -432,7 +605,8 @@ def all_favored_interfaces():
         List[str]: the list of favored interfaces.
 
    """
-    return aggregated_bridges() + bare_nics() + bondings()
+    info = get_netinfo()
+    return _aggregated_bridges(info) + _bare_nics(info) + list(info.bondings)
 
 
 def get_interface_type(iface):
@@ -448,54 +622,110 @@ def get_interface_type(iface):
         str: the interface type.
 
     """
-    try:
-        if is_nic(iface):
-            return 'nic'
-        if is_bonding(iface):
-            return 'bonding'
-        if is_bridge(iface):
-            return 'bridge'
-        if is_vlan(iface):
-            return 'vlan'
-        return 'unknown'
-    except IOError:
-        return 'unknown'
+    info = get_netinfo()
+    if _contains(info.nics, iface):
+        return 'nic'
+    if _contains(info.bondings, iface):
+        return 'bonding'
+    if _contains(_bridges(info), iface):
+        return 'bridge'
+    if _contains(info.vlans, iface):
+        return 'vlan'
+    return 'unknown'
 
 
 def get_dev_macaddr(dev):
-    info = ethtool.get_interfaces_info(dev)[0]
-    return info.mac_address
+    address = get_netinfo().addresses.get(dev)
+    if address is None:
+        return ethtool.get_interfaces_info(dev)[0].mac_address
+    return address[0]
 
 
 def get_dev_netaddr(dev):
-    info = ethtool.get_interfaces_info(dev)[0]
-    return (info.ipv4_address and
-            '%s/%s' % (info.ipv4_address, info.ipv4_netmask) or '')
+    address = get_netinfo().addresses.get(dev)
+    if address is None:
+        info = ethtool.get_interfaces_info(dev)[0]
+        return (info.ipv4_address and
+                '%s/%s' % (info.ipv4_address, info.ipv4_netmask) or '')
+    return address[1]
 
 
 def get_dev_netaddrs():
     nets = []
-    for dev in ethtool.get_devices():
-        devnet = get_dev_netaddr(dev)
+    for mac, devnet in get_netinfo().addresses.values():
         devnet and nets.append(ipaddress.IPv4Network(devnet, False))
     return nets
 
 
+class SubnetAllocator(object):
+    """
+    Free IPv4 subnets lookup over the address ranges in use, kept as sorted
+    and merged [start, end) integer intervals. Finding a free subnet jumps
+    from a used range to the next one with a binary search, instead of
+    checking every candidate subnet against every used network.
+    """
+
+    def __init__(self, used_nets=()):
+        ranges = sorted(
+            (int(net.network_address), int(net.broadcast_address) + 1)
+            for net in used_nets
+        )
+        self._starts = []
+        self._ends = []
+        for start, end in ranges:
+            if self._ends and start <= self._ends[-1]:
+                self._ends[-1] = max(self._ends[-1], end)
+            else:
+                self._starts.append(start)
+                self._ends.append(end)
+
+    def add(self, net):
+        """Mark the IPv4Network <net> as used"""
+        start = int(net.network_address)
+        end = int(net.broadcast_address) + 1
+        # merge with the ranges overlapping or adjacent to <net>
+        first = bisect.bisect_left(self._ends, start)
+        last = bisect.bisect_right(self._starts, end)
+        if first < last:
+            start = min(start, self._starts[first])
+            end = max(end, self._ends[last - 1])
+        self._starts[first:last] = [start]
+        self._ends[first:last] = [end]
+
+    def _next_used(self, addr):
+        # index of the first used range ending after <addr>
+        return bisect.bisect_right(self._ends, addr)
+
+    def find_free(self, pool, prefix=24):
+        """
+        Return the first subnet of length <prefix> of the IPv4Network <pool>
+        not overlapping any used range, or None when the pool is full.
+        """
+        if prefix < pool.prefixlen:
+            return None
+
+        size = 2 ** (32 - prefix)
+        end = int(pool.broadcast_address) + 1
+        candidate = int(pool.network_address)
+        while candidate + size <= end:
+            i = self._next_used(candidate)
+            if i == len(self._starts) or self._starts[i] >= candidate + size:
+                return ipaddress.IPv4Network((candidate, prefix))
+
+            # skip the used range, aligned on the subnet size
+            candidate = -(-self._ends[i] // size) * size
+        return None
+
+
 # used_nets should include all the subnet allocated in libvirt network
 # will get host network by get_dev_netaddrs
-def get_one_free_network(used_nets, nets_pool=None):
+def get_one_free_network(used_nets, nets_pool=None, prefix=24):
     if nets_pool is None:
         nets_pool = PrivateNets
 
-    def _get_free_network(nets, used_nets):
-        for net in nets.subnets(new_prefix=24):
-            if not any(net.overlaps(used) for used in used_nets):
-                return str(net)
-        return None
-
-    used_nets = used_nets + get_dev_netaddrs()
+    allocator = SubnetAllocator(list(used_nets) + get_dev_netaddrs())
     for nets in nets_pool:
-        net = _get_free_network(nets, used_nets)
+        net = allocator.find_free(nets, prefix)
         if net:
-            return net
+            return str(net)
     return None
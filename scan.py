@@ -24,7 +24,7 @@ import shutil
 import tempfile
 import time
 
-from wok.plugins.kimchi.isoinfo import IsoImage
+from wok.plugins.kimchi.config import get_kimchi_version
 from wok.plugins.kimchi.isoinfo import probe_iso
 from wok.utils import wok_log
 
@@ -35,8 +35,11 @@ SCAN_IGNORE = ['/tmp/kimchi-scan-*']
 class Scanner(object):
     SCAN_TTL = 300
 
-    def __init__(self, record_clean_cb):
+    def __init__(self, record_clean_cb, objstore=None):
         self.clean_cb = record_clean_cb
+        # the results of previous scans are kept in the object store, so
+        # unchanged ISO files are not read again
+        self.objstore = objstore
 
     def delete(self):
         self.clean_stale(-1)
@@ -64,15 +67,49 @@ class Scanner(object):
         self.clean_stale()
         return tempfile.mkdtemp(prefix='kimchi-scan-' + name, dir='/tmp')
 
+    def _load_cache(self):
+        cache = {}
+        if self.objstore is None:
+            return cache
+
+        try:
+            with self.objstore as session:
+                for path in session.get_list('isoscan'):
+                    cache[path] = session.get('isoscan', path)
+        except Exception as e:
+            wok_log.error(f'Unable to load the ISO scan cache: {e}')
+        return cache
+
+    def _store_cache(self, old_cache, cache, scan_path):
+        if self.objstore is None:
+            return
+
+        scan_path = os.path.join(os.path.abspath(scan_path), '')
+        try:
+            with self.objstore as session:
+                for path, entry in cache.items():
+                    if old_cache.get(path) != entry:
+                        session.store(
+                            'isoscan', path, entry, get_kimchi_version())
+
+                # forget the files removed from the scanned directory
+                for path in old_cache:
+                    if path.startswith(scan_path) and not os.path.exists(path):
+                        session.delete('isoscan', path, ignore_missing=True)
+        except Exception as e:
+            wok_log.error(f'Unable to store the ISO scan cache: {e}')
+
     def start_scan(self, cb, params):
+        # key: ISO name; value: (distro, version) of the images linked
+        linked = {}
+
         def updater(iso_info):
             iso_name = os.path.basename(iso_info['path'])[:-3]
 
-            duplicates = '%s/%s*' % (params['pool_path'], iso_name)
-            for f in glob.glob(duplicates):
-                iso_img = IsoImage(f)
-                if (iso_info['distro'], iso_info['version']) == iso_img.probe():
-                    return
+            iso_id = (iso_info['distro'], iso_info['version'])
+            if iso_id in linked.setdefault(iso_name, set()):
+                return
+            linked[iso_name].add(iso_id)
 
             iso_path = (
                 iso_name +
@@ -83,11 +120,17 @@ class Scanner(object):
                 params['pool_path'], os.path.basename(iso_path))
             os.symlink(iso_info['path'], link_name)
 
+        old_cache = self._load_cache()
+        cache = dict(old_cache)
+
         ignore_paths = params.get('ignore_list', [])
         scan_params = dict(
             path=params['scan_path'],
             updater=updater,
             ignore_list=ignore_paths + SCAN_IGNORE,
+            cache=cache,
         )
-        probe_iso(None, scan_params)
-        cb('', True)
+        try:
+            probe_iso(cb, scan_params)
+        finally:
+            self._store_cache(old_cache, cache, params['scan_path'])
@@ -18,11 +18,15 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 #
 import glob
+import hashlib
 import os
 import signal
 import tempfile
+import threading
 import time
 import uuid
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 try:
     from PIL import Image
@@ -38,6 +42,90 @@ from wok.plugins.kimchi import config
 (fd, pipe) = tempfile.mkstemp()
 stream_test_result = None
 
+# number of VMs whose last thumbnail is kept in memory
+THUMBNAIL_CACHE_SIZE = 64
+# number of thumbnails generated at once in background
+SCREENSHOT_WORKERS = 2
+
+
+class ThumbnailCache(object):
+    """
+    Generate the thumbnails of the VMs in background and keep the last one
+    of the recently viewed VMs in memory, so the requests return at once
+    with the latest image instead of waiting for libvirt and PIL.
+
+    A frame identical to the one of the last thumbnail is not encoded again.
+    """
+
+    def __init__(self, size=THUMBNAIL_CACHE_SIZE, workers=SCREENSHOT_WORKERS):
+        self.size = size
+        self.workers = workers
+        # key: VM UUID; value: dict with the path, the PNG data, its ETag,
+        # the hash of the frame and the time of the last check
+        self._entries = OrderedDict()
+        # UUIDs of the VMs being refreshed
+        self._pending = set()
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def get(self, vm_uuid):
+        with self._lock:
+            entry = self._entries.get(vm_uuid)
+            if entry is None:
+                return None
+            self._entries.move_to_end(vm_uuid)
+            return dict(entry)
+
+    def store(self, vm_uuid, path, data, frame):
+        with self._lock:
+            self._entries[vm_uuid] = {
+                'path': path,
+                'data': data,
+                'etag': hashlib.sha1(data).hexdigest(),
+                'frame': frame,
+                'checked': time.time(),
+            }
+            self._entries.move_to_end(vm_uuid)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def touch(self, vm_uuid):
+        """Record that the frame of the VM <vm_uuid> did not change"""
+        with self._lock:
+            if vm_uuid in self._entries:
+                self._entries[vm_uuid]['checked'] = time.time()
+
+    def forget(self, vm_uuid):
+        with self._lock:
+            self._entries.pop(vm_uuid, None)
+
+    def refresh(self, screenshot):
+        """
+        Generate a new thumbnail for the VMScreenshot <screenshot> in
+        background, unless one is already being generated for the same VM.
+        """
+        with self._lock:
+            if screenshot.vm_uuid in self._pending:
+                return
+            self._pending.add(screenshot.vm_uuid)
+            if self._pool is None:
+                self._pool = ThreadPool(processes=self.workers)
+            pool = self._pool
+        pool.apply_async(self._refresh, (screenshot,))
+
+    def _refresh(self, screenshot):
+        try:
+            screenshot._generate_thumbnail()
+        except Exception as e:
+            wok_log.error(f'Unable to refresh the screenshot of VM '
+                          f'{screenshot.vm_uuid}: {e}')
+        finally:
+            with self._lock:
+                self._pending.discard(screenshot.vm_uuid)
+
+
+thumbnail_cache = ThumbnailCache()
+
 
 class VMScreenshot(object):
     OUTDATED_SECS = 5
@@ -58,21 +146,47 @@ class VMScreenshot(object):
         return stream_test_result
 
     def lookup(self):
-        now = time.time()
-        try:
-            last_update = os.path.getmtime(self.info['thumbnail'])
-        except OSError:
-            last_update = 0
+        """
+        Return the URI of the latest thumbnail of the VM. Only the first
+        thumbnail is generated at once: a new one is generated in background
+        when it is more than OUTDATED_SECS seconds old.
+        """
+        cached = thumbnail_cache.get(self.vm_uuid)
+        if cached is not None:
+            self.info['thumbnail'] = cached['path']
+            last_update = cached['checked']
+        else:
+            try:
+                last_update = os.path.getmtime(self.info['thumbnail'])
+            except OSError:
+                last_update = 0
 
-        if now - last_update > self.OUTDATED_SECS:
-            self._clean_extra(self.LIVE_WINDOW)
+        if not last_update:
             self._generate_thumbnail()
+        elif time.time() - last_update > self.OUTDATED_SECS:
+            thumbnail_cache.refresh(self)
         return 'plugins/kimchi/data/screenshots/%s' %\
                os.path.basename(self.info['thumbnail'])
 
-    def _clean_extra(self, window=-1):
+    def get_image(self):
+        """
+        Return a dict with the PNG data of the latest thumbnail, its ETag and
+        its modification time, or None when it is not in memory.
         """
-        Clear screenshots before time specified by window,
+        cached = thumbnail_cache.get(self.vm_uuid)
+        if cached is None:
+            return None
+
+        try:
+            mtime = os.path.getmtime(cached['path'])
+        except OSError:
+            return None
+        return {'data': cached['data'], 'etag': cached['etag'],
+                'mtime': mtime}
+
+    def _clean_extra(self, window=-1, keep=None):
+        """
+        Clear screenshots before time specified by window, except <keep>.
         Clear all screenshots if window is -1.
         """
         try:
@@ -81,12 +195,13 @@ class VMScreenshot(object):
                                    (config.get_screenshot_path(),
                                     self.vm_uuid))
             for f in clear_list:
-                if now - os.path.getmtime(f) > window:
+                if f != keep and now - os.path.getmtime(f) > window:
                     os.unlink(f)
         except OSError:
             pass
 
     def delete(self):
+        thumbnail_cache.forget(self.vm_uuid)
         return self._clean_extra()
 
     def _generate_scratch(self, thumbnail):
@@ -153,6 +268,7 @@ class VMScreenshot(object):
             os.remove(pipe)
 
     def _generate_thumbnail(self):
+        self._clean_extra(self.LIVE_WINDOW, self.info['thumbnail'])
         thumbnail = os.path.join(config.get_screenshot_path(), '%s-%s.png' %
                                  (self.vm_uuid, str(uuid.uuid4())))
 
@@ -168,9 +284,22 @@ class VMScreenshot(object):
         else:
             self._create_black_image(thumbnail)
 
+        frame = None
         if os.path.getsize(thumbnail) == 0:
             self._create_black_image(thumbnail)
         else:
+            with open(thumbnail, 'rb') as f:
+                frame = hashlib.sha1(f.read()).hexdigest()
+
+            # the screen did not change: keep the last thumbnail
+            cached = thumbnail_cache.get(self.vm_uuid)
+            if (cached is not None and cached['frame'] == frame and
+                    os.path.exists(cached['path'])):
+                os.unlink(thumbnail)
+                thumbnail_cache.touch(self.vm_uuid)
+                self.info['thumbnail'] = cached['path']
+                return
+
             im = Image.open(thumbnail)
             try:
                 # Prevent Image lib from lazy load,
@@ -180,4 +309,6 @@ class VMScreenshot(object):
                 wok_log.warning('Image load with warning: %s.' % e)
             im.save(thumbnail, 'PNG')
 
+        with open(thumbnail, 'rb') as f:
+            thumbnail_cache.store(self.vm_uuid, thumbnail, f.read(), frame)
         self.info['thumbnail'] = thumbnail
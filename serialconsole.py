@@ -18,11 +18,11 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 #
 import os
+import selectors
 import socket
 import sys
 import threading
 import time
-from multiprocessing import Process
 
 import libvirt
 from wok.config import config as wok_config
@@ -31,330 +31,461 @@ from wok.utils import wok_log
 
 
 SOCKET_QUEUE_BACKLOG = 0
-CTRL_Q = '\x11'
+CTRL_Q = b'\x11'
 BASE_DIRECTORY = '/run'
 
+# bytes read or written at once from a client socket or a console stream
+BUFFER_SIZE = 64 * 1024
+# console output kept while no client is connected
+MAX_PENDING_OUTPUT = 1024 * 1024
+# seconds between two checks of the guests state and of the idle clients
+CHECK_INTERVAL = 1
+# seconds to wait for the guest to answer on its serial console
+LISTEN_TIMEOUT = 1
+# seconds to wait for the guest to be running
+RUNNING_TIMEOUT = 10
 
-class SocketServer(Process):
+# key: libvirt URI; value: ConsoleServer
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def get_console_server(conn):
+    """
+    Return the serial console server of the guests of the libvirt connection
+    <conn>, started on first use.
+    """
+    with _servers_lock:
+        server = _servers.get(conn.uri)
+        if server is None:
+            server = _servers[conn.uri] = ConsoleServer(conn)
+        return server
+
+
+class ConsoleSession(object):
+    """The console stream of a guest and the unix socket of its client"""
+
+    def __init__(self, guest_name, dom, stream, listener):
+        self.guest_name = guest_name
+        self.dom = dom
+        self.stream = stream
+        self.listener = listener
+        self.path = listener.getsockname()
+        self.client = None
+        self.last_activity = time.monotonic()
+        # data from the console not sent to the client yet and the opposite
+        self.to_client = bytearray()
+        self.to_console = bytearray()
+        # set when the console sends its first data
+        self.answered = threading.Event()
+        self.closed = False
+        # protects the buffers
+        self.lock = threading.Lock()
+        # serializes the writes to the console stream
+        self.send_lock = threading.Lock()
+
+
+class ConsoleServer(object):
     """Unix socket server for guest console access.
 
-    Implements a unix socket server for each guest, this server will receive
-    data from a particular client, forward that data to the guest console,
-    receive the response from the console and send the response back to the
-    client.
+    A single thread serves the consoles of all the guests. Each guest
+    console is available on the unix socket /run/<guest name>, which
+    websockify proxies to the client websocket. The sockets are
+    non-blocking and watched with a selector, while the console streams are
+    read from the libvirt event loop of the Kimchi server, so all the
+    consoles share the same libvirt connection.
 
     Features:
-        - one socket server per client connection;
-        - server listens to unix socket;
         - exclusive connection per guest;
-        - websockity handles the proxy between the client websocket to the
-          local unix socket;
-
-    Note:
-        - old versions (< 0.6.0)of websockify don't handle their children
-        processes accordingly, leaving a zombie process behind (this also
-        happens with novnc).
+        - the socket is removed when the client disconnects, when it is idle
+          for longer than the session timeout or when the guest stops;
     """
 
-    def __init__(self, guest_name, URI):
-        """Constructs a unix socket server.
-
-        Listens to connections on /run/<guest name>.
-        """
-        Process.__init__(self)
-
-        self._guest_name = guest_name
-        self._uri = URI
-        self._server_addr = os.path.join(BASE_DIRECTORY, guest_name)
-        if os.path.exists(self._server_addr):
-            raise RuntimeError(
-                'There is an existing connection to %s' % guest_name)
-
-        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self._socket.bind(self._server_addr)
-        self._socket.listen(SOCKET_QUEUE_BACKLOG)
-        wok_log.info('[%s] socket server to guest %s created',
-                     self.name, guest_name)
-
-    def run(self):
-        """Implements customized run method from Process.
+    def __init__(self, conn):
+        self.conn = conn
+        # key: guest name; value: ConsoleSession
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        # functions to run in the server thread, which owns the selector
+        self._calls = []
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._thread = None
+
+    def open(self, guest_name):
         """
-        self.listen()
-
-    def _is_vm_listening_serial(self, console):
-        """Checks if the guest is listening (reading/writing) to the serial
-        console.
-        """
-        is_listening = []
-
-        def _test_output(stream, event, opaque):
-            is_listening.append(1)
-
-        def _event_loop():
-            while not is_listening:
-                libvirt.virEventRunDefaultImpl()
-
-        console.eventAddCallback(
-            libvirt.VIR_STREAM_EVENT_READABLE, _test_output, None)
-        libvirt_loop = threading.Thread(target=_event_loop)
-        libvirt_loop.start()
-
-        console.send(b'\n')
-        libvirt_loop.join(1)
+        Open the console of the guest <guest_name> and listen for its client
+        on /run/<guest name>.
 
-        if not libvirt_loop.is_alive():
-            console.eventRemoveCallback()
-            return True
-
-        console.eventRemoveCallback()
-        return False
-
-    def _send_to_client(self, stream, event, opaque):
-        """Handles libvirt stream readable events.
-
-        Each event will be send back to the client socket.
+        Return False when the guest is not running or does not answer on its
+        serial console.
         """
+        with self._lock:
+            if guest_name in self._sessions:
+                raise RuntimeError(
+                    'There is an existing connection to %s' % guest_name)
+            # reserve the guest while its console is opened
+            self._sessions[guest_name] = None
+
+        session = None
         try:
-            data = stream.recv(1024)
-
-        except Exception as e:
-            wok_log.info(
-                '[%s] Error when reading from console: %s', self.name, str(e))
-            return
-
-        # return if no data received or client socket(opaque) is not valid
-        if not data or not opaque:
-            return
+            session = self._open_session(guest_name)
+        finally:
+            with self._lock:
+                if session is None:
+                    del self._sessions[guest_name]
+                else:
+                    self._sessions[guest_name] = session
 
-        opaque.send(data)
+        if session is None:
+            return False
 
-    def libvirt_event_loop(self, guest, client):
-        """Runs libvirt event loop.
-        """
-        # stop the event loop when the guest is not running
-        while guest.is_running():
-            libvirt.virEventRunDefaultImpl()
+        self._start()
+        self._call_soon(self._register, session)
+        wok_log.info('Socket server to guest %s console created', guest_name)
+        return True
 
-        # shutdown the client socket to unblock the recv and stop the
-        # server as soon as the guest shuts down
-        client.shutdown(socket.SHUT_RD)
+    def _open_session(self, guest_name):
+        dom = model.vms.VMModel.get_vm(guest_name, self.conn)
 
-    def listen(self):
-        """Prepares the environment before starts to accept connections
+        # guest must be in a running state to get its console
+        deadline = time.monotonic() + RUNNING_TIMEOUT
+        while not self._is_running(dom):
+            if time.monotonic() > deadline:
+                wok_log.error('Guest %s is not running', guest_name)
+                return None
+            time.sleep(1)
 
-        Initializes and destroy the resources needed to accept connection.
-        """
-        libvirt.virEventRegisterDefaultImpl()
+        path = os.path.join(BASE_DIRECTORY, guest_name)
+        # no other connection to this guest exists, the socket is stale
+        if os.path.exists(path):
+            os.unlink(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(SOCKET_QUEUE_BACKLOG)
+        listener.setblocking(False)
+
+        # Note: If another instance (eg: virsh) has an existing console opened
+        # to this guest, this code will steal that console.
+        stream = self.conn.get().newStream(libvirt.VIR_STREAM_NONBLOCK)
+        session = ConsoleSession(guest_name, dom, stream, listener)
         try:
-            guest = LibvirtGuest(self._guest_name, self._uri, self.name)
-
-        except Exception as e:
-            wok_log.error(
-                '[%s] Cannot open the guest %s due to %s',
-                self.name,
-                self._guest_name,
-                str(e),
+            dom.openConsole(
+                None,
+                stream,
+                libvirt.VIR_DOMAIN_CONSOLE_FORCE |
+                libvirt.VIR_DOMAIN_CONSOLE_SAFE,
+            )
+            stream.eventAddCallback(
+                libvirt.VIR_STREAM_EVENT_READABLE |
+                libvirt.VIR_STREAM_EVENT_ERROR |
+                libvirt.VIR_STREAM_EVENT_HANGUP,
+                self._stream_cb,
+                session,
             )
-            self._socket.close()
-            sys.exit(1)
 
-        except (KeyboardInterrupt, SystemExit):
-            self._socket.close()
-            sys.exit(1)
+            # the guest answers a new line if it is listening to the serial
+            stream.send(b'\n')
+        except Exception:
+            self._release(session)
+            raise
 
-        console = None
-        try:
-            console = guest.get_console()
-            if console is None:
-                wok_log.error(
-                    '[%s] Cannot get the console to %s', self.name, self._guest_name
-                )
+        if not session.answered.wait(LISTEN_TIMEOUT):
+            wok_log.error(
+                'Guest %s is not listening to its serial console', guest_name)
+            self._release(session)
+            return None
+        return session
+
+    @staticmethod
+    def _is_running(dom):
+        state = dom.state(0)[0]
+        return state in (libvirt.VIR_DOMAIN_RUNNING, libvirt.VIR_DOMAIN_PAUSED)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
                 return
-
-            if not self._is_vm_listening_serial(console):
-                sys.exit(1)
-
-            self._listen(guest, console)
-
-        # clear resources aquired when the process is killed
-        except (KeyboardInterrupt, SystemExit):
+            self._thread = threading.Thread(
+                target=self._run, name='KimchiSerialConsole')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _call_soon(self, func, *args):
+        with self._lock:
+            self._calls.append((func, args))
+        try:
+            self._wakeup_w.send(b'\0')
+        except BlockingIOError:
+            # the server thread has not read the previous wake ups yet
             pass
 
-        finally:
-            wok_log.info(
-                '[%s] Shutting down the socket server to %s console',
-                self.name,
-                self._guest_name,
-            )
-            self._socket.close()
-            if os.path.exists(self._server_addr):
-                os.unlink(self._server_addr)
-
-            try:
-                console.eventRemoveCallback()
-
-            except Exception as e:
-                wok_log.info(
-                    '[%s] Callback is probably removed: %s', self.name, str(e))
-
-            guest.close()
-
-    def _listen(self, guest, console):
-        """Accepts client connections.
-
-        Each connection is directly linked to the desired guest console. Thus
-        any data received from the client can be send to the guest console as
-        well as any response from the guest console can be send back to the
-        client console.
-        """
-        client, client_addr = self._socket.accept()
-
-        session_timeout = wok_config.get('server', 'session_timeout')
-        client.settimeout(int(session_timeout) * 60)
-        wok_log.info('[%s] Client connected to %s',
-                     self.name, self._guest_name)
+    def _stream_cb(self, stream, events, session):
+        """Handles the libvirt stream events, in the libvirt event loop"""
+        if events & (libvirt.VIR_STREAM_EVENT_ERROR |
+                     libvirt.VIR_STREAM_EVENT_HANGUP):
+            self._call_soon(self._close, session)
+            return
 
-        # register the callback to receive any data from the console
-        console.eventAddCallback(
-            libvirt.VIR_STREAM_EVENT_READABLE, self._send_to_client, client
-        )
+        if events & libvirt.VIR_STREAM_EVENT_WRITABLE:
+            self._flush_console(session)
 
-        # start the libvirt event loop in a python thread
-        libvirt_loop = threading.Thread(
-            target=self.libvirt_event_loop, args=(guest, client)
-        )
-        libvirt_loop.start()
+        if not events & libvirt.VIR_STREAM_EVENT_READABLE:
+            return
 
+        received = False
         while True:
-            data = ''
             try:
-                data = client.recv(1024)
-
-            except Exception as e:
-                wok_log.info(
-                    '[%s] Client disconnected from %s: %s',
-                    self.name,
-                    self._guest_name,
-                    str(e),
-                )
+                data = stream.recv(BUFFER_SIZE)
+            except libvirt.libvirtError as e:
+                wok_log.info('Error when reading from %s console: %s',
+                             session.guest_name, e)
+                self._call_soon(self._close, session)
                 break
 
-            if not data or data == CTRL_Q:
+            # -2: no more data for now
+            if data == -2:
                 break
-
-            # if the console can no longer be accessed, close everything
-            # and quits
-            try:
-                console.send(data)
-
-            except Exception:
-                wok_log.info(
-                    '[%s] Console of %s is not accessible', self.name, self._guest_name
-                )
+            if not data:
+                self._call_soon(self._close, session)
                 break
 
-        # clear used resources when the connection is closed and, if possible,
-        # tell the client the connection was lost.
-        try:
-            client.send(b'\\r\\n\\r\\nClient disconnected\\r\\n')
+            received = True
+            with session.lock:
+                session.to_client += data
+                excess = len(session.to_client) - MAX_PENDING_OUTPUT
+                if excess > 0:
+                    del session.to_client[:excess]
+
+        if received:
+            session.answered.set()
+            self._call_soon(self._update_client, session)
+
+    def _flush_console(self, session):
+        """Sends the pending client data to the console stream"""
+        with session.send_lock:
+            while True:
+                with session.lock:
+                    data = bytes(session.to_console[:BUFFER_SIZE])
+                if not data:
+                    break
+
+                try:
+                    sent = session.stream.send(data)
+                except libvirt.libvirtError:
+                    wok_log.info('Console of %s is not accessible',
+                                 session.guest_name)
+                    self._call_soon(self._close, session)
+                    return
+
+                if sent == -2:
+                    break
+                with session.lock:
+                    del session.to_console[:sent]
+
+            # be woken up by the event loop when the stream is writable again
+            events = libvirt.VIR_STREAM_EVENT_READABLE
+            if data:
+                events |= libvirt.VIR_STREAM_EVENT_WRITABLE
+            if not session.closed:
+                session.stream.eventUpdateCallback(events)
+
+    def _register(self, session):
+        if not session.closed:
+            self._selector.register(
+                session.listener, selectors.EVENT_READ, session)
+
+    def _update_client(self, session):
+        if session.closed or session.client is None:
+            return
 
-        except Exception:
-            pass
+        events = selectors.EVENT_READ
+        with session.lock:
+            if session.to_client:
+                events |= selectors.EVENT_WRITE
+        self._selector.modify(session.client, events, session)
 
+    def _accept(self, session):
+        try:
+            client, addr = session.listener.accept()
+        except BlockingIOError:
+            return
 
-# socket_server
+        if session.client is not None:
+            # exclusive connection per guest
+            client.close()
+            return
 
+        client.setblocking(False)
+        session.client = client
+        session.last_activity = time.monotonic()
+        self._selector.register(client, selectors.EVENT_READ, session)
+        self._update_client(session)
+        wok_log.info('Client connected to %s', session.guest_name)
 
-class LibvirtGuest(object):
-    def __init__(self, guest_name, uri, process_name):
-        """
-        Constructs a guest object that opens a connection to libvirt and
-        searchs for a particular guest, provided by the caller.
-        """
-        self._proc_name = process_name
+    def _read_client(self, session):
         try:
-            libvirt = model.libvirtconnection.LibvirtConnection(uri)
-            self._guest = model.vms.VMModel.get_vm(guest_name, libvirt)
+            data = session.client.recv(BUFFER_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            wok_log.info('Client disconnected from %s: %s',
+                         session.guest_name, e)
+            self._close(session)
+            return
 
-        except Exception as e:
-            wok_log.error(
-                '[%s] Cannot open guest %s: %s', self._proc_name, guest_name, str(
-                    e)
-            )
-            raise
+        if not data or data == CTRL_Q:
+            self._close(session)
+            return
 
-        self._libvirt = libvirt.get()
-        self._name = guest_name
-        self._stream = None
+        session.last_activity = time.monotonic()
+        with session.lock:
+            session.to_console += data
+        self._flush_console(session)
 
-    def is_running(self):
-        """
-        Checks if this guest is currently in a running state.
-        """
-        return (
-            self._guest.state(0)[0] == libvirt.VIR_DOMAIN_RUNNING or
-            self._guest.state(0)[0] == libvirt.VIR_DOMAIN_PAUSED
-        )
+    def _write_client(self, session):
+        with session.lock:
+            data = bytes(session.to_client)
+        try:
+            sent = session.client.send(data)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            wok_log.info('Client disconnected from %s: %s',
+                         session.guest_name, e)
+            self._close(session)
+            return
 
-    def get_console(self):
-        """
-        Opens a console to this guest and returns a reference to it.
-        Note: If another instance (eg: virsh) has an existing console opened
-        to this guest, this code will steal that console.
-        """
-        # guest must be in a running state to get its console
-        counter = 10
-        while not self.is_running():
-            wok_log.info(
-                '[%s] Guest %s is not running, waiting for it',
-                self._proc_name,
-                self._name,
-            )
+        with session.lock:
+            del session.to_client[:sent]
+        self._update_client(session)
 
-            counter -= 1
-            if counter <= 0:
-                return None
+    def _check_sessions(self):
+        """Closes the sessions of stopped guests and idle clients"""
+        timeout = int(wok_config.get('server', 'session_timeout')) * 60
+        now = time.monotonic()
+        with self._lock:
+            sessions = [s for s in self._sessions.values() if s is not None]
 
-            time.sleep(1)
+        for session in sessions:
+            try:
+                running = self._is_running(session.dom)
+            except libvirt.libvirtError:
+                running = False
+
+            if not running:
+                wok_log.info('Guest %s is not running', session.guest_name)
+                self._close(session)
+            elif session.client is not None and (
+                now - session.last_activity > timeout
+            ):
+                wok_log.info('Client of %s console is idle',
+                             session.guest_name)
+                self._close(session)
+
+    def _close(self, session):
+        """Releases the resources of a session, in the server thread"""
+        if session.closed:
+            return
 
-        # attach a stream in the guest console so we can read from/write to it
-        if self._stream is None:
-            wok_log.info(
-                '[%s] Opening the console for guest %s', self._proc_name, self._name
-            )
-            self._stream = self._libvirt.newStream(libvirt.VIR_STREAM_NONBLOCK)
-            self._guest.openConsole(
-                None,
-                self._stream,
-                libvirt.VIR_DOMAIN_CONSOLE_FORCE | libvirt.VIR_DOMAIN_CONSOLE_SAFE,
-            )
-        return self._stream
+        wok_log.info('Shutting down the socket server to %s console',
+                     session.guest_name)
+        for sock in (session.listener, session.client):
+            if sock is None:
+                continue
+            try:
+                self._selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
 
-    def close(self):
-        """Closes the libvirt connection.
-        """
-        self._libvirt.close()
+        # if possible, tell the client the connection was lost
+        if session.client is not None:
+            try:
+                session.client.send(b'\r\n\r\nClient disconnected\r\n')
+            except OSError:
+                pass
+            session.client.close()
+
+        self._release(session)
+        with self._lock:
+            if self._sessions.get(session.guest_name) is session:
+                del self._sessions[session.guest_name]
+
+    def _release(self, session):
+        session.closed = True
+        session.listener.close()
+        if os.path.exists(session.path):
+            os.unlink(session.path)
 
+        try:
+            session.stream.eventRemoveCallback()
+        except Exception as e:
+            wok_log.info('Callback is probably removed: %s', str(e))
 
-# guest
+        try:
+            session.stream.abort()
+        except Exception:
+            pass
 
+    def _run(self):
+        next_check = time.monotonic() + CHECK_INTERVAL
+        while True:
+            timeout = max(next_check - time.monotonic(), 0)
+            for key, events in self._selector.select(timeout):
+                session = key.data
+                if session is None:
+                    try:
+                        while self._wakeup_r.recv(BUFFER_SIZE):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif session.closed:
+                    continue
+                elif key.fileobj is session.listener:
+                    self._accept(session)
+                else:
+                    if events & selectors.EVENT_READ:
+                        self._read_client(session)
+                    if events & selectors.EVENT_WRITE and not session.closed:
+                        self._write_client(session)
+
+            with self._lock:
+                calls, self._calls = self._calls, []
+            for func, args in calls:
+                try:
+                    func(*args)
+                except Exception as e:
+                    wok_log.error('Serial console server error: %s', str(e))
+
+            if time.monotonic() >= next_check:
+                self._check_sessions()
+                next_check = time.monotonic() + CHECK_INTERVAL
 
-def main(guest_name, URI='qemu:///system'):
-    """Main entry point to create a socket server.
 
-    Starts a new socket server to listen messages to/from the guest.
+def main(guest_name, URI='qemu:///system'):
+    """Stand alone instance of the console server, with its own libvirt
+    connection and event loop.
     """
-    server = None
-    try:
-        server = SocketServer(guest_name, URI)
+    libvirt.virEventRegisterDefaultImpl()
+
+    def _event_loop():
+        while True:
+            libvirt.virEventRunDefaultImpl()
+
+    libvirt_loop = threading.Thread(target=_event_loop)
+    libvirt_loop.daemon = True
+    libvirt_loop.start()
 
-    except Exception as e:
-        wok_log.error('Cannot create the socket server: %s', str(e))
-        raise
+    conn = model.libvirtconnection.LibvirtConnection(URI)
+    server = get_console_server(conn)
+    if not server.open(guest_name):
+        sys.exit(1)
 
-    server.start()
-    return server
+    while guest_name in server._sessions:
+        time.sleep(1)
 
 
 if __name__ == '__main__':
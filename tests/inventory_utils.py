@@ -0,0 +1,93 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import unittest
+
+import libvirt
+import mock
+
+
+def fake_object(name, xml=None, **values):
+    """
+    Return a mocked libvirt object named <name>, described by <xml>, whose
+    other methods return the values of the keyword arguments.
+    """
+    obj = mock.Mock()
+    obj.name.return_value = name
+    if xml is not None:
+        obj.XMLDesc.return_value = xml
+    for method, value in values.items():
+        getattr(obj, method).return_value = value
+    return obj
+
+
+def libvirt_error(message, code):
+    """Return a libvirtError with the error code <code>"""
+    e = libvirt.libvirtError(message)
+    e.get_error_code = mock.Mock(return_value=code)
+    return e
+
+
+class InventoryTestCase(unittest.TestCase):
+    """
+    Base class of the tests of the event-driven inventories.
+
+    The inventory of class <inventory_class> is created on a mocked libvirt
+    connection listing self.objects through <list_method> and finding them
+    through <lookup_method> by the value of their <lookup_key> method, or
+    raising a libvirtError with the code <not_found>. It watches the mocked
+    LibvirtEvents self.events, which registers the events through
+    <register_method>.
+    """
+
+    inventory_class = None
+    register_method = None
+    list_method = None
+    lookup_method = None
+    lookup_key = 'name'
+    not_found = None
+
+    def setUp(self):
+        self.objects = self.get_objects()
+        self.conn = mock.Mock()
+        vir_conn = self.conn.get.return_value
+        getattr(vir_conn, self.list_method).side_effect = (
+            lambda flags: list(self.objects)
+        )
+        if self.lookup_method is not None:
+            getattr(vir_conn, self.lookup_method).side_effect = self._lookup
+        self.events = mock.Mock()
+        getattr(self.events, self.register_method).return_value = True
+
+        self.inventory = self.inventory_class(self.conn)
+        self.inventory.watch(self.events)
+
+    def get_objects(self):
+        """Return the libvirt objects listed by the connection"""
+        return []
+
+    def remove_object(self, name):
+        """Stop listing the libvirt object <name>"""
+        self.objects[:] = [obj for obj in self.objects if obj.name() != name]
+
+    def _lookup(self, key):
+        for obj in self.objects:
+            if getattr(obj, self.lookup_key)() == key:
+                return obj
+
+        raise libvirt_error('Object not found', self.not_found)
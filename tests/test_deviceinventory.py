@@ -0,0 +1,150 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import mock
+from inventory_utils import fake_object
+from inventory_utils import InventoryTestCase
+from wok.plugins.kimchi.model import hostdev
+from wok.plugins.kimchi.model.deviceinventory import DeviceInventory
+
+
+DEVICES = {
+    'computer': {'parent': None, 'device_type': 'system'},
+    'pci_0000_00_02_0': {
+        'parent': 'computer', 'device_type': 'pci', 'iommuGroup': 1,
+        'path': '/sys/devices/pci0000:00/0000:00:02.0',
+    },
+    'pci_0000_03_00_0': {
+        'parent': 'computer', 'device_type': 'pci', 'iommuGroup': 7,
+        'path': '/sys/devices/pci0000:00/0000:03:00.0',
+    },
+    'pci_0000_03_00_1': {
+        'parent': 'computer', 'device_type': 'pci', 'iommuGroup': 7,
+        'path': '/sys/devices/pci0000:00/0000:03:00.1',
+    },
+    'net_eth0': {'parent': 'pci_0000_03_00_0', 'device_type': 'net'},
+    'usb_1_1': {'parent': 'computer', 'device_type': 'usb_device'},
+    'usb_1_1_0': {'parent': 'usb_1_1', 'device_type': 'usb'},
+}
+
+PCI_CLASSES = {
+    'pci_0000_00_02_0': 0x030000,
+    'pci_0000_03_00_0': 0x020000,
+    'pci_0000_03_00_1': 0x030200,
+}
+
+
+class DeviceInventoryTests(InventoryTestCase):
+    inventory_class = DeviceInventory
+    register_method = 'registerNodeDeviceEvents'
+    list_method = 'listAllDevices'
+
+    def get_objects(self):
+        return [fake_object(name) for name in DEVICES]
+
+    def _get_dev_info(self, node_dev):
+        info = dict(DEVICES[node_dev.name()])
+        info['name'] = node_dev.name()
+        return info
+
+    def setUp(self):
+        super(DeviceInventoryTests, self).setUp()
+        patches = [
+            mock.patch.object(
+                hostdev, 'get_dev_info', side_effect=self._get_dev_info),
+            mock.patch.object(
+                hostdev, '_get_pci_class',
+                side_effect=lambda info: PCI_CLASSES[info['name']]),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_devices(self):
+        devices = self.inventory.get_devices()
+        self.assertEqual(sorted(DEVICES), [d['name'] for d in devices])
+        usb = self.inventory.get_devices('usb_device')
+        self.assertEqual(['usb_1_1'], [d['name'] for d in usb])
+        self.assertIsNone(self.inventory.get_device('pci_0000_ff_00_0'))
+
+        # the infos returned are copies
+        self.inventory.get_device('usb_1_1')['vga3d'] = False
+        self.assertNotIn('vga3d', self.inventory.get_device('usb_1_1'))
+
+    def test_passthrough_devices(self):
+        # the graphic card is not eligible, unlike the 3D controller
+        self.assertEqual(
+            ['pci_0000_03_00_0', 'pci_0000_03_00_1', 'usb_1_1'],
+            self.inventory.get_passthrough_devices(),
+        )
+        self.assertEqual(
+            0x030200, self.inventory.get_pci_class('pci_0000_03_00_1'))
+        self.assertIsNone(self.inventory.get_pci_class('usb_1_1'))
+
+    def test_iommu_groups(self):
+        self.assertEqual(
+            {1: ['pci_0000_00_02_0'],
+             7: ['pci_0000_03_00_0', 'pci_0000_03_00_1']},
+            self.inventory.get_iommu_groups(),
+        )
+
+        # the children are in the IOMMU group of their parent
+        self.assertEqual(
+            ['net_eth0', 'pci_0000_03_00_1'],
+            self.inventory.get_affected_devices('pci_0000_03_00_0'),
+        )
+        # without IOMMU group the children are affected
+        self.assertEqual(
+            ['usb_1_1_0'], self.inventory.get_affected_devices('usb_1_1'))
+        self.assertEqual(
+            ['pci_0000_03_00_0', 'pci_0000_03_00_1'],
+            self.inventory.get_affected_devices('net_eth0'),
+        )
+
+    def test_built_once(self):
+        self.inventory.get_devices()
+        self.inventory.get_passthrough_devices()
+        self.inventory.get_affected_devices('usb_1_1')
+        vir_conn = self.conn.get.return_value
+        self.assertEqual(1, vir_conn.listAllDevices.call_count)
+        self.assertEqual(len(DEVICES), hostdev.get_dev_info.call_count)
+
+    def test_device_events(self):
+        self.inventory.get_devices()
+        self.events.registerNodeDeviceEvents.assert_called_once_with(
+            self.conn, self.inventory._device_changed_cb, None
+        )
+
+        self.remove_object('usb_1_1_0')
+        self.inventory._device_changed_cb(mock.Mock(), None)
+        self.assertEqual([], self.inventory.get_affected_devices('usb_1_1'))
+
+    def test_no_events(self):
+        # without the events the inventory is built on every access
+        self.events.registerNodeDeviceEvents.return_value = False
+        self.inventory.get_devices()
+        self.remove_object('usb_1_1')
+        self.assertNotIn(
+            'usb_1_1', self.inventory.get_passthrough_devices())
+
+    def test_reconnect(self):
+        self.inventory.get_devices()
+        self.conn.get.return_value = mock.Mock()
+        self.conn.get.return_value.listAllDevices.return_value = []
+        self.assertEqual([], self.inventory.get_devices())
+        self.assertEqual(2, self.events.registerNodeDeviceEvents.call_count)
@@ -18,36 +18,206 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import json
 import unittest
 
 import mock
 from wok.exception import NotFoundError
 from wok.exception import OperationFailed
-from wok.plugins.kimchi.disks import _get_lsblk_devs
+from wok.plugins.kimchi import disks
+from wok.plugins.kimchi.disks import BlockDevices
+from wok.plugins.kimchi.utils import TTLCache
 
 
-class DiskTests(unittest.TestCase):
+def _dev(name, devtype, children=None, **fields):
+    dev = {
+        'name': name,
+        'kname': fields.pop('kname', name),
+        'type': devtype,
+        'fstype': None,
+        'mountpoint': None,
+        'maj:min': fields.pop('majmin', '8:0'),
+        'size': 1073741824,
+        'pkname': None,
+        'parttype': None,
+    }
+    dev.update(fields)
+    if children:
+        dev['children'] = children
+    return dev
 
-    @mock.patch('wok.plugins.kimchi.disks.run_command')
-    def test_lsblk_returns_404_when_device_not_found(self, mock_run_command):
-        mock_run_command.return_value = ['', 'not a block device', 32]
-        fake_dev = '/not/a/true/block/dev'
-        keys = ['MOUNTPOINT']
 
+# a multipath device listed under each of its paths
+MPATH = _dev('mpatha', 'mpath', kname='dm-0', majmin='253:0')
+LSBLK_TREE = [
+    _dev('sda', 'disk', [
+        _dev('sda1', 'part', fstype='xfs', mountpoint='/boot',
+             parttype='0x83'),
+        _dev('sda2', 'part', parttype='0x5'),
+        _dev('sda5', 'part', parttype='0x83'),
+        _dev('sda6', 'part', fstype='swap', mountpoint='[SWAP]',
+             parttype='0x82'),
+    ]),
+    _dev('sdb', 'disk', [MPATH]),
+    _dev('sdc', 'disk', [MPATH]),
+    _dev('sdd', 'disk', fstype='LVM2_member'),
+    _dev('sde', 'disk'),
+    _dev('sr0', 'rom'),
+]
+
+LVM_REPORT = {'report': [
+    {
+        'vg': [{'vg_name': 'vgtest', 'vg_size': '21474836480',
+                'vg_free': '1073741824'}],
+        'pv': [{'pv_name': '/dev/sdd', 'pv_size': '21474836480',
+                'pv_uuid': 'CyBzhK-cQFl-gWqr-fyWC-A50Y-LMxu-iHiJq4'}],
+        'lv': [{'lv_name': 'lva', 'lv_path': '/dev/vgtest/lva',
+                'lv_size': '10737418240'},
+               {'lv_name': '[lvol0_pmspare]', 'lv_path': '',
+                'lv_size': '4194304'}],
+    },
+    {
+        'vg': [{'vg_name': 'vgtest2', 'vg_size': '1073741824',
+                'vg_free': '0'}],
+        'pv': [{'pv_name': '/dev/sdf', 'pv_size': '1073741824',
+                'pv_uuid': 'kkon5B-vnFI-eKHn-I5cG-Hj0C-uGx0-xqZrXI'}],
+        'lv': [{'lv_name': 'lvb', 'lv_path': '/dev/vgtest2/lvb',
+                'lv_size': '1073741824'}],
+    },
+    # physical volumes belonging to no volume group
+    {
+        'vg': [],
+        'pv': [{'pv_name': '/dev/sdg', 'pv_size': '1073741824',
+                'pv_uuid': 'a1b2c3-vnFI-eKHn-I5cG-Hj0C-uGx0-xqZrXI'}],
+        'lv': [],
+    },
+]}
+
+
+class BlockDevicesTests(unittest.TestCase):
+    def setUp(self):
+        self.devices = BlockDevices(LSBLK_TREE)
+
+    def test_graph(self):
+        mpath = self.devices.find('mpatha')
+        self.assertEqual(['sdb', 'sdc'], mpath['parents'])
+        self.assertEqual('/dev/mapper/mpatha', mpath['path'])
+        self.assertEqual(['mpatha'], self.devices.find('sdb')['children'])
+        self.assertEqual(
+            ['sda1', 'sda2', 'sda5', 'sda6'],
+            self.devices.find('sda')['children'],
+        )
+        self.assertEqual('1073741824', self.devices.find('sda1')['size'])
+        self.assertEqual('sda5', self.devices.find('/dev/sda5')['name'])
+        self.assertIsNone(self.devices.find('sdz'))
+
+    def test_available(self):
+        available = [
+            name for name, dev in sorted(self.devices.devices.items())
+            if self.devices.is_available(dev)
+        ]
+        # disks with partitions or held by a multipath device, mounted or
+        # formatted devices, physical volumes and extended partitions are
+        # not available
+        self.assertEqual(['mpatha', 'sda5', 'sde'], available)
+
+
+class BlockDeviceInventoryTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('wok.plugins.kimchi.disks.run_command')
+        self.run_command = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.run_command.return_value = [
+            json.dumps({'blockdevices': LSBLK_TREE}), '', 0]
+
+        patcher = mock.patch.object(
+            disks, '_block_devices',
+            TTLCache(disks._block_devices.load, disks.BLOCK_DEVICES_TTL))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_single_lsblk_call(self):
+        self.assertEqual(
+            ['mpatha', 'sda5', 'sde'],
+            sorted(disks.get_partitions_names(check=True)),
+        )
+        details = disks.get_partition_details('sda6')
+        self.assertEqual('', details['mountpoint'])
+        self.assertFalse(details['available'])
+        self.assertTrue(disks.get_partition_details('sde')['available'])
+        self.run_command.assert_called_once_with(['lsblk', '-J', '-b', '-O'])
+
+        disks.invalidate_block_devices()
+        disks.get_partitions_names()
+        self.assertEqual(2, self.run_command.call_count)
+
+    def test_device_copy(self):
+        dev = disks.find_block_device('sdb')
+        dev['parents'].append('sdz')
+        dev['children'].append('sdz')
+        dev = disks.find_block_device('sdb')
+        self.assertNotIn('sdz', dev['parents'])
+        self.assertNotIn('sdz', dev['children'])
+
+    def test_device_not_found(self):
+        self.assertIsNone(disks.find_block_device('/dev/sdz'))
         with self.assertRaises(NotFoundError):
-            _get_lsblk_devs(keys, [fake_dev])
-            cmd = ['lsblk', '-Pbo', 'MOUNTPOINT', fake_dev]
-            mock_run_command.assert_called_once_with(cmd)
+            disks.get_partition_details('sdz')
+
+    def test_lsblk_error(self):
+        self.run_command.return_value = ['', 'error', 1]
+        with self.assertRaises(OperationFailed):
+            disks.get_partitions_names()
+
+
+class LVMInventoryTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('wok.plugins.kimchi.disks.run_command')
+        self.run_command = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.run_command.return_value = [json.dumps(LVM_REPORT), '', 0]
+
+        patcher = mock.patch.object(
+            disks, '_lvm', TTLCache(disks._lvm.load, disks.LVM_REPORT_TTL))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_single_lvm_call(self):
+        self.assertEqual(
+            [{'vgname': 'vgtest', 'size': 21474836480, 'free': 1073741824},
+             {'vgname': 'vgtest2', 'size': 1073741824, 'free': 0}],
+            disks.vgs(),
+        )
+        self.assertEqual(
+            [{'lvname': 'lva', 'path': '/dev/vgtest/lva',
+              'size': 10737418240}],
+            disks.lvs('vgtest'),
+        )
+        self.assertEqual(['lva', 'lvb'], [lv['lvname'] for lv in disks.lvs()])
+        self.assertEqual(
+            ['/dev/sdd', '/dev/sdf', '/dev/sdg'],
+            [pv['pvname'] for pv in disks.pvs()],
+        )
+        self.assertEqual(
+            ['/dev/sdf'], [pv['pvname'] for pv in disks.pvs('vgtest2')])
+        vg = disks.get_vg('vgtest')
+        self.assertEqual(['/dev/sdd'], [pv['pvname'] for pv in vg['pvs']])
+        self.assertEqual(1, self.run_command.call_count)
+        self.assertEqual(
+            ['lvm', 'fullreport', '--reportformat', 'json'],
+            self.run_command.call_args[0][0][:4],
+        )
 
-    @mock.patch('wok.plugins.kimchi.disks.run_command')
-    def test_lsblk_returns_500_when_unknown_error_occurs(
-            self, mock_run_command):
+        disks.invalidate_lvm()
+        disks.vgs()
+        self.assertEqual(2, self.run_command.call_count)
 
-        mock_run_command.return_value = ['', '', 1]
-        valid_dev = '/valid/block/dev'
-        keys = ['MOUNTPOINT']
+    def test_vg_not_found(self):
+        self.assertIsNone(disks.get_vg('vgtest3'))
+        # the report is read again before giving up
+        self.assertEqual(2, self.run_command.call_count)
 
+    def test_lvm_error(self):
+        self.run_command.return_value = ['', 'error', 5]
         with self.assertRaises(OperationFailed):
-            _get_lsblk_devs(keys, [valid_dev])
-            cmd = ['lsblk', '-Pbo', 'MOUNTPOINT', valid_dev]
-            mock_run_command.assert_called_once_with(cmd)
+            disks.vgs()
@@ -0,0 +1,192 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import libvirt
+from inventory_utils import fake_object
+from inventory_utils import InventoryTestCase
+from inventory_utils import libvirt_error
+from wok.plugins.kimchi.model.domaininventory import DomainInventory
+
+
+DOMAIN_XML = """
+<domain type='kvm'>
+  <name>%(name)s</name>
+  <uuid>%(uuid)s</uuid>
+  <devices>
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='qcow2'/>
+      <source file='/var/lib/libvirt/images/%(name)s.img'/>
+      <target dev='vda' bus='virtio'/>
+    </disk>
+    <interface type='network'>
+      <source network='default'/>
+    </interface>
+  </devices>
+</domain>
+"""
+
+VOLUME_XML = """
+<volume type='file'>
+  <name>%(name)s</name>
+  <target>
+    <path>%(path)s</path>
+    <format type='qcow2'/>
+  </target>
+  %(backing)s
+</volume>
+"""
+
+BACKING_XML = """
+  <backingStore>
+    <path>%s</path>
+    <format type='raw'/>
+  </backingStore>
+"""
+
+
+class DomainInventoryTests(InventoryTestCase):
+    inventory_class = DomainInventory
+    register_method = 'registerDomainChangeEvents'
+    list_method = 'listAllDomains'
+    lookup_method = 'lookupByUUIDString'
+    lookup_key = 'UUIDString'
+    not_found = libvirt.VIR_ERR_NO_DOMAIN
+
+    def _dom(self, name, uuid):
+        return fake_object(
+            name, DOMAIN_XML % {'name': name, 'uuid': uuid},
+            UUIDString=uuid, state=[5, 0]
+        )
+
+    def get_objects(self):
+        return [self._dom('vm-1', 'uuid-1'), self._dom('vm-2', 'uuid-2')]
+
+    def setUp(self):
+        super(DomainInventoryTests, self).setUp()
+        self.doms = self.objects
+        # key: volume path; value: path of its backing file
+        self.backing = {}
+        vir_conn = self.conn.get.return_value
+        vir_conn.storageVolLookupByPath.side_effect = self._lookup_volume
+
+    def _lookup_volume(self, path):
+        if not path.startswith('/var/lib/libvirt/images/'):
+            raise libvirt_error('Storage volume not found',
+                                libvirt.VIR_ERR_NO_STORAGE_VOL)
+
+        backing = ''
+        if path in self.backing:
+            backing = BACKING_XML % self.backing[path]
+        name = path.split('/')[-1]
+        return fake_object(name, VOLUME_XML % {
+            'name': name, 'path': path, 'backing': backing})
+
+    def test_entries(self):
+        domains = self.inventory.get_domains()
+        self.assertEqual(['vm-1', 'vm-2'], [d['name'] for d in domains])
+        self.assertEqual(['default'], domains[0]['networks'])
+        self.assertEqual(
+            '/var/lib/libvirt/images/vm-1.img', domains[0]['disks'][0]['path']
+        )
+        self.assertEqual(5, domains[0]['state'])
+        self.assertEqual([], domains[0]['hostdevs'])
+
+    def test_xml_read_once_until_changed(self):
+        self.inventory.get_domains()
+        self.inventory.get_domains()
+        for dom in self.doms:
+            self.assertEqual(1, dom.XMLDesc.call_count)
+
+        # only the changed domain is read again
+        self.inventory._domain_changed_cb(self.doms[0], None)
+        self.inventory.get_domains()
+        self.assertEqual(2, self.doms[0].XMLDesc.call_count)
+        self.assertEqual(1, self.doms[1].XMLDesc.call_count)
+        self.assertEqual(1, self.conn.get().listAllDomains.call_count)
+
+    def test_defined_and_undefined_domains(self):
+        path = '/var/lib/libvirt/images/%s.img'
+        self.assertEqual(['vm-1'], self.inventory.get_disk_users(path % 'vm-1'))
+
+        removed = self.doms.pop(0)
+        self.doms.append(self._dom('vm-3', 'uuid-3'))
+        self.inventory.invalidate(removed)
+        self.inventory.invalidate(self.doms[-1])
+
+        domains = self.inventory.get_domains()
+        self.assertEqual(['vm-2', 'vm-3'], sorted(d['name'] for d in domains))
+        self.assertEqual([], self.inventory.get_disk_users(path % 'vm-1'))
+        self.assertEqual(['vm-3'], self.inventory.get_disk_users(path % 'vm-3'))
+
+    def test_failed_load(self):
+        vir_conn = self.conn.get.return_value
+        vir_conn.listAllDomains.side_effect = libvirt_error(
+            'Connection reset', libvirt.VIR_ERR_INTERNAL_ERROR)
+        self.assertRaises(libvirt.libvirtError, self.inventory.get_domains)
+        vir_conn.listAllDomains.side_effect = lambda flags: list(self.doms)
+        self.assertEqual(2, len(self.inventory.get_domains()))
+
+        # the domain changed is read again after the failure
+        self.inventory._domain_changed_cb(self.doms[0], None)
+        vir_conn.lookupByUUIDString.side_effect = libvirt_error(
+            'Connection reset', libvirt.VIR_ERR_INTERNAL_ERROR)
+        self.assertRaises(libvirt.libvirtError, self.inventory.get_domains)
+        vir_conn.lookupByUUIDString.side_effect = self._lookup
+        self.inventory.get_domains()
+        self.assertEqual(2, self.doms[0].XMLDesc.call_count)
+        self.assertEqual(1, self.doms[1].XMLDesc.call_count)
+
+    def test_no_events(self):
+        self.events.registerDomainChangeEvents.return_value = False
+        inventory = DomainInventory(self.conn)
+        inventory.watch(self.events)
+
+        inventory.get_domains()
+        inventory.get_domains()
+        for dom in self.doms:
+            self.assertEqual(2, dom.XMLDesc.call_count)
+
+    def test_backing_users(self):
+        path = '/var/lib/libvirt/images/%s.img'
+        # vm-2 is a linked clone of vm-1, itself backed by a template image
+        self.backing[path % 'vm-2'] = path % 'vm-1'
+        self.backing[path % 'vm-1'] = '/templates/base.img'
+
+        self.assertEqual(
+            ['vm-2'], self.inventory.get_backing_users(path % 'vm-1'))
+        self.assertEqual(
+            ['vm-1', 'vm-2'],
+            self.inventory.get_backing_users('/templates/base.img')
+        )
+        self.assertEqual([], self.inventory.get_backing_users(path % 'vm-2'))
+        # a backing file is not a disk of the domain
+        self.assertEqual(['vm-1'], self.inventory.get_disk_users(path % 'vm-1'))
+
+    def test_backing_users_of_running_domain(self):
+        # the live XML lists the backing chain of the disks
+        self.doms[1].XMLDesc.return_value = DOMAIN_XML.replace(
+            '<target dev',
+            "<backingStore type='file'><format type='raw'/>"
+            "<source file='/var/lib/libvirt/images/vm-1.img'/>"
+            "<backingStore/></backingStore><target dev"
+        ) % {'name': 'vm-2', 'uuid': 'uuid-2'}
+
+        self.assertEqual(
+            ['vm-2'],
+            self.inventory.get_backing_users('/var/lib/libvirt/images/vm-1.img')
+        )
@@ -0,0 +1,75 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import threading
+import unittest
+
+import mock
+from wok.exception import OperationFailed
+from wok.plugins.kimchi.model.libvirtconnection import ConnectionPool
+from wok.plugins.kimchi.model.libvirtconnection import LibvirtConnection
+
+
+class ConnectionPoolTests(unittest.TestCase):
+    def test_slots_are_reused(self):
+        pool = ConnectionPool(2)
+        slot = pool.acquire()
+        pool.release(slot)
+        self.assertEqual(slot, pool.acquire())
+        self.assertNotEqual(slot, pool.acquire())
+
+        stats = pool.get_stats()
+        self.assertEqual(2, stats['size'])
+        self.assertEqual(2, stats['in_use'])
+        self.assertEqual(3, stats['borrowed'])
+        self.assertEqual(0, stats['waited'])
+
+    def test_saturated_pool_waits(self):
+        pool = ConnectionPool(1)
+        slot = pool.acquire()
+        acquired = []
+        thread = threading.Thread(
+            target=lambda: acquired.append(pool.acquire()))
+        thread.start()
+
+        # the second caller waits for the slot to be released
+        thread.join(0.1)
+        self.assertEqual([], acquired)
+        self.assertEqual(1, pool.get_stats()['waiting'])
+
+        pool.release(slot)
+        thread.join()
+        self.assertEqual([slot], acquired)
+        stats = pool.get_stats()
+        self.assertEqual(1, stats['waited'])
+        self.assertEqual(0, stats['waiting'])
+        self.assertEqual(1, stats['max_in_use'])
+
+
+class LibvirtConnectionTests(unittest.TestCase):
+    @mock.patch.object(LibvirtConnection, 'get')
+    def test_borrow_unreachable(self, mock_get):
+        mock_get.return_value = None
+        conn = LibvirtConnection('test:///borrow-unreachable', pool_size=1)
+
+        with self.assertRaises(OperationFailed):
+            with conn.borrow():
+                self.fail('no connection is lent while libvirt is down')
+
+        # the slot is released
+        self.assertEqual(0, conn.get_stats()['in_use'])
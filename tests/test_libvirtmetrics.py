@@ -0,0 +1,67 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import unittest
+
+from wok.plugins.kimchi.model.libvirtmetrics import CallMetrics
+
+
+class CallMetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.metrics = CallMetrics(buckets=(0.01, 1))
+        self.metrics.record('virDomain.XMLDesc', 0.001)
+        self.metrics.record('virDomain.XMLDesc', 0.5)
+        self.metrics.record('virStoragePool.refresh', 2, failed=True)
+
+    def test_stats(self):
+        stats = self.metrics.get_stats()
+        xml = stats['virDomain.XMLDesc']
+        self.assertEqual(2, xml['calls'])
+        self.assertEqual(0, xml['errors'])
+        self.assertAlmostEqual(0.501, xml['time'])
+        self.assertEqual({'0.01': 1, '1': 2, '+Inf': 2}, xml['buckets'])
+
+        refresh = stats['virStoragePool.refresh']
+        self.assertEqual(1, refresh['errors'])
+        self.assertEqual({'0.01': 0, '1': 0, '+Inf': 1}, refresh['buckets'])
+
+        self.metrics.reset()
+        self.assertEqual({}, self.metrics.get_stats())
+
+    def test_prometheus(self):
+        text = self.metrics.to_prometheus(
+            {'connection_in_use': 1, 'connection_connected': True},
+            {'connection_borrowed': 3})
+        lines = text.splitlines()
+        self.assertIn(
+            'kimchi_libvirt_call_duration_seconds_bucket'
+            '{api="virDomain.XMLDesc",le="1"} 2', lines)
+        self.assertIn(
+            'kimchi_libvirt_call_duration_seconds_count'
+            '{api="virStoragePool.refresh"} 1', lines)
+        self.assertIn(
+            'kimchi_libvirt_call_errors_total'
+            '{api="virStoragePool.refresh"} 1', lines)
+        self.assertIn(
+            'kimchi_libvirt_calls_total{api="virDomain.XMLDesc"} 2', lines)
+        self.assertIn('# TYPE kimchi_libvirt_calls_total counter', lines)
+        self.assertIn('kimchi_libvirt_connection_in_use 1.0', lines)
+        self.assertIn(
+            '# TYPE kimchi_libvirt_connection_borrowed_total counter', lines)
+        self.assertIn('kimchi_libvirt_connection_borrowed_total 3.0', lines)
+        self.assertIn('kimchi_libvirt_connection_connected 1.0', lines)
@@ -0,0 +1,98 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import unittest
+
+import mock
+from wok.exception import InvalidOperation
+from wok.plugins.kimchi.model.vms import VMModel
+
+
+BASE_PATH = '/var/lib/libvirt/images/base.img'
+DOMAIN_XML = """
+<domain type='kvm'>
+  <name>base</name>
+  <devices>
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='raw'/>
+      <source file='%s'/>
+      <target dev='vda' bus='virtio'/>
+    </disk>
+  </devices>
+</domain>
+""" % BASE_PATH
+
+
+@mock.patch('wok.plugins.kimchi.model.vms.UserTests')
+@mock.patch('wok.plugins.kimchi.model.vms.xpath_get_text')
+@mock.patch('wok.plugins.kimchi.model.vms.get_domain_inventory')
+@mock.patch('wok.plugins.kimchi.model.vms.VMModel.get_vm')
+class LinkedCloneBaseTests(unittest.TestCase):
+    def setUp(self):
+        self.model = VMModel.__new__(VMModel)
+        self.model.conn = mock.Mock()
+        self.dom = mock.Mock()
+        self.dom.XMLDesc.return_value = DOMAIN_XML
+        self.dom.isPersistent.return_value = True
+        # shut off
+        self.dom.info.return_value = [5, 0, 0, 0, 0]
+
+    def _setup(self, mock_get_vm, mock_inventory, mock_xpath, clones):
+        mock_get_vm.return_value = self.dom
+        mock_xpath.side_effect = (
+            lambda xml, xpath: [BASE_PATH] if '@device' in xpath else []
+        )
+        inventory = mock_inventory.return_value
+        inventory.get_backing_users.side_effect = (
+            lambda path: list(clones) if path == BASE_PATH else []
+        )
+        return inventory
+
+    def test_start_base_of_linked_clones(self, mock_get_vm, mock_inventory,
+                                         mock_xpath, mock_user_tests):
+        self._setup(mock_get_vm, mock_inventory, mock_xpath,
+                    ['clone-1', 'clone-2'])
+        with self.assertRaisesRegex(InvalidOperation, 'KCHVM0098E'):
+            self.model.start('base')
+        self.dom.create.assert_not_called()
+
+    def test_start_without_linked_clones(self, mock_get_vm, mock_inventory,
+                                         mock_xpath, mock_user_tests):
+        self._setup(mock_get_vm, mock_inventory, mock_xpath, [])
+        self.model.start('base')
+        self.dom.create.assert_called_once_with()
+
+    def test_delete_base_of_linked_clones(self, mock_get_vm, mock_inventory,
+                                          mock_xpath, mock_user_tests):
+        self._setup(mock_get_vm, mock_inventory, mock_xpath, ['clone-1'])
+        with self.assertRaisesRegex(InvalidOperation, 'KCHVM0097E'):
+            self.model.delete('base')
+
+        # neither the VM nor its disks are touched
+        self.dom.undefine.assert_not_called()
+        self.dom.destroy.assert_not_called()
+        vir_conn = self.model.conn.get.return_value
+        vir_conn.storageVolLookupByPath.assert_not_called()
+
+    def test_linked_clones_of_their_own_base(self, mock_get_vm,
+                                             mock_inventory, mock_xpath,
+                                             mock_user_tests):
+        # a VM backed by its own disks is not a linked clone of itself
+        self._setup(mock_get_vm, mock_inventory, mock_xpath, ['base'])
+        self.assertEqual(
+            [], self.model._get_linked_clones('base', [BASE_PATH]))
@@ -0,0 +1,76 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import os
+import tempfile
+import unittest
+
+import mock
+from wok.plugins.kimchi.magicinfo import FileTypeCache
+from wok.plugins.kimchi.magicinfo import MagicPool
+
+
+class MagicInfoTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, b'data')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    @mock.patch('wok.plugins.kimchi.magicinfo.magic')
+    def test_handles_are_reused(self, mock_magic):
+        pool = MagicPool(size=1)
+        for i in range(3):
+            pool.file(self.path)
+
+        self.assertEqual(1, mock_magic.open.call_count)
+        handle = mock_magic.open.return_value
+        self.assertEqual(1, handle.load.call_count)
+        self.assertEqual(3, handle.file.call_count)
+        self.assertFalse(handle.close.called)
+
+    def test_unchanged_files_are_not_read_again(self):
+        pool = mock.Mock()
+        pool.file.return_value = 'data'
+        cache = FileTypeCache(pool)
+
+        self.assertEqual('data', cache.get_type(self.path))
+        self.assertEqual('data', cache.get_type(self.path))
+        self.assertEqual(1, pool.file.call_count)
+
+        # changed files are read again
+        with open(self.path, 'ab') as fd:
+            fd.write(b'more data')
+        cache.get_type(self.path)
+        self.assertEqual(2, pool.file.call_count)
+
+    def test_lru_eviction(self):
+        pool = mock.Mock()
+        pool.file.return_value = 'data'
+        cache = FileTypeCache(pool, size=1)
+
+        fd, other = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, other)
+
+        cache.get_type(self.path)
+        cache.get_type(other)
+        cache.get_type(self.path)
+        self.assertEqual(3, pool.file.call_count)
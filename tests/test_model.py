@@ -43,14 +43,18 @@ from wok.exception import InvalidOperation
 from wok.exception import InvalidParameter
 from wok.exception import NotFoundError
 from wok.exception import OperationFailed
+from wok.plugins.kimchi import isoinfo
 from wok.plugins.kimchi import network as netinfo
 from wok.plugins.kimchi import osinfo
 from wok.plugins.kimchi.config import kimchiPaths as paths
 from wok.plugins.kimchi.model import model
 from wok.plugins.kimchi.model.libvirtconnection import LibvirtConnection
+from wok.plugins.kimchi.model.utils import DomainView
 from wok.plugins.kimchi.model.virtviewerfile import FirewallManager
 from wok.plugins.kimchi.model.virtviewerfile import VMVirtViewerFileModel
 from wok.plugins.kimchi.model.vms import VMModel
+from wok.plugins.kimchi.xmlutils.disk import get_vm_disk_info
+from wok.plugins.kimchi.xmlutils.disk import get_vm_disks
 from wok.rollbackcontext import RollbackContext
 from wok.utils import convert_data_size
 from wok.xmlutils.utils import xpath_get_text
@@ -199,6 +203,13 @@ class ModelTests(unittest.TestCase):
         self.assertEqual([], info['groups'])
         self.assertTrue(info['persistent'])
 
+        full_list = inst.vms_get_full_list()
+        self.assertEqual(1, len(full_list))
+        self.assertEqual(keys, set(full_list[0].keys()))
+        for key in ('name', 'state', 'uuid', 'memory', 'cpu_info', 'graphics',
+                    'users', 'groups', 'persistent', 'autostart'):
+            self.assertEqual(info[key], full_list[0][key])
+
     @unittest.skipUnless(
         utils.running_as_root() and os.uname()[
             4] != 's390x', 'Must be run as root'
@@ -1667,6 +1678,43 @@ class ModelTests(unittest.TestCase):
         self.assertEqual(expected_topology,
                          inst.vm_get_vm_cpu_topology(FakeDom()))
 
+    def test_get_vm_cpu_topology_single_fetch(self):
+        dom = mock.Mock()
+        dom.XMLDesc.return_value = """<domain type='kvm'>\
+<cpu><topology sockets='3' cores='2' threads='8'/></cpu>\
+</domain>"""
+
+        inst = model.Model(None, objstore_loc=self.tmp_store)
+        self.assertEqual({'sockets': 3, 'cores': 2, 'threads': 8},
+                         inst.vm_get_vm_cpu_topology(dom))
+        # has_topology() and the topology values share the same XML
+        dom.XMLDesc.assert_called_once_with(0)
+
+    def test_domain_view(self):
+        dom = mock.Mock()
+        dom.XMLDesc.return_value = """<domain type='kvm'>\
+<name>fakedom</name><cpu><topology sockets='1' cores='2' threads='4'/></cpu>\
+<devices><disk type='file' device='disk'><driver name='qemu' type='qcow2'/>\
+<source file='/var/lib/libvirt/images/fakedom.img'/>\
+<target dev='vda' bus='virtio'/></disk>\
+<interface type='network'><target dev='vnet0'/></interface>\
+<video><model type='vga'/></video></devices></domain>"""
+
+        view = DomainView(dom)
+        self.assertEqual(['2'], view.xpath('./cpu/topology/@cores'))
+        self.assertEqual(['vda'], view.get_targets('disk'))
+        self.assertEqual(['vnet0'], view.get_targets('interface'))
+        self.assertTrue(view.has_device('video'))
+        self.assertFalse(view.has_device('graphics'))
+        self.assertEqual('', view.get_metadata_node('access'))
+        self.assertEqual({'vda': 'virtio'}, get_vm_disks(dom, view.root))
+        self.assertEqual(
+            '/var/lib/libvirt/images/fakedom.img',
+            get_vm_disk_info(dom, 'vda', view.root)['path'],
+        )
+        # the XML is fetched and parsed only once
+        dom.XMLDesc.assert_called_once_with(libvirt.VIR_DOMAIN_XML_SECURE)
+
     @mock.patch('wok.plugins.kimchi.model.vms.VMModel.has_topology')
     def test_get_vm_cpu_topology_blank(self, mock_has_topology):
         class FakeDom:
@@ -1920,6 +1968,15 @@ class ModelTests(unittest.TestCase):
             # (and removed) above (i.e. 'name' and 'uuid')
             self.assertEqual(original_vm, clone_vm)
 
+            # create a linked clone
+            task = inst.vm_clone(name, linked=True)
+            linked_name = task['target_uri'].split('/')[-2]
+            rollback.prependDefer(inst.vm_delete, linked_name)
+            inst.task_wait(task['id'])
+            task = inst.task_lookup(task['id'])
+            self.assertEqual('finished', task['status'])
+            self.assertIn(linked_name, inst.vms_get_list())
+
     def test_use_test_host(self):
         inst = model.Model('test:///default', objstore_loc=self.tmp_store)
 
@@ -1986,6 +2043,223 @@ class ModelTests(unittest.TestCase):
             volumes = inst.storagevolumes_get_list(args['name'])
             self.assertEqual(len(volumes), 2)
 
+    def test_probe_iso_cache(self):
+        with RollbackContext() as rollback:
+            scan_path = os.path.join(TMP_DIR, 'probe-iso-cache')
+            ignore_path = os.path.join(scan_path, 'ignored')
+            os.makedirs(ignore_path)
+            rollback.prependDefer(shutil.rmtree, scan_path)
+            construct_fake_iso(
+                os.path.join(scan_path, 'ubuntu.iso'), True, '14.04', 'ubuntu')
+            construct_fake_iso(
+                os.path.join(ignore_path, 'sles.iso'), True, '10', 'sles')
+
+            cache = {}
+            params = {'path': scan_path, 'ignore_list': [ignore_path],
+                      'cache': cache}
+            found = []
+            params['updater'] = found.append
+            isoinfo.probe_iso(None, params)
+            self.assertEqual(
+                [('ubuntu', '14.04')],
+                [(iso['distro'], iso['version']) for iso in found]
+            )
+
+            # unchanged files are not read again
+            found[:] = []
+            with mock.patch('wok.plugins.kimchi.isoinfo.IsoImage') as mock_iso:
+                isoinfo.probe_iso(None, params)
+                self.assertFalse(mock_iso.called)
+            self.assertEqual(1, len(found))
+
+    def test_iso_probe_lru_cache(self):
+        with RollbackContext() as rollback:
+            iso_path = os.path.join(TMP_DIR, 'probe-lru')
+            os.makedirs(iso_path)
+            rollback.prependDefer(shutil.rmtree, iso_path)
+            ubuntu = os.path.join(iso_path, 'ubuntu.iso')
+            sles = os.path.join(iso_path, 'sles.iso')
+            construct_fake_iso(ubuntu, True, '14.04', 'ubuntu')
+            construct_fake_iso(sles, True, '10', 'sles')
+
+            cache = isoinfo.IsoProbeCache(size=1)
+            info = cache.get_info(ubuntu)
+            self.assertEqual(('ubuntu', '14.04'),
+                             (info['distro'], info['version']))
+            self.assertTrue(info['bootable'])
+
+            # unchanged files are not read again
+            with mock.patch('wok.plugins.kimchi.isoinfo.IsoImage') as mock_iso:
+                self.assertEqual(info, cache.get_info(ubuntu))
+                self.assertFalse(mock_iso.called)
+
+            # the least recently used entry is evicted
+            self.assertEqual('sles', cache.get_info(sles)['distro'])
+            with mock.patch('wok.plugins.kimchi.isoinfo.IsoImage') as mock_iso:
+                mock_iso.return_value.probe.return_value = ('ubuntu', '14.04')
+                cache.get_info(ubuntu)
+                self.assertTrue(mock_iso.called)
+
+            # changed files are read again
+            construct_fake_iso(sles, True, '14.04', 'ubuntu')
+            os.utime(sles, ns=(0, 0))
+            self.assertEqual('ubuntu', cache.get_info(sles)['distro'])
+
+    def _open_counted(self, opened):
+        def _open(path, mode):
+            fd = mock.Mock(wraps=builtins.open(path, mode))
+            opened.append(fd)
+            return fd
+
+        return mock.patch('wok.plugins.kimchi.isoinfo.open', create=True,
+                          side_effect=_open)
+
+    def test_iso_probe_single_read(self):
+        samples = [
+            ('ubuntu', '14.04'),
+            ('fedora', '17'),
+            ('sles', '10'),
+            ('opensuse', '11.3'),
+            ('rhel', '4.8'),
+            ('openbsd', '5.0'),
+            ('windows', '2008r2'),
+        ]
+        with RollbackContext() as rollback:
+            iso_path = os.path.join(TMP_DIR, 'probe-single-read')
+            os.makedirs(iso_path)
+            rollback.prependDefer(shutil.rmtree, iso_path)
+
+            for distro, version in samples:
+                path = os.path.join(iso_path, f'{distro}.iso')
+                construct_fake_iso(path, True, version, distro)
+                opened = []
+                with self._open_counted(opened):
+                    iso = isoinfo.IsoImage(path)
+
+                self.assertEqual((distro, version), iso.probe())
+                # the whole header is read at once and the file closed
+                self.assertEqual(1, len(opened))
+                opened[0].read.assert_called_once_with(
+                    isoinfo.IsoImage.HEADER_SIZE)
+                opened[0].close.assert_called_once_with()
+
+    def test_iso_reads_share_file(self):
+        with RollbackContext() as rollback:
+            iso_path = os.path.join(TMP_DIR, 'probe-share-file')
+            os.makedirs(iso_path)
+            rollback.prependDefer(shutil.rmtree, iso_path)
+            path = os.path.join(iso_path, 'ubuntu.iso')
+            construct_fake_iso(path, True, '14.04', 'ubuntu')
+            iso = isoinfo.IsoImage(path)
+
+            # the reads out of the header reuse the same file until closed
+            opened = []
+            with self._open_counted(opened):
+                first = iso._get_iso_data(16 * iso.SECTOR_SIZE, 6)
+                second = iso._get_iso_data(17 * iso.SECTOR_SIZE, 6)
+                iso._close()
+                iso._close()
+
+            self.assertEqual(b'\x01CD001', first)
+            self.assertEqual(b'\x00CD001', second)
+            self.assertEqual(1, len(opened))
+            opened[0].close.assert_called_once_with()
+            self.assertIsNone(iso._fd)
+
+    def _remote_iso(self, data, status, mock_http):
+        response = mock_http.return_value.getresponse.return_value
+        response.status = status
+        if status == 206:
+            response.read.return_value = data
+        else:
+            response.read.side_effect = lambda size=None: data[:size]
+
+        with mock.patch('wok.plugins.kimchi.isoinfo.check_url_path',
+                        return_value=True):
+            return isoinfo.IsoImage('http://example.com/isos/ubuntu.iso')
+
+    def _iso_data(self, rollback):
+        iso_path = os.path.join(TMP_DIR, 'probe-remote')
+        os.makedirs(iso_path)
+        rollback.prependDefer(shutil.rmtree, iso_path)
+        path = os.path.join(iso_path, 'ubuntu.iso')
+        construct_fake_iso(path, True, '14.04', 'ubuntu')
+        with open(path, 'rb') as fd:
+            return fd.read()
+
+    @mock.patch('wok.plugins.kimchi.isoinfo.HTTPConnection')
+    def test_remote_iso_range(self, mock_http):
+        with RollbackContext() as rollback:
+            data = self._iso_data(rollback)
+            iso = self._remote_iso(data, 206, mock_http)
+
+        self.assertEqual(('ubuntu', '14.04'), iso.probe())
+        mock_http.assert_called_once_with('example.com', timeout=15)
+        http = mock_http.return_value
+        http.request.assert_called_once_with(
+            'GET', '/isos/ubuntu.iso',
+            headers={'Range': 'bytes=0-%d' % (iso.HEADER_SIZE - 1)}
+        )
+        http.close.assert_called_once_with()
+        self.assertIsNone(iso._http)
+
+    @mock.patch('wok.plugins.kimchi.isoinfo.HTTPConnection')
+    def test_remote_iso_without_range(self, mock_http):
+        with RollbackContext() as rollback:
+            data = self._iso_data(rollback)
+            iso = self._remote_iso(data, 200, mock_http)
+
+        self.assertEqual(('ubuntu', '14.04'), iso.probe())
+        # only the header is read before dropping the connection
+        response = mock_http.return_value.getresponse.return_value
+        response.read.assert_called_once_with(iso.HEADER_SIZE)
+        mock_http.return_value.close.assert_called_once_with()
+
+    @mock.patch('urllib.request.urlopen')
+    @mock.patch('wok.plugins.kimchi.isoinfo.HTTPConnection')
+    def test_remote_iso_urllib_fallback(self, mock_http, mock_urlopen):
+        with RollbackContext() as rollback:
+            data = self._iso_data(rollback)
+            mock_urlopen.return_value.read.return_value = data
+            # redirections are followed by urllib
+            iso = self._remote_iso(data, 302, mock_http)
+
+        self.assertEqual(('ubuntu', '14.04'), iso.probe())
+        mock_http.return_value.close.assert_called_once_with()
+        request = mock_urlopen.call_args[0][0]
+        self.assertEqual('http://example.com/isos/ubuntu.iso',
+                         request.full_url)
+        self.assertEqual('bytes=0-%d' % (iso.HEADER_SIZE - 1),
+                         request.get_header('Range'))
+
+    def test_iso_any_matcher(self):
+        iso = isoinfo.IsoImage.__new__(isoinfo.IsoImage)
+        iso.path = 'unknown.iso'
+        iso.bootable = True
+
+        # unknown Volume IDs are not matched against every entry
+        iso.volume_id = 'NOT A KNOWN OS'
+        with mock.patch.object(isoinfo, 'iso_matchers') as mock_matchers:
+            self.assertEqual(('unknown', 'unknown'), iso.probe())
+            self.assertFalse(mock_matchers.__iter__.called)
+
+        # the first matching entry wins, as when matching each regex in turn
+        for volume_id in ['Fedora-WS-Live-x86_64-25-1', 'RHEL/4-U8',
+                          'openSUSE-Leap-42.2', 'SLES-11-SP4-DVD',
+                          'Ubuntu-Server 16.04']:
+            expected = ('unknown', 'unknown')
+            for distro, version, regex in isoinfo.iso_dir:
+                match = re.search(regex, volume_id)
+                if match:
+                    if hasattr(version, '__call__'):
+                        version = version(match)
+                    expected = (distro, version)
+                    break
+
+            iso.volume_id = volume_id
+            self.assertEqual(expected, iso.probe())
+            self.assertNotEqual(('unknown', 'unknown'), expected)
+
     def _host_is_power():
         return platform.machine().startswith('ppc')
 
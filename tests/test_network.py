@@ -0,0 +1,196 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import ipaddress
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from wok.plugins.kimchi import network as netinfo
+from wok.plugins.kimchi.utils import TTLCache
+
+
+OVS_OUTPUT = '\n'.join([
+    json.dumps({
+        'headings': ['name', 'ports'],
+        'data': [['ovsbr0', ['set', [['uuid', 'p0'], ['uuid', 'p1']]]]],
+    }),
+    json.dumps({
+        'headings': ['_uuid', 'name'],
+        'data': [[['uuid', 'p0'], 'ovsbr0'], [['uuid', 'p1'], 'eth3']],
+    }),
+])
+
+
+class NetInfoSnapshotTests(unittest.TestCase):
+    def _iface(self, name, files=(), dirs=(), flags='0x1003'):
+        path = os.path.join(self.net_path, name)
+        os.makedirs(path)
+        for d in dirs:
+            os.makedirs(os.path.join(path, d))
+        for f, content in files:
+            with open(os.path.join(path, f), 'w') as fd:
+                fd.write(content)
+        with open(os.path.join(path, 'flags'), 'w') as fd:
+            fd.write(flags + '\n')
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.net_path = os.path.join(self.tmpdir, 'net')
+        vlan_path = os.path.join(self.tmpdir, 'vlan') + '/'
+        os.makedirs(vlan_path)
+
+        # br0 --- bond0.10 --- bond0 --- eth1, eth2
+        self._iface('eth0', [('device', '')])
+        self._iface('eth1', [('device', ''), ('master', '')])
+        self._iface('eth2', [('device', ''), ('master', '')])
+        self._iface('eth3', [('device', '')], flags='0x1002')
+        self._iface('wlan0', [('device', '')], ['wireless'])
+        self._iface('bond0', [('bonding/slaves', 'eth1 eth2\n')], ['bonding'])
+        self._iface('bond0.10', [('brport', '')])
+        self._iface('br0', [], ['bridge', 'brif/bond0.10'])
+        self._iface('virbr0', [], ['bridge', 'brif'])
+        with open(vlan_path + 'bond0.10', 'w') as fd:
+            fd.write('bond0.10  VID: 10\t REORDER_HDR: 1\n'
+                     'Device: bond0\n')
+
+        patches = [
+            mock.patch.multiple(
+                netinfo,
+                NET_PATH=self.net_path,
+                NET_BRPORT=self.net_path + '/%s/brport',
+                NET_MASTER=self.net_path + '/%s/master',
+                BONDING_SLAVES=self.net_path + '/%s/bonding/slaves',
+                BRIDGE_PORTS=self.net_path + '/%s/brif',
+                PROC_NET_VLAN=vlan_path,
+                _netinfo=TTLCache(
+                    netinfo.NetInfoSnapshot, netinfo.NETINFO_TTL),
+            ),
+            mock.patch.object(
+                netinfo, 'find_executable', return_value='/bin/ovs-vsctl'),
+            mock.patch.object(netinfo, 'ethtool'),
+            mock.patch.object(netinfo, 'run_command'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        netinfo.ethtool.IFF_UP = 0x1
+        netinfo.ethtool.IFF_RUNNING = 0x40
+        eth0 = mock.Mock(device='eth0', mac_address='52:54:00:00:00:01',
+                         ipv4_address='192.168.1.10', ipv4_netmask=24)
+        netinfo.ethtool.get_interfaces_info.return_value = [eth0]
+        # systemctl is-active openvswitch, then ovs-vsctl
+        netinfo.run_command.side_effect = [['', '', 0], [OVS_OUTPUT, '', 0]]
+
+    def test_interfaces(self):
+        self.assertEqual(
+            ['eth0', 'eth1', 'eth2', 'eth3'], sorted(netinfo.nics()))
+        self.assertEqual(['wlan0'], netinfo.wlans())
+        self.assertEqual(['bond0'], netinfo.bondings())
+        self.assertEqual(['bond0.10'], netinfo.vlans())
+        self.assertEqual('bond0', netinfo.get_vlan_device('bond0.10'))
+        self.assertEqual(['eth1', 'eth2'], netinfo.slaves('bond0'))
+        self.assertEqual(
+            ['br0', 'ovsbr0', 'virbr0'], sorted(netinfo.bridges()))
+        self.assertEqual(['ovsbr0'], netinfo.ovs_bridges())
+        self.assertEqual(['eth3'], netinfo.ports('ovsbr0'))
+        self.assertEqual('vlan', netinfo.get_interface_type('bond0.10'))
+        self.assertEqual('unknown', netinfo.get_interface_type('lo'))
+        self.assertEqual('up', netinfo.operstate('eth0'))
+        self.assertEqual('down', netinfo.operstate('eth3'))
+
+    def test_favored_interfaces(self):
+        self.assertEqual(
+            ['eth1', 'eth2', 'bond0.10'], netinfo.get_bridge_port_device('br0'))
+        self.assertEqual(['eth0'], netinfo.bare_nics())
+        self.assertTrue(netinfo.is_bare_nic('eth0'))
+        self.assertFalse(netinfo.is_bare_nic('eth3'))
+        # virbr0 has no nic among its ports
+        self.assertEqual(
+            ['bond0', 'br0', 'eth0', 'ovsbr0'],
+            sorted(netinfo.all_favored_interfaces()),
+        )
+
+    def test_addresses(self):
+        self.assertEqual('52:54:00:00:00:01', netinfo.get_dev_macaddr('eth0'))
+        self.assertEqual('192.168.1.10/24', netinfo.get_dev_netaddr('eth0'))
+        self.assertEqual(
+            ['192.168.1.0/24'], [str(n) for n in netinfo.get_dev_netaddrs()])
+
+    def test_single_pass(self):
+        for iface in netinfo.all_interfaces():
+            netinfo.get_interface_type(iface)
+            netinfo.is_bare_nic(iface)
+        netinfo.all_favored_interfaces()
+        self.assertEqual(2, netinfo.run_command.call_count)
+        self.assertEqual(1, netinfo.ethtool.get_interfaces_info.call_count)
+
+        netinfo.run_command.side_effect = [['', '', 3]]
+        netinfo.invalidate_netinfo()
+        self.assertEqual([], netinfo.ovs_bridges())
+        self.assertEqual(3, netinfo.run_command.call_count)
+
+
+class SubnetAllocatorTests(unittest.TestCase):
+    def _net(self, net):
+        return ipaddress.IPv4Network(net, False)
+
+    def test_find_free(self):
+        allocator = netinfo.SubnetAllocator([
+            self._net('192.168.0.0/24'),
+            self._net('192.168.1.128/25'),
+            self._net('192.168.2.0/23'),
+            self._net('192.168.5.1/24'),
+        ])
+        pool = self._net('192.168.0.0/16')
+        self.assertEqual(
+            self._net('192.168.4.0/24'), allocator.find_free(pool))
+        self.assertEqual(
+            self._net('192.168.1.0/25'), allocator.find_free(pool, 25))
+        self.assertEqual(
+            self._net('192.168.8.0/22'), allocator.find_free(pool, 22))
+
+        allocator.add(self._net('192.168.4.0/24'))
+        self.assertEqual(
+            self._net('192.168.6.0/24'), allocator.find_free(pool))
+
+        # the used ranges are merged
+        allocator.add(self._net('192.168.0.0/20'))
+        self.assertEqual([int(self._net('192.168.0.0/20')[0])],
+                         allocator._starts)
+
+    def test_pool_full(self):
+        allocator = netinfo.SubnetAllocator([self._net('10.0.0.0/8')])
+        self.assertIsNone(allocator.find_free(self._net('10.0.0.0/8')))
+        self.assertIsNone(
+            netinfo.SubnetAllocator().find_free(self._net('10.0.0.0/25')))
+
+    @mock.patch.object(netinfo, 'get_dev_netaddrs')
+    def test_get_one_free_network(self, mock_netaddrs):
+        mock_netaddrs.return_value = [self._net('192.168.122.1/24')]
+        used = [self._net('192.168.0.0/17'), self._net('192.168.128.0/17')]
+        self.assertEqual('172.16.0.0/24', netinfo.get_one_free_network(used))
+        self.assertEqual(
+            '192.168.123.0/24',
+            netinfo.get_one_free_network([], netinfo.DefaultNetsPool),
+        )
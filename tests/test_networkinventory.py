@@ -0,0 +1,87 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import libvirt
+from inventory_utils import fake_object
+from inventory_utils import InventoryTestCase
+from wok.plugins.kimchi.model.networkinventory import NetworkInventory
+
+
+NETWORK_XML = """
+<network>
+  <name>%(name)s</name>
+  <ip family='ipv6' address='2001:db8:ca2:2::1' prefix='64'/>
+  <ip address='%(address)s' netmask='255.255.255.0'/>
+</network>
+"""
+
+BRIDGE_XML = """
+<network>
+  <name>%(name)s</name>
+  <forward mode='bridge'/>
+  <bridge name='br0'/>
+</network>
+"""
+
+
+class NetworkInventoryTests(InventoryTestCase):
+    inventory_class = NetworkInventory
+    register_method = 'registerNetworkEvents'
+    list_method = 'listAllNetworks'
+    lookup_method = 'networkLookupByName'
+    not_found = libvirt.VIR_ERR_NO_NETWORK
+
+    def _net(self, name, address=None):
+        xml = NETWORK_XML if address else BRIDGE_XML
+        return fake_object(name, xml % {'name': name, 'address': address})
+
+    def get_objects(self):
+        return [self._net('default', '192.168.122.1'), self._net('bridged')]
+
+    def _subnets(self):
+        return sorted(str(net) for net in self.inventory.get_subnets())
+
+    def test_subnets(self):
+        self.assertEqual(['192.168.122.0/24'], self._subnets())
+
+    def test_network_events(self):
+        self._subnets()
+        self.events.registerNetworkEvents.assert_called_once_with(
+            self.conn, self.inventory._network_changed_cb, None
+        )
+
+        net = self._net('isolated', '10.0.0.1')
+        self.objects.append(net)
+        self.inventory._network_changed_cb(net, None)
+        self.assertEqual(['10.0.0.0/24', '192.168.122.0/24'], self._subnets())
+
+        # only the changed network is read again
+        vir_conn = self.conn.get.return_value
+        self.assertEqual(1, vir_conn.listAllNetworks.call_count)
+        self.assertEqual(1, self.objects[0].XMLDesc.call_count)
+
+        self.objects.remove(net)
+        self.inventory.invalidate('isolated')
+        self.assertEqual(['192.168.122.0/24'], self._subnets())
+
+    def test_no_events(self):
+        # without the events the inventory is built on every access
+        self.events.registerNetworkEvents.return_value = False
+        self._subnets()
+        self.objects.pop(0)
+        self.assertEqual([], self._subnets())
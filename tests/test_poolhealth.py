@@ -0,0 +1,95 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import unittest
+
+import mock
+from wok.plugins.kimchi.model.poolhealth import MAX_CHECK_INTERVAL
+from wok.plugins.kimchi.model.poolhealth import PoolHealthMonitor
+
+
+POOL_ARGS = {
+    'name': 'nfs-pool',
+    'type': 'netfs',
+    'source': {'path': '/export', 'host': 'nfs.example.com'},
+}
+
+
+class PoolHealthMonitorTests(unittest.TestCase):
+    def setUp(self):
+        self.monitor = PoolHealthMonitor(mock.Mock(), interval=60)
+        patcher = mock.patch(
+            'wok.plugins.kimchi.model.poolhealth.StoragePoolDef')
+        self.pool_def = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.prepare = self.pool_def.create.return_value.prepare
+
+    def _expire(self):
+        self.monitor._pools[POOL_ARGS['name']]['next'] = 0
+
+    def test_state_is_cached(self):
+        self.assertTrue(self.monitor.is_online(POOL_ARGS))
+        self.assertTrue(self.monitor.is_online(POOL_ARGS))
+        self.assertEqual(1, self.prepare.call_count)
+        self.assertTrue(self.monitor.get_status('nfs-pool')['online'])
+
+        # actions may ask for a new check
+        self.prepare.side_effect = Exception('unreachable')
+        self.assertFalse(self.monitor.is_online(POOL_ARGS, recheck=True))
+        self.assertFalse(self.monitor.is_online(POOL_ARGS))
+        self.assertEqual(2, self.prepare.call_count)
+
+    @mock.patch('time.monotonic', return_value=0)
+    def test_background_checks_back_off(self, monotonic):
+        self.prepare.side_effect = Exception('unreachable')
+        self.assertFalse(self.monitor.is_online(POOL_ARGS))
+        entry = self.monitor._pools['nfs-pool']
+        self.assertEqual(60, entry['next'])
+
+        # nothing is due yet
+        self.monitor._workers = mock.Mock()
+        self.monitor._workers.apply_async.side_effect = (
+            lambda func, args: func(*args))
+        self.monitor._run()
+        self.assertEqual(1, self.prepare.call_count)
+
+        # the delay doubles up to MAX_CHECK_INTERVAL while offline
+        delays = []
+        for i in range(5):
+            entry['next'] = 0
+            self.monitor._run()
+            delays.append(entry['next'])
+        self.assertEqual([120, 240, 480, MAX_CHECK_INTERVAL,
+                          MAX_CHECK_INTERVAL], delays)
+
+        # and is reset once the server is back
+        self.prepare.side_effect = None
+        entry['next'] = 0
+        self.monitor._run()
+        self.assertTrue(self.monitor.is_online(POOL_ARGS))
+        self.assertEqual(60, entry['next'])
+        self.assertEqual(7, self.prepare.call_count)
+
+    def test_changed_pool_is_checked_again(self):
+        self.monitor.is_online(POOL_ARGS)
+        args = dict(POOL_ARGS, source={'path': '/other', 'host': 'nfs'})
+        self.monitor.is_online(args)
+        self.assertEqual(2, self.prepare.call_count)
+
+        self.monitor.forget('nfs-pool')
+        self.assertIsNone(self.monitor.get_status('nfs-pool')['online'])
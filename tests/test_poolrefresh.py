@@ -0,0 +1,82 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import threading
+import unittest
+
+import mock
+from wok.plugins.kimchi.model.poolrefresh import PoolRefresher
+
+
+class PoolRefresherTests(unittest.TestCase):
+    def setUp(self):
+        self.pool = mock.Mock()
+        self.pool.name.return_value = 'default'
+        self.events = mock.Mock()
+        conn = mock.MagicMock()
+        vir_conn = conn.borrow.return_value.__enter__.return_value
+        vir_conn.storagePoolLookupByName.return_value = self.pool
+        self.refresher = PoolRefresher(conn, window=60)
+        self.refresher.watch(self.events)
+
+    def test_refresh_window(self):
+        self.refresher.refresh(self.pool)
+        self.refresher.refresh(self.pool)
+        self.assertEqual(1, self.pool.refresh.call_count)
+        self.assertEqual(1, self.events.registerPoolChangeEvents.call_count)
+
+        # refreshed again once invalidated
+        self.refresher.invalidate('default')
+        self.refresher.refresh(self.pool)
+        self.assertEqual(2, self.pool.refresh.call_count)
+
+        # lifecycle events invalidate the pool, refresh events do not
+        self.refresher._pool_changed_cb(self.pool, True, None)
+        self.refresher.refresh(self.pool)
+        self.assertEqual(2, self.pool.refresh.call_count)
+        self.refresher._pool_changed_cb(self.pool, False, None)
+        self.refresher.refresh(self.pool)
+        self.assertEqual(3, self.pool.refresh.call_count)
+
+    def test_concurrent_refreshes_are_coalesced(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def _refresh(flags):
+            started.set()
+            release.wait()
+
+        self.pool.refresh.side_effect = _refresh
+        threads = [
+            threading.Thread(target=self.refresher.refresh, args=(self.pool,))
+            for i in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        started.wait()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, self.pool.refresh.call_count)
+
+    def test_failed_refresh_is_retried(self):
+        self.pool.refresh.side_effect = [Exception('failed'), None]
+        self.assertRaises(Exception, self.refresher.refresh, self.pool)
+        self.refresher.refresh(self.pool)
+        self.assertEqual(2, self.pool.refresh.call_count)
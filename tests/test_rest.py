@@ -129,12 +129,38 @@ class RestTests(unittest.TestCase):
         vms = json.loads(self.request('/plugins/kimchi/vms').read())
         self.assertEqual(11, len(vms))
 
+        # The full listing must return the same VMs with the same keys
+        full_vms = json.loads(
+            self.request('/plugins/kimchi/vms?_full=1').read())
+        self.assertEqual(
+            sorted(vm['name'] for vm in vms),
+            sorted(vm['name'] for vm in full_vms)
+        )
+        for vm, full_vm in zip(
+            sorted(vms, key=lambda v: v['name']),
+            sorted(full_vms, key=lambda v: v['name'])
+        ):
+            self.assertEqual(set(vm.keys()), set(full_vm.keys()))
+            self.assertEqual(vm['uuid'], full_vm['uuid'])
+            self.assertEqual(vm['state'], full_vm['state'])
+            self.assertEqual(vm['memory'], full_vm['memory'])
+            self.assertEqual(vm['cpu_info'], full_vm['cpu_info'])
+
         vm = json.loads(self.request('/plugins/kimchi/vms/vm-1').read())
         self.assertEqual('vm-1', vm['name'])
         self.assertEqual('shutoff', vm['state'])
         self.assertEqual([], vm['users'])
         self.assertEqual([], vm['groups'])
 
+        # Statistics are only sampled for running VMs
+        stats = json.loads(
+            self.request('/plugins/kimchi/vms/vm-1/stats').read())
+        self.assertEqual(vm['stats'], stats)
+        history = json.loads(
+            self.request('/plugins/kimchi/vms/vm-1/stats/history').read())
+        self.assertIn('interval', history)
+        self.assertEqual([], history['samples'])
+
     def test_edit_vm_cpuhotplug(self):
         req = json.dumps(
             {
@@ -0,0 +1,88 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from PIL import Image
+from wok.plugins.kimchi import screenshot
+from wok.plugins.kimchi.screenshot import ThumbnailCache
+from wok.plugins.kimchi.screenshot import VMScreenshot
+
+
+class FakeScreenshot(VMScreenshot):
+    color = 'blue'
+
+    def _generate_scratch(self, thumbnail):
+        Image.new('RGB', (640, 480), self.color).save(thumbnail, 'PPM')
+
+
+class ScreenshotTests(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        patchers = [
+            mock.patch('wok.plugins.kimchi.config.get_screenshot_path',
+                       return_value=self.path),
+            mock.patch.object(screenshot, 'stream_test_result', True),
+            mock.patch.object(screenshot, 'thumbnail_cache', ThumbnailCache()),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_unchanged_frame_is_not_encoded_again(self):
+        shot = FakeScreenshot({'uuid': 'vm-uuid'})
+        shot.lookup()
+        first = shot.info['thumbnail']
+        image = shot.get_image()
+        self.assertEqual(open(first, 'rb').read(), image['data'])
+
+        with mock.patch.object(Image, 'open') as image_open:
+            shot._generate_thumbnail()
+            self.assertFalse(image_open.called)
+        self.assertEqual(first, shot.info['thumbnail'])
+        self.assertEqual([os.path.basename(first)], os.listdir(self.path))
+
+        FakeScreenshot.color = 'red'
+        self.addCleanup(setattr, FakeScreenshot, 'color', 'blue')
+        shot._generate_thumbnail()
+        self.assertNotEqual(first, shot.info['thumbnail'])
+        self.assertNotEqual(image['etag'], shot.get_image()['etag'])
+
+    def test_outdated_thumbnail_is_refreshed_in_background(self):
+        shot = FakeScreenshot({'uuid': 'vm-uuid'})
+        shot.lookup()
+
+        with mock.patch.object(screenshot.thumbnail_cache, 'refresh') as refresh:
+            shot.lookup()
+            self.assertFalse(refresh.called)
+
+            with mock.patch('time.time', return_value=float('inf')):
+                shot.lookup()
+            refresh.assert_called_once_with(shot)
+
+    def test_lru(self):
+        cache = ThumbnailCache(size=2)
+        for vm_uuid in ['vm-1', 'vm-2', 'vm-3']:
+            cache.store(vm_uuid, f'/tmp/{vm_uuid}.png', b'png', 'frame')
+        self.assertIsNone(cache.get('vm-1'))
+        self.assertEqual('/tmp/vm-3.png', cache.get('vm-3')['path'])
@@ -0,0 +1,123 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+import libvirt
+import mock
+from wok.plugins.kimchi import serialconsole
+from wok.plugins.kimchi.serialconsole import ConsoleServer
+
+
+class FakeStream(object):
+    def __init__(self):
+        self.output = []
+        self.input = b''
+        self.cb = None
+
+    def eventAddCallback(self, events, cb, opaque):
+        self.cb = (cb, opaque)
+
+    def eventUpdateCallback(self, events):
+        pass
+
+    def eventRemoveCallback(self):
+        self.cb = None
+
+    def abort(self):
+        pass
+
+    def recv(self, size):
+        if not self.output:
+            return -2
+        return self.output.pop(0)
+
+    def send(self, data):
+        self.input += data
+        # the guest echoes what it receives
+        self.output.append(data)
+        cb, opaque = self.cb
+        cb(self, libvirt.VIR_STREAM_EVENT_READABLE, opaque)
+        return len(data)
+
+
+class ConsoleServerTests(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        patcher = mock.patch.object(
+            serialconsole, 'BASE_DIRECTORY', self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.stream = FakeStream()
+        self.dom = mock.Mock()
+        self.dom.state.return_value = [libvirt.VIR_DOMAIN_RUNNING, 0]
+        conn = mock.Mock()
+        conn.get.return_value.newStream.return_value = self.stream
+        self.server = ConsoleServer(conn)
+
+        patcher = mock.patch('wok.plugins.kimchi.model.vms.VMModel.get_vm',
+                             return_value=self.dom)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _connect(self, name):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(os.path.join(self.path, name))
+        client.settimeout(5)
+        self.addCleanup(client.close)
+        return client
+
+    def _wait_closed(self, name):
+        for i in range(50):
+            if name not in self.server._sessions:
+                return
+            time.sleep(0.1)
+        self.fail(f'Console of {name} is still open')
+
+    def test_console_is_forwarded(self):
+        self.assertTrue(self.server.open('guest'))
+        self.assertRaises(RuntimeError, self.server.open, 'guest')
+
+        client = self._connect('guest')
+        # the answer to the listening test is kept for the client
+        self.assertEqual(b'\n', client.recv(1024))
+        client.sendall(b'ls\n')
+        self.assertEqual(b'ls\n', client.recv(1024))
+        self.assertEqual(b'\nls\n', self.stream.input)
+
+        client.sendall(serialconsole.CTRL_Q)
+        self._wait_closed('guest')
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'guest')))
+
+    def test_guest_shutdown_closes_console(self):
+        self.assertTrue(self.server.open('guest'))
+        self.dom.state.return_value = [libvirt.VIR_DOMAIN_SHUTOFF, 0]
+        self._wait_closed('guest')
+
+    def test_guest_not_listening(self):
+        self.stream.send = mock.Mock(return_value=1)
+        self.assertFalse(self.server.open('guest'))
+        self.assertEqual({}, self.server._sessions)
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'guest')))
@@ -0,0 +1,308 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import io
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+import libvirt
+import mock
+from wok.exception import OperationFailed
+from wok.plugins.kimchi.model.storagevolumes import reap_stale_uploads
+from wok.plugins.kimchi.model.storagevolumes import StorageVolumeModel
+from wok.plugins.kimchi.model.storagevolumes import UPLOAD_BLOCK_SIZE
+from wok.plugins.kimchi.model.storagevolumes import upload_volumes
+from wok.plugins.kimchi.model.storagevolumes import URLDownload
+from wok.plugins.kimchi.model.storagevolumes import VolumeUpload
+
+
+URL = 'http://example.com/disk.img'
+DATA = b'0123456789'
+
+
+class FakeResponse(object):
+    """
+    HTTP response returning <data> and then an end of file, as if the
+    connection was closed, unless <error> is given to be raised instead.
+    """
+
+    def __init__(self, data, status=200, headers=None, chunked=False,
+                 error=None):
+        self.data = data
+        self.status = status
+        self.headers = headers or {}
+        self.chunked = chunked
+        self.error = error
+        self.closed = False
+
+    def readinto(self, buf):
+        if not self.data:
+            if self.error is not None:
+                raise self.error
+            return 0
+        nbytes = min(len(buf), len(self.data))
+        buf[:nbytes] = self.data[:nbytes]
+        self.data = self.data[nbytes:]
+        return nbytes
+
+    def close(self):
+        self.closed = True
+
+
+def _range_not_satisfiable(total):
+    return urllib.error.HTTPError(
+        URL, 416, 'Range Not Satisfiable',
+        {'Content-Range': f'bytes */{total}'}, None
+    )
+
+
+@mock.patch('wok.plugins.kimchi.model.storagevolumes.urllib.request.urlopen')
+class URLDownloadTests(unittest.TestCase):
+    def _download(self, mock_urlopen, responses, retries=2):
+        ranges = []
+
+        def _urlopen(request, timeout):
+            ranges.append(request.get_header('Range'))
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        mock_urlopen.side_effect = _urlopen
+        download = URLDownload(URL, chunk_size=4, retries=retries)
+        download.open()
+        data = b''.join(bytes(chunk) for chunk in download)
+        return download, data, ranges
+
+    def test_complete(self, mock_urlopen):
+        download, data, ranges = self._download(mock_urlopen, [
+            FakeResponse(DATA, headers={'Content-Length': '10'}),
+        ])
+        self.assertEqual(DATA, data)
+        self.assertEqual(10, download.size)
+        self.assertEqual([None], ranges)
+
+    def test_resume(self, mock_urlopen):
+        download, data, ranges = self._download(mock_urlopen, [
+            FakeResponse(DATA[:4], headers={'Content-Length': '10'}),
+            FakeResponse(DATA[4:], status=206),
+        ])
+        self.assertEqual(DATA, data)
+        self.assertEqual([None, 'bytes=4-'], ranges)
+
+    def test_resume_not_supported(self, mock_urlopen):
+        self.assertRaises(IOError, self._download, mock_urlopen, [
+            FakeResponse(DATA[:4], headers={'Content-Length': '10'}),
+            FakeResponse(DATA, status=200),
+            FakeResponse(DATA, status=200),
+            FakeResponse(DATA, status=200),
+        ])
+
+    def test_retries(self, mock_urlopen):
+        # each resumed response brings new data, so the retries are reset
+        download, data, ranges = self._download(mock_urlopen, [
+            FakeResponse(DATA[:4], headers={'Content-Length': '10'}),
+            urllib.error.URLError('timed out'),
+            FakeResponse(DATA[4:8], status=206),
+            urllib.error.URLError('timed out'),
+            FakeResponse(DATA[8:], status=206),
+        ], retries=2)
+        self.assertEqual(DATA, data)
+        self.assertEqual(
+            [None, 'bytes=4-', 'bytes=4-', 'bytes=8-', 'bytes=8-'], ranges)
+
+    def test_retries_exhausted(self, mock_urlopen):
+        responses = [
+            FakeResponse(DATA[:4], headers={'Content-Length': '10'}),
+            urllib.error.URLError('timed out'),
+            urllib.error.URLError('timed out'),
+            urllib.error.URLError('timed out'),
+        ]
+        self.assertRaises(
+            IOError, self._download, mock_urlopen, responses, retries=2)
+        # the first request and 2 retries
+        self.assertEqual(1, len(responses))
+
+    def test_chunked_without_length(self, mock_urlopen):
+        download, data, ranges = self._download(mock_urlopen, [
+            FakeResponse(DATA, chunked=True),
+        ])
+        self.assertEqual(DATA, data)
+        self.assertIsNone(download.size)
+        self.assertEqual([None], ranges)
+
+    def test_without_length_complete(self, mock_urlopen):
+        download, data, ranges = self._download(mock_urlopen, [
+            FakeResponse(DATA),
+            _range_not_satisfiable(10),
+        ])
+        self.assertEqual(DATA, data)
+        self.assertEqual(10, download.size)
+        self.assertEqual([None, 'bytes=10-'], ranges)
+
+    def test_without_length_truncated(self, mock_urlopen):
+        download, data, ranges = self._download(mock_urlopen, [
+            FakeResponse(DATA[:4]),
+            FakeResponse(DATA[4:], status=206,
+                         headers={'Content-Range': 'bytes 4-9/10'}),
+            FakeResponse(DATA[4:], status=206,
+                         headers={'Content-Range': 'bytes 4-9/10'}),
+        ])
+        self.assertEqual(DATA, data)
+        self.assertEqual(10, download.size)
+        self.assertEqual([None, 'bytes=4-', 'bytes=4-'], ranges)
+
+    def test_without_length_unverifiable(self, mock_urlopen):
+        # the server ignores the Range header
+        self.assertRaises(IOError, self._download, mock_urlopen, [
+            FakeResponse(DATA[:4]),
+            FakeResponse(DATA),
+        ])
+
+
+SPARSE_FLAG = 'VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM'
+
+
+class VolumeUploadTests(unittest.TestCase):
+    def setUp(self):
+        self.conn = mock.Mock()
+        self.stream = self.conn.get.return_value.newStream.return_value
+        self.stream.send.side_effect = len
+        self.vol = mock.Mock()
+
+    def _sent(self):
+        return b''.join(c[0][0] for c in self.stream.send.call_args_list)
+
+    def test_single_stream(self):
+        with mock.patch.object(libvirt, SPARSE_FLAG, 0, create=True):
+            upload = VolumeUpload(self.conn, self.vol, 0, 20)
+            upload.send(io.BytesIO(b'0123456789'), 10)
+            upload.send(io.BytesIO(bytes(10)), 10)
+            upload.finish()
+
+        # a single stream for all the chunks
+        self.conn.get.return_value.newStream.assert_called_once_with(0)
+        self.vol.upload.assert_called_once_with(self.stream, 0, 20, 0)
+        self.assertFalse(upload.sparse)
+        self.assertEqual(b'0123456789' + bytes(10), self._sent())
+        self.stream.sendHole.assert_not_called()
+        self.stream.finish.assert_called_once_with()
+
+    def test_sparse_stream(self):
+        data = b'x' * UPLOAD_BLOCK_SIZE + bytes(2 * UPLOAD_BLOCK_SIZE) + b'y'
+        with mock.patch.object(libvirt, SPARSE_FLAG, 1, create=True):
+            upload = VolumeUpload(self.conn, self.vol, 0, len(data) + 10)
+            upload.send(io.BytesIO(data), len(data))
+            # a chunk ending with zeros ends with a hole
+            upload.send(io.BytesIO(bytes(10)), 10)
+
+        self.assertTrue(upload.sparse)
+        self.vol.upload.assert_called_once_with(
+            self.stream, 0, len(data) + 10, 1)
+        self.assertEqual(b'x' * UPLOAD_BLOCK_SIZE + b'y', self._sent())
+        self.assertEqual(
+            [mock.call(2 * UPLOAD_BLOCK_SIZE), mock.call(10)],
+            self.stream.sendHole.call_args_list
+        )
+
+    def test_sparse_not_supported(self):
+        self.vol.upload.side_effect = [libvirt.libvirtError('no sparse'),
+                                       None]
+        with mock.patch.object(libvirt, SPARSE_FLAG, 1, create=True):
+            upload = VolumeUpload(self.conn, self.vol, 0, 10)
+
+        self.assertFalse(upload.sparse)
+        self.stream.abort.assert_called_once_with()
+        self.assertEqual(mock.call(self.stream, 0, 10, 0),
+                         self.vol.upload.call_args)
+
+
+class StorageVolumeUploadTests(unittest.TestCase):
+    def setUp(self):
+        self.model = StorageVolumeModel.__new__(StorageVolumeModel)
+        self.model.conn = mock.Mock()
+        self.stream = self.model.conn.get.return_value.newStream.return_value
+        self.vol = mock.Mock()
+        self.vol.path.return_value = '/var/lib/libvirt/images/upload.img'
+        self.vol.info.return_value = [0, 20, 0]
+        self.cb = mock.Mock()
+        self.vol_data = {
+            'lock': threading.Lock(),
+            'offset': 0,
+            'cb': self.cb,
+            'expected_vol_size': 20,
+            'upload': None,
+            'last': 0,
+        }
+        upload_volumes[self.vol.path()] = self.vol_data
+        self.addCleanup(upload_volumes.clear)
+
+    @mock.patch.object(libvirt, SPARSE_FLAG, 0, create=True)
+    def test_abort_and_delete_on_error(self):
+        self.stream.send.side_effect = libvirt.libvirtError('broken pipe')
+        self.assertRaises(
+            OperationFailed, self.model.doUpload, self.cb, self.vol,
+            self.vol_data, io.BytesIO(b'0123456789'), 10
+        )
+
+        self.stream.abort.assert_called_once_with()
+        self.vol.delete.assert_called_once_with(0)
+        self.cb.assert_called_once_with('', False)
+        self.assertNotIn(self.vol.path(), upload_volumes)
+
+    @mock.patch('wok.plugins.kimchi.model.storagevolumes.get_pool_refresher')
+    @mock.patch('wok.plugins.kimchi.model.storagevolumes.time.monotonic')
+    def test_reap_stale_uploads(self, mock_monotonic, mock_refresher):
+        upload = self.vol_data['upload'] = mock.Mock()
+        fresh = dict(self.vol_data, cb=mock.Mock(), upload=mock.Mock(),
+                     lock=threading.Lock(), last=100)
+        upload_volumes['/var/lib/libvirt/images/fresh.img'] = fresh
+        vir_conn = self.model.conn.get.return_value
+        mock_monotonic.return_value = 100
+
+        reap_stale_uploads(self.model.conn, timeout=60)
+
+        # the idle upload is aborted and its volume deleted
+        upload.abort.assert_called_once_with()
+        self.cb.assert_called_once_with(mock.ANY, False)
+        vir_conn.storageVolLookupByPath.assert_called_once_with(
+            self.vol.path())
+        vir_conn.storageVolLookupByPath.return_value.delete.assert_called_once_with(0)
+        self.assertEqual(
+            ['/var/lib/libvirt/images/fresh.img'], list(upload_volumes))
+        fresh['upload'].abort.assert_not_called()
+        fresh['cb'].assert_not_called()
+
+    @mock.patch('wok.plugins.kimchi.model.storagevolumes.StorageVolumeModel'
+                '.get_storagevolume')
+    def test_chunk_of_aborted_upload(self, mock_get_vol):
+        mock_get_vol.return_value = self.vol
+        self.model.doUpload = mock.Mock()
+        # the upload is reaped while the chunk waits for the lock
+        self.vol_data['lock'] = mock.MagicMock()
+        self.vol_data['lock'].__enter__.side_effect = (
+            lambda *args: upload_volumes.clear()
+        )
+
+        self.assertRaises(
+            OperationFailed, self.model.update, 'default', 'upload.img',
+            {'chunk': b'0123456789', 'chunk_size': '10'}
+        )
+        self.model.doUpload.assert_not_called()
@@ -0,0 +1,127 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import unittest
+
+import mock
+from wok.exception import InvalidParameter
+from wok.exception import OperationFailed
+from wok.plugins.kimchi.model.utils import get_vm_names
+from wok.plugins.kimchi.model.vms import VMsModel
+
+
+POOL_URI = '/plugins/kimchi/storagepools/default'
+
+
+class VMNamesTests(unittest.TestCase):
+    def test_free_names(self):
+        self.assertEqual(['ci-1', 'ci-2'], get_vm_names('ci', 2, []))
+        self.assertEqual(
+            ['ci-2', 'ci-4', 'ci-5'],
+            get_vm_names('ci', 3, ['ci-1', 'ci-3', 'other-2'])
+        )
+
+
+@mock.patch('wok.plugins.kimchi.model.vms.get_pool_refresher')
+@mock.patch('wok.plugins.kimchi.model.vms.get_domain_inventory')
+@mock.patch('wok.plugins.kimchi.model.vms.set_metadata_node')
+class VMsBatchCreateTests(unittest.TestCase):
+    def setUp(self):
+        with mock.patch('wok.plugins.kimchi.model.vms.CapabilitiesModel'), \
+                mock.patch('wok.plugins.kimchi.model.vms.TaskModel'):
+            self.conn = mock.Mock()
+            self.model = VMsModel(conn=self.conn, objstore=mock.MagicMock())
+
+        self.template = mock.Mock()
+        self.template.info = {'os_distro': 'fedora', 'os_version': '25'}
+        self.template.to_volume_list.side_effect = lambda vm_uuid: [{
+            'pool': POOL_URI,
+            'path': f'/var/lib/libvirt/images/{vm_uuid}-0.img',
+        }]
+        self.template.to_vm_xml.side_effect = (
+            lambda name, vm_uuid, **kwargs: f'<domain>{name}</domain>'
+        )
+        self.vir_conn = self.conn.get.return_value
+        self.doms = {}
+        self.vir_conn.defineXML.side_effect = self._define
+
+    def _define(self, xml):
+        return self.doms.setdefault(xml, mock.Mock())
+
+    def test_name_with_count(self, *args):
+        self.assertRaises(
+            InvalidParameter,
+            self.model.create,
+            {'template': '/plugins/kimchi/templates/t', 'name': 'vm',
+             'count': 2}
+        )
+
+    def test_create_batch(self, mock_metadata, mock_inventory,
+                          mock_refresher):
+        cb = mock.Mock()
+        names = ['ci-1', 'ci-2', 'ci-3']
+        self.model._create_batch_task(
+            cb, {'names': names, 'template': self.template})
+
+        self.assertEqual(3, self.template.provision_volume.call_count)
+        self.assertEqual(3, self.vir_conn.defineXML.call_count)
+        self.assertEqual(3, mock_metadata.call_count)
+        self.assertEqual(
+            sorted(f'<domain>{name}</domain>' for name in names),
+            sorted(self.doms)
+        )
+        for dom in self.doms.values():
+            dom.undefine.assert_not_called()
+        self.vir_conn.storageVolLookupByPath.assert_not_called()
+
+        mock_refresher.return_value.invalidate.assert_called_with('default')
+        mock_inventory.return_value.invalidate.assert_called_with()
+        self.assertIn(mock.call('OK', True), cb.call_args_list)
+        progress = [c[0][0] for c in cb.call_args_list
+                    if c[0][0].startswith('Created VM')]
+        self.assertEqual(3, len(progress))
+        self.assertTrue(progress[-1].endswith('(3/3)'))
+
+    def test_create_batch_rollback(self, mock_metadata, mock_inventory,
+                                   mock_refresher):
+        failing = []
+
+        def _provision(vol):
+            if not failing:
+                failing.append(vol['path'])
+                raise OperationFailed('KCHVMSTOR0008E', {'error': 'full'})
+
+        self.template.provision_volume.side_effect = _provision
+        cb = mock.Mock()
+        self.assertRaises(
+            OperationFailed,
+            self.model._create_batch_task,
+            cb,
+            {'names': ['ci-1', 'ci-2', 'ci-3', 'ci-4'],
+             'template': self.template},
+        )
+
+        # the VMs created before the failure are removed with their volumes
+        for dom in self.doms.values():
+            dom.undefine.assert_called_once_with()
+        deleted = [c[0][0] for c in
+                   self.vir_conn.storageVolLookupByPath.call_args_list]
+        self.assertEqual(len(self.doms), len(deleted))
+        self.assertNotIn(failing[0], deleted)
+        self.assertNotIn(mock.call('OK', True), cb.call_args_list)
+        mock_inventory.return_value.invalidate.assert_called_with()
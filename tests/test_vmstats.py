@@ -0,0 +1,115 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import unittest
+
+import mock
+from wok.plugins.kimchi.model.vmstats import get_vm_stats_sampler
+from wok.plugins.kimchi.model.vmstats import StatsRingBuffer
+from wok.plugins.kimchi.model.vmstats import VMStatsSampler
+
+
+class StatsRingBufferTests(unittest.TestCase):
+    def test_empty_buffer(self):
+        buf = StatsRingBuffer(3)
+        self.assertEqual(0, len(buf))
+        self.assertIsNone(buf.last())
+        self.assertEqual([], buf.samples())
+        self.assertEqual(0.0, buf.peak('cpu'))
+
+    def test_buffer_wraps_around(self):
+        buf = StatsRingBuffer(3)
+        for i in range(5):
+            buf.append((i, i * 10, 0, i, 0))
+
+        self.assertEqual(3, len(buf))
+        self.assertEqual(4, buf.last()['timestamp'])
+        self.assertEqual([2, 3, 4], [s['timestamp'] for s in buf.samples()])
+        self.assertEqual(40, buf.peak('cpu'))
+        self.assertEqual(4, buf.peak('net_io'))
+
+
+class VMStatsSamplerTests(unittest.TestCase):
+    def _record(self, cputime, rx_bytes, rd_bytes):
+        return {
+            'state.state': 1,
+            'vcpu.current': 2,
+            'cpu.time': cputime,
+            'balloon.current': 1024,
+            'balloon.rss': 256,
+            'net.count': 1,
+            'net.0.rx.bytes': rx_bytes,
+            'net.0.tx.bytes': 0,
+            'block.count': 1,
+            'block.0.rd.bytes': rd_bytes,
+            'block.0.wr.bytes': 0,
+        }
+
+    @mock.patch('wok.plugins.kimchi.model.vmstats.time.monotonic')
+    def test_rates_between_samples(self, mock_monotonic):
+        sampler = VMStatsSampler(None, interval=5, history=10)
+
+        mock_monotonic.return_value = 100
+        sampler._add_sample('uuid', self._record(0, 0, 0))
+        # rates need two samples
+        self.assertEqual([], sampler.get_history('uuid'))
+        self.assertEqual(0, sampler.get_stats('uuid')['cpu_utilization'])
+
+        # 10s later: 1 vCPU fully used out of 2, 500 KB/s, 1000 KiB/s
+        mock_monotonic.return_value = 110
+        sampler._add_sample(
+            'uuid', self._record(10 * 10 ** 9, 5000 * 1000, 10000 * 1024)
+        )
+        stats = sampler.get_stats('uuid')
+        self.assertEqual(50.0, stats['cpu_utilization'])
+        self.assertEqual(25.0, stats['mem_utilization'])
+        self.assertEqual(500.0, stats['net_throughput'])
+        self.assertEqual(500, stats['net_throughput_peak'])
+        self.assertEqual(1000.0, stats['io_throughput'])
+        self.assertEqual(1000, stats['io_throughput_peak'])
+        self.assertEqual(1, len(sampler.get_history('uuid')))
+
+    def test_unknown_vm(self):
+        sampler = VMStatsSampler(None)
+        stats = sampler.get_stats('unknown')
+        self.assertEqual(0, stats['cpu_utilization'])
+        self.assertEqual(100, stats['net_throughput_peak'])
+        self.assertEqual(100, stats['io_throughput_peak'])
+        self.assertEqual([], sampler.get_history('unknown'))
+
+    def test_shared_by_connection(self):
+        conn = mock.Mock(uri='qemu:///test-vmstats')
+        other = mock.Mock(uri='qemu:///test-vmstats')
+        sampler = get_vm_stats_sampler(conn)
+        self.assertIs(sampler, get_vm_stats_sampler(other))
+        self.assertIsNot(
+            sampler, get_vm_stats_sampler(mock.Mock(uri='test:///default')))
+
+    @mock.patch('wok.plugins.kimchi.model.vmstats.cherrypy')
+    def test_single_thread(self, mock_cherrypy):
+        sampler = VMStatsSampler(None, interval=5)
+        sampler.start()
+        sampler.start()
+        mock_cherrypy.process.plugins.BackgroundTask.assert_called_once_with(
+            5, sampler._sample)
+        thread = sampler.sampler_thread
+        thread.start.assert_called_once_with()
+
+        sampler.stop()
+        sampler.stop()
+        thread.cancel.assert_called_once_with()
@@ -409,7 +409,7 @@ var kimchi = {
 
     listVMs : function(suc, err) {
         wok.requestJSON({
-            url : 'plugins/kimchi/vms',
+            url : 'plugins/kimchi/vms?_full=1',
             type : 'GET',
             contentType : 'application/json',
             headers: {'Wok-Robot': 'wok-robot'},
@@ -23,8 +23,10 @@ import os
 import re
 import sqlite3
 import stat
+import threading
 import time
 import urllib
+from collections import OrderedDict
 from http.client import HTTPConnection
 from http.client import HTTPException
 
@@ -261,6 +263,104 @@ def get_next_clone_name(all_names, basename, name_suffix='', ts=False):
     return new_name
 
 
+class TTLCache(object):
+    """
+    Cache of the value returned by <load>, loaded again after <ttl> seconds
+    or after invalidate(). Concurrent readers of an outdated cache share a
+    single load.
+    """
+
+    def __init__(self, load, ttl):
+        self.load = load
+        self.ttl = ttl
+        self._value = None
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._loaded = None
+
+    def get(self, refresh=False):
+        """
+        Return the cached value, loaded again when outdated or when <refresh>
+        is True.
+        """
+        with self._lock:
+            if (
+                refresh or self._loaded is None or
+                time.monotonic() - self._loaded >= self.ttl
+            ):
+                self._value = self.load()
+                self._loaded = time.monotonic()
+            return self._value
+
+
+class FileCache(object):
+    """
+    LRU cache of the values computed from files, keyed by the real path of the
+    file and its stat signature (device, inode, size and modification time),
+    so a file is only read again when it changes.
+
+    Only regular files are cached: the content of block devices and remote
+    files may change without their stat signature changing.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_key(path):
+        try:
+            path = os.path.realpath(path)
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return (path, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, path, load):
+        """
+        Return the value cached for the file <path>, computed by load(path)
+        when the file is not cached or changed. None values are not cached.
+        """
+        key = self._get_key(path)
+        if key is not None:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    return self._entries[key]
+
+        value = load(path)
+        if key is None or value is None:
+            return value
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, path=None):
+        """
+        Drop the value of the file <path> or all of them when <path> is None.
+        """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                return
+
+            path = os.path.realpath(path)
+            for key in [k for k in self._entries if k[0] == path]:
+                del self._entries[key]
+
+
 def is_libvirtd_up():
     """
     Checks if libvirt is up.
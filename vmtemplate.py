@@ -32,7 +32,7 @@ from wok.exception import MissingParameter
 from wok.exception import OperationFailed
 from wok.plugins.kimchi import imageinfo
 from wok.plugins.kimchi import osinfo
-from wok.plugins.kimchi.isoinfo import IsoImage
+from wok.plugins.kimchi.isoinfo import probe_one
 from wok.plugins.kimchi.utils import check_url_path
 from wok.plugins.kimchi.utils import is_s390x
 from wok.plugins.kimchi.utils import pool_name_from_uri
@@ -222,8 +222,7 @@ class VMTemplate(object):
         if len(list(filter(iso.startswith, iso_prefixes))) == 0:
             raise InvalidParameter('KCHTMPL0006E', {'param': iso})
         try:
-            iso_img = IsoImage(iso)
-            return iso_img.probe()
+            return probe_one(iso)
         except IsoFormatError:
             raise InvalidParameter('KCHISO0001E', {'filename': iso})
 
@@ -139,12 +139,17 @@ def _get_disk_type(path):
     raise InvalidParameter('KCHVMSTOR0003E', {'value': path})
 
 
-def get_device_node(dom, dev_name):
+def get_device_node(dom, dev_name, root=None):
+    """
+    Return the <disk> node of the device <dev_name>.
+    The inactive XML of the domain is used unless an already parsed domain XML
+    is given in <root>.
+    """
     import libvirt
 
-    xml = dom.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-    devices = objectify.fromstring(xml).devices
-    disk = devices.xpath("./disk/target[@dev='%s']/.." % dev_name)
+    if root is None:
+        root = objectify.fromstring(dom.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE))
+    disk = root.xpath("./devices/disk/target[@dev='%s']/.." % dev_name)
     if not disk:
         raise NotFoundError(
             'KCHVMSTOR0007E', {'dev_name': dev_name, 'vm_name': dom.name()}
@@ -153,18 +158,26 @@ def get_device_node(dom, dev_name):
     return disk[0]
 
 
-def get_vm_disk_info(dom, dev_name):
+def get_vm_disk_info(dom, dev_name, root=None):
     # Retrieve disk xml and format return dict
-    disk = get_device_node(dom, dev_name)
+    disk = get_device_node(dom, dev_name, root)
     if disk is None:
         return None
 
+    return get_disk_info(disk)
+
+
+def get_disk_info(disk):
+    """
+    Return the description of a <disk> node of a domain XML.
+    """
+    path = ''
     try:
-        source = disk.source
+        source = disk.find('source')
         if source is not None:
             src_type = disk.attrib['type']
             if src_type == 'network':
-                host = source.host
+                host = source.find('host')
                 path = (
                     source.attrib['protocol'] +
                     '://' +
@@ -178,23 +191,29 @@ def get_vm_disk_info(dom, dev_name):
     except Exception:
         path = ''
 
+    target = disk.find('target')
     return {
-        'dev': dev_name,
+        'dev': target.attrib['dev'],
         'path': path,
         'type': disk.attrib['device'],
-        'format': disk.driver.attrib['type'],
-        'bus': disk.target.attrib['bus'],
+        'format': disk.find('driver').attrib['type'],
+        'bus': target.attrib['bus'],
     }
 
 
-def get_vm_disks(dom):
-    xml = dom.XMLDesc(0)
-    devices = objectify.fromstring(xml).devices
+def get_vm_disks(dom, root=None):
+    """
+    Return a dict mapping the target of every disk and cdrom of the domain to
+    its bus. <root> may be an already parsed domain XML.
+    """
+    if root is None:
+        root = objectify.fromstring(dom.XMLDesc(0))
 
     storages = {}
-    all_disks = devices.xpath("./disk[@device='disk']")
-    all_disks.extend(devices.xpath("./disk[@device='cdrom']"))
+    all_disks = root.xpath("./devices/disk[@device='disk']")
+    all_disks.extend(root.xpath("./devices/disk[@device='cdrom']"))
     for disk in all_disks:
-        storages[disk.target.attrib['dev']] = disk.target.attrib['bus']
+        target = disk.find('target')
+        storages[target.attrib['dev']] = target.attrib['bus']
 
     return storages